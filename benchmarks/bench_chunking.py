@@ -0,0 +1,75 @@
+"""
+Throughput of text normalization and chunking: the single-pass normalizer and
+chunker against the previous two regex passes and RecursiveCharacterTextSplitter.
+
+    python benchmarks/bench_chunking.py --megabytes 1 5 20
+
+The input imitates extracted PDF text: wrapped lines, blank lines between
+paragraphs and page-number lines. Both pipelines process the whole text as
+one buffer.
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(os.path.dirname(__file__))
+
+from synthetic_pdf import WORDS
+from text_chunker import normalize_text, text_chunker
+
+
+def synthetic_text(megabytes: float, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    lines = []
+    size = 0
+    while size < megabytes * 1024 * 1024:
+        line = " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 14)))
+        if rng.random() < 0.3:
+            line += "."
+        if rng.random() < 0.08:
+            line += "\n"  # paragraph break
+        if rng.random() < 0.02:
+            line += f"\n{rng.randint(1, 99)}"  # page number
+        lines.append(line)
+        size += len(line) + 1
+    return "\n".join(lines)
+
+
+def previous_pipeline(text: str):
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    text = re.sub(r'^\s*\w{1,2}\s*$', '', text, flags=re.MULTILINE)
+    text = re.sub(r'\s+', ' ', text, flags=re.MULTILINE).strip()
+    return RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100).split_text(text)
+
+
+def current_pipeline(text: str):
+    return text_chunker.split(normalize_text(text))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--megabytes", type=float, nargs="*", default=[1, 5, 20])
+    parser.add_argument("--repeat", type=int, default=3, help="best of this many runs is reported")
+    args = parser.parse_args()
+
+    print(f"{'MB':>6}{'pipeline':>10}{'seconds':>10}{'MB/s':>9}{'chunks':>9}{'mean len':>10}")
+    for megabytes in args.megabytes:
+        text = synthetic_text(megabytes)
+        for name, pipeline in (("previous", previous_pipeline), ("current", current_pipeline)):
+            best = None
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                chunks = pipeline(text)
+                seconds = time.perf_counter() - started
+                best = seconds if best is None else min(best, seconds)
+            mean = sum(map(len, chunks)) / len(chunks)
+            print(f"{megabytes:>6g}{name:>10}{best:>10.3f}{megabytes / best:>9.1f}{len(chunks):>9}{mean:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
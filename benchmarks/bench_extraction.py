@@ -0,0 +1,95 @@
+"""
+Peak RSS of PDF extraction and chunking as the page count grows.
+
+Each measurement runs in a fresh interpreter so peaks don't carry over:
+
+    python benchmarks/bench_extraction.py --pages 100 500 2000
+
+"stream" is the ingestion path (process_pdf_file writing pages to the content
+file, then chunking read_pages lazily). "buffered" is a copy of the extraction
+ingestion used before streaming, kept here as the reference: pypdf reads the
+whole file into memory, every parsed page stays in its object cache, and the
+text and chunk list are held in full.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT)
+sys.path.append(os.path.dirname(__file__))
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def extract_buffered(pdf_path: str) -> list:
+    from pypdf import PdfReader
+    from pdf_processor import preprocess_text, get_text_chunks
+
+    # Given a path, pypdf copies the whole document into a BytesIO
+    reader = PdfReader(pdf_path)
+    page_texts = [preprocess_text(page.extract_text() or "") for page in reader.pages]
+    text = "".join(page_texts)
+    return get_text_chunks(text)
+
+
+def run_child(mode: str, pdf_path: str) -> dict:
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    from pdf_processor import process_pdf_file, read_pages, iter_text_chunks
+
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    if mode == "stream":
+        with tempfile.TemporaryDirectory() as content_dir:
+            content_path = os.path.join(content_dir, "content.txt")
+            process_pdf_file(pdf_path, content_path)
+            chunks = sum(1 for _ in iter_text_chunks(read_pages(content_path)))
+    else:
+        chunks = len(extract_buffered(pdf_path))
+    return {
+        "mode": mode,
+        "chunks": chunks,
+        "seconds": round(time.perf_counter() - started, 2),
+        "peak_rss_growth_mb": round(peak_rss_mb() - baseline, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[100, 500, 2000])
+    parser.add_argument("--modes", nargs="+", default=["stream", "buffered"], choices=["stream", "buffered"])
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "PDF"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(*args.child)))
+        return
+
+    from synthetic_pdf import write_text_pdf
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for pages in args.pages:
+            pdf_path = os.path.join(workdir, f"{pages}.pdf")
+            write_text_pdf(pdf_path, pages)
+            for mode in args.modes:
+                output = subprocess.run(
+                    [sys.executable, __file__, "--child", mode, pdf_path],
+                    check=True, capture_output=True, text=True,
+                    env={**os.environ, "OCR_WORKERS": "1"},
+                ).stdout
+                result = {"pages": pages, "file_mb": round(os.path.getsize(pdf_path) / 2**20, 1), **json.loads(output.splitlines()[-1])}
+                results.append(result)
+                print(json.dumps(result), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Recall and latency of the compressed FAISS indexes against the flat baseline.
+
+    python benchmarks/bench_index.py --chunks 50000 --dimensions 768
+
+Vectors are drawn around random cluster centers in a low-dimensional
+subspace to resemble document embeddings. For every index type and search
+setting it reports recall@k against exact flat search, query latency
+percentiles, bytes per vector and build time. --output writes the rows as JSON.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import faiss
+import numpy as np
+from index_factory import FLAT, IVFPQ, HNSWSQ, build_index, flat_index, index_bytes
+
+
+def clustered_vectors(count: int, dimensions: int, clusters: int, rng, latent: int = 64) -> np.ndarray:
+    """
+    Unit vectors around cluster centers in a low-dimensional subspace, plus a
+    little noise in every dimension: text embeddings have a much lower
+    intrinsic dimension than their length, which isotropic noise would hide.
+    """
+    centers = rng.normal(size=(clusters, latent))
+    points = centers[rng.integers(0, clusters, count)] + rng.normal(scale=0.5, size=(count, latent))
+    vectors = points @ rng.normal(size=(latent, dimensions)) + rng.normal(scale=0.5, size=(count, dimensions))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def measure(index, queries: np.ndarray, truth: np.ndarray, k: int) -> dict:
+    latencies = []
+    found = []
+    for query in queries:
+        started = time.perf_counter()
+        _, positions = index.search(query[None, :], k)
+        latencies.append(time.perf_counter() - started)
+        found.append(positions[0])
+    recall = np.mean([len(set(row) & set(expected)) / k for row, expected in zip(found, truth)])
+    latencies = np.asarray(latencies) * 1000
+    return {
+        "recall": round(float(recall), 4),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=50000)
+    parser.add_argument("--dimensions", type=int, default=768)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("-k", type=int, default=20, help="neighbours per query, as fetch_k in retrieval")
+    parser.add_argument("--nprobe", type=int, nargs="*", default=[4, 8, 16, 32, 64])
+    parser.add_argument("--ef-search", type=int, nargs="*", default=[16, 32, 64, 128])
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = clustered_vectors(args.chunks + args.queries, args.dimensions, args.clusters, rng)
+    corpus, queries = vectors[:args.chunks], vectors[args.chunks:]
+
+    started = time.perf_counter()
+    flat = flat_index(corpus, args.dimensions)
+    flat_build = time.perf_counter() - started
+    _, truth = flat.search(queries, args.k)
+
+    rows = [{"type": FLAT, "setting": "", "bytes_per_vector": index_bytes(flat) / args.chunks,
+             "build_s": round(flat_build, 2), **measure(flat, queries, truth, args.k)}]
+
+    # Force compression regardless of the configured threshold
+    import index_factory
+    index_factory.INDEX_COMPRESS_MIN_CHUNKS = 0
+    for index_type, settings in ((IVFPQ, args.nprobe), (HNSWSQ, args.ef_search)):
+        started = time.perf_counter()
+        index, params = build_index(flat, index_type)
+        build = time.perf_counter() - started
+        if params["type"] != index_type:
+            print(f"{index_type}: too few chunks to train, skipped")
+            continue
+        for setting in settings:
+            if index_type == IVFPQ:
+                index.nprobe = setting
+                label = f"nprobe={setting}"
+            else:
+                index.hnsw.efSearch = setting
+                label = f"efSearch={setting}"
+            rows.append({"type": params["factory"], "setting": label, "bytes_per_vector": index_bytes(index) / args.chunks,
+                         "build_s": round(build, 2), **measure(index, queries, truth, args.k)})
+
+    print(f"{args.chunks} vectors x {args.dimensions} dimensions, recall@{args.k} against flat search")
+    print(f"{'index':<18}{'setting':<14}{'recall':>8}{'p50 ms':>9}{'p95 ms':>9}{'B/vector':>10}{'build s':>9}")
+    for row in rows:
+        print(f"{row['type']:<18}{row['setting']:<14}{row['recall']:>8.3f}{row['p50_ms']:>9.3f}{row['p95_ms']:>9.3f}"
+              f"{row['bytes_per_vector']:>10.1f}{row['build_s']:>9.2f}")
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"parameters": vars(args), "faiss": faiss.__version__, "rows": rows}, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
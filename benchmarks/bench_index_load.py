@@ -0,0 +1,87 @@
+"""
+Cold-start load time and memory of a document index, by index size: the
+memory-mapped format (load_store) against FAISS.save_local/load_local.
+
+    python benchmarks/bench_index_load.py --chunks 10000 100000 500000
+
+Each load runs in a fresh process, which reports the time to open the index
+and to answer a first query, and the growth of its anonymous (private)
+memory. Mapped pages are file-backed and shared through the page cache, so
+they don't show up there.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+def anonymous_mb() -> float:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("RssAnon:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def build(directory: str, chunks: int, dimensions: int):
+    import numpy as np
+    from langchain_community.vectorstores import FAISS
+    from index_store import save_store
+
+    rng = np.random.default_rng(0)
+    vectors = rng.random((chunks, dimensions), dtype=np.float32)
+    texts = [f"Chunk {position} " + "lorem ipsum " * 80 for position in range(chunks)]
+    store = FAISS.from_embeddings(list(zip(texts, vectors.tolist())), embedding=None)
+    save_store(store, os.path.join(directory, "mapped"))
+    store.save_local(os.path.join(directory, "legacy"))
+
+
+def measure(directory: str, layout: str, dimensions: int):
+    import numpy as np
+    from langchain_community.vectorstores import FAISS
+    from index_store import load_store
+
+    query = np.random.default_rng(1).random(dimensions, dtype=np.float32).tolist()
+    before = anonymous_mb()
+    started = time.perf_counter()
+    if layout == "mapped":
+        store = load_store(os.path.join(directory, layout), None)
+    else:
+        store = FAISS.load_local(os.path.join(directory, layout), None, allow_dangerous_deserialization=True)
+    loaded = time.perf_counter() - started
+    store.similarity_search_with_score_by_vector(query, k=20)
+    first_query = time.perf_counter() - started - loaded
+    print(json.dumps({"load_ms": round(loaded * 1000, 1), "first_query_ms": round(first_query * 1000, 1),
+                      "anon_mb": round(anonymous_mb() - before, 1)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, nargs="*", default=[10000, 100000])
+    parser.add_argument("--dimensions", type=int, default=768)
+    parser.add_argument("--measure", nargs=2, metavar=("DIRECTORY", "LAYOUT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        measure(*args.measure, args.dimensions)
+        return
+
+    print(f"{'chunks':>8}{'layout':>8}{'load ms':>10}{'query ms':>10}{'anon MB':>9}")
+    for chunks in args.chunks:
+        with tempfile.TemporaryDirectory() as directory:
+            build(directory, chunks, args.dimensions)
+            for layout in ("legacy", "mapped"):
+                output = subprocess.run(
+                    [sys.executable, __file__, "--dimensions", str(args.dimensions), "--measure", directory, layout],
+                    capture_output=True, text=True, check=True,
+                ).stdout
+                row = json.loads(output.strip().splitlines()[-1])
+                print(f"{chunks:>8}{layout:>8}{row['load_ms']:>10.1f}{row['first_query_ms']:>10.1f}{row['anon_mb']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Cold start of a new API process: the time to import main, to run the
+startup hook (shared clients and INDEX_WARMUP_COUNT indexes), and the
+latency of the first and second chat requests, with and without warmup.
+
+    python benchmarks/bench_startup.py --documents 8 --pages 200 --warmup 0 4
+
+Every run is a fresh process against the same data directory, built once
+with the local providers. The first request asks about the most recently
+used document and the second about the next one, both of which warmup
+loads first.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT)
+sys.path.append(os.path.dirname(__file__))
+
+from synthetic_pdf import WORDS
+
+
+def environment(directory: str, warmup: int) -> dict:
+    return {
+        **os.environ,
+        "PROVIDER": "local",
+        "DATA_ROOT": directory,
+        "INDEX_ROOT": os.path.join(directory, "indexes"),
+        "REGISTRY_PATH": os.path.join(directory, "registry.db"),
+        "CONTENT_DIR": os.path.join(directory, "content"),
+        "UPLOAD_DIR": os.path.join(directory, "uploads"),
+        "INDEX_WARMUP_COUNT": str(warmup),
+    }
+
+
+def build(documents: int, pages: int):
+    from pdf_processor import get_vector_store
+
+    rng = random.Random(0)
+    for number in range(documents):
+        text = [(page, " ".join(rng.choice(WORDS) for _ in range(400))) for page in range(1, pages + 1)]
+        get_vector_store(text, f"doc-{number}")
+        # Later documents count as more recently used
+        time.sleep(0.01)
+
+
+def measure():
+    started = time.perf_counter()
+    import main
+    imported = time.perf_counter() - started
+
+    from fastapi.testclient import TestClient
+    from index_cache import recently_used_indexes
+
+    newest, older = recently_used_indexes(2)
+    started = time.perf_counter()
+    with TestClient(main.app) as client:
+        startup = time.perf_counter() - started
+        timings = []
+        for pdf_id, question in ((newest, "pump valve pressure"), (older, "bearing shaft seal")):
+            started = time.perf_counter()
+            response = client.post(f"/v1/chat/{pdf_id}", json={"message": question})
+            timings.append(time.perf_counter() - started)
+            assert response.status_code == 200, response.text
+    print(json.dumps({"import_ms": round(imported * 1000, 1), "startup_ms": round(startup * 1000, 1),
+                      "first_ms": round(timings[0] * 1000, 1), "second_ms": round(timings[1] * 1000, 1)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=8)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--warmup", type=int, nargs="*", default=[0, 4], help="INDEX_WARMUP_COUNT values to compare")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--measure", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--build", metavar="DIRECTORY", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        measure()
+        return
+    if args.build:
+        build(args.documents, args.pages)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Built in a child process, so the configuration comes from the same environment
+        subprocess.run([sys.executable, __file__, "--build", directory, "--documents", str(args.documents), "--pages", str(args.pages)],
+                       cwd=directory, env=environment(directory, 0), check=True, capture_output=True)
+        print(f"{'warmup':>7}{'import ms':>11}{'startup ms':>12}{'first ms':>10}{'second ms':>11}")
+        for warmup in args.warmup:
+            for _ in range(args.runs):
+                output = subprocess.run([sys.executable, __file__, "--measure"], cwd=directory, env=environment(directory, warmup),
+                                        capture_output=True, text=True, check=True).stdout
+                row = json.loads(output.strip().splitlines()[-1])
+                print(f"{warmup:>7}{row['import_ms']:>11.1f}{row['startup_ms']:>12.1f}{row['first_ms']:>10.1f}{row['second_ms']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
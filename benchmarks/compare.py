@@ -0,0 +1,97 @@
+"""
+Compare two run_benchmarks.py result files and flag regressions.
+
+    python benchmarks/compare.py baseline.json current.json --threshold 20
+
+Prints every numeric metric with its change. Exits with status 1 if any
+metric got worse by more than --threshold percent, so it can gate CI:
+latencies, durations and memory (keys ending in _ms, seconds, rss_mb or
+bytes) by growing, throughputs (keys ending in _per_s) by dropping.
+"""
+import sys
+import json
+import argparse
+
+# Metrics where larger is worse, and where smaller is worse
+HIGHER_IS_WORSE = ("_ms", "seconds", "rss_mb", "bytes")
+LOWER_IS_WORSE = ("_per_s",)
+# Keys describing the run rather than measuring it
+SKIPPED_KEYS = {"parameters", "commit", "created", "python", "platform", "cpu_count", "pages", "count", "concurrency"}
+
+
+def _document_key(document: dict) -> str:
+    return f"{document.get('kind')}-{document.get('pages')}"
+
+
+def flatten(result, prefix: str = "") -> dict:
+    """
+    Map dotted paths to the numeric leaves of a result; documents are keyed
+    by kind and page count so runs with different size lists line up.
+    """
+    metrics = {}
+    if isinstance(result, dict):
+        for key, value in result.items():
+            if key in SKIPPED_KEYS:
+                continue
+            if key == "documents" and isinstance(value, list):
+                for document in value:
+                    metrics.update(flatten(document, f"{prefix}{_document_key(document)}."))
+            else:
+                metrics.update(flatten(value, f"{prefix}{key}."))
+    elif isinstance(result, (int, float)) and not isinstance(result, bool):
+        metrics[prefix.rstrip(".")] = float(result)
+    return metrics
+
+
+def regressed(metric: str, change: float, threshold: float) -> bool:
+    """
+    Whether a change of change percent in metric is worse than threshold percent.
+    """
+    if metric.endswith(LOWER_IS_WORSE):
+        return -change > threshold
+    if metric.endswith(HIGHER_IS_WORSE):
+        return change > threshold
+    return False
+
+
+def compare(baseline: dict, current: dict, threshold: float):
+    """
+    Return (rows, regressions) where rows are (metric, baseline, current,
+    percent change) for metrics present in both runs.
+    """
+    before, after = flatten(baseline), flatten(current)
+    rows = []
+    regressions = []
+    for metric in sorted(before.keys() & after.keys()):
+        old, new = before[metric], after[metric]
+        change = (new - old) / old * 100 if old else 0.0
+        rows.append((metric, old, new, change))
+        if regressed(metric, change, threshold):
+            regressions.append(metric)
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=20.0, help="allowed regression in percent")
+    args = parser.parse_args()
+
+    with open(args.baseline) as baseline_file, open(args.current) as current_file:
+        baseline, current = json.load(baseline_file), json.load(current_file)
+
+    rows, regressions = compare(baseline, current, args.threshold)
+    width = max((len(metric) for metric, *_ in rows), default=10)
+    print(f"{'metric':<{width}}  {'baseline':>12}  {'current':>12}  {'change':>8}")
+    for metric, old, new, change in rows:
+        flag = "  REGRESSION" if metric in regressions else ""
+        print(f"{metric:<{width}}  {old:>12.3f}  {new:>12.3f}  {change:>+7.1f}%{flag}")
+    print(f"\nbaseline {baseline.get('commit', 'unknown')[:12]}, current {current.get('commit', 'unknown')[:12]}")
+    if regressions:
+        print(f"{len(regressions)} metric(s) worse by more than {args.threshold:g}%")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""
+End-to-end benchmark of ingestion and chat, written as JSON so runs can be
+compared between commits with benchmarks/compare.py.
+
+    python benchmarks/run_benchmarks.py --output benchmarks/results/$(git rev-parse --short HEAD).json
+
+Everything runs offline against the local providers (hashing embeddings and
+an echo model with --llm-latency seconds per answer). Stages:
+
+- extraction: process_pdf on text, scanned and mixed documents
+- ocr: extract_text_with_ocr per scanned page (skipped without tesseract/poppler)
+- chunking: get_text_chunks over the extracted text
+- embedding: batched local embeddings of the chunks
+- index_build / index_save / index_load: FAISS.from_embeddings, save_store, load_store (memory-mapped)
+- retrieval: hybrid scatter_gather_search over the saved index
+- api: concurrent POST /v1/pdf and POST /v1/chat/{pdf_id} through an ASGI client
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT)
+sys.path.append(os.path.dirname(__file__))
+
+from synthetic_pdf import WORDS, write_text_pdf, write_scanned_pdf, write_mixed_pdf
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def summarize(latencies, items: int = None, seconds: float = None) -> dict:
+    """
+    Latency percentiles in milliseconds plus throughput in items per second.
+    """
+    import numpy as np
+
+    values = np.asarray(latencies, dtype=float) * 1000
+    summary = {
+        "count": len(latencies),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+    if seconds:
+        summary["throughput_per_s"] = round((items or len(latencies)) / seconds, 2)
+    return summary
+
+
+def timed(function, *args, **kwargs):
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def random_questions(count: int, seed: int = 1):
+    rng = random.Random(seed)
+    return [
+        f"What does the manual say about {rng.choice(WORDS)} {rng.choice(WORDS)} for PN-{rng.randint(1, 2000):05d}?"
+        for _ in range(count)
+    ]
+
+
+def ocr_available() -> bool:
+    return bool(shutil.which("tesseract") and shutil.which("pdftoppm") and shutil.which("pdfinfo"))
+
+
+def bench_document(kind: str, pages: int, path: str, workdir: str, queries: int) -> dict:
+    """
+    Run every offline stage on one generated document.
+    """
+    from langchain_community.vectorstores import FAISS
+    from pdf_processor import process_pdf, get_text_chunks, extract_text_with_ocr
+    from embedding_client import BatchedEmbeddings, EmbeddingMetrics
+    from providers import create_embeddings, UnlimitedRate
+    from retrieval import scatter_gather_search
+    from lexical_index import BM25Index
+    from index_cache import index_path, index_cache
+    from index_store import load_store, save_store
+
+    result = {"kind": kind, "pages": pages, "file_mb": round(os.path.getsize(path) / 2**20, 2)}
+    if kind != "text" and not ocr_available():
+        result["skipped"] = "tesseract or poppler is not installed"
+        return result
+
+    if kind != "text":
+        scanned = [number for number in range(1, pages + 1) if kind == "scanned" or number % 5 == 0][:5]
+        latencies = []
+        with open(path, "rb") as pdf_file:
+            for number in scanned:
+                _, seconds = timed(extract_text_with_ocr, pdf_file, page_numbers=[number])
+                latencies.append(seconds)
+        result["ocr"] = summarize(latencies, seconds=sum(latencies))
+
+    with open(path, "rb") as pdf_file:
+        pdf_data, seconds = timed(process_pdf, pdf_file)
+    result["extraction"] = {"seconds": round(seconds, 3), "pages_per_s": round(pages / seconds, 2)}
+
+    chunks, seconds = timed(get_text_chunks, pdf_data["text"])
+    result["chunking"] = {"seconds": round(seconds, 3), "chunks": len(chunks)}
+    if not chunks:
+        return result
+
+    embeddings = create_embeddings()
+    batched = BatchedEmbeddings(embeddings, limiter=UnlimitedRate(), metrics=EmbeddingMetrics())
+    vectors, seconds = timed(batched.embed_documents, chunks)
+    result["embedding"] = {"seconds": round(seconds, 3), "chunks_per_s": round(len(chunks) / seconds, 2)}
+
+    ids = [f"{kind}-{pages}-{position}" for position in range(len(chunks))]
+    store, seconds = timed(FAISS.from_embeddings, list(zip(chunks, vectors)), embeddings, ids=ids)
+    result["index_build"] = {"seconds": round(seconds, 3)}
+
+    pdf_id = f"bench-{kind}-{pages}"
+    lexical = BM25Index()
+    lexical.add_many(zip(ids, chunks))
+    _, seconds = timed(save_store, store, index_path(pdf_id))
+    lexical.save(index_path(pdf_id))
+    result["index_save"] = {"seconds": round(seconds, 3)}
+
+    _, seconds = timed(load_store, index_path(pdf_id), embeddings)
+    result["index_load"] = {"seconds": round(seconds, 3)}
+
+    async def run_queries():
+        latencies = []
+        for question in random_questions(queries):
+            started = time.perf_counter()
+            query_vector = embeddings.embed_query(question)
+            await scatter_gather_search([pdf_id], embeddings, query_vector, k=4, query_text=question, fetch_k=20, mode="hybrid")
+            latencies.append(time.perf_counter() - started)
+        return latencies
+
+    started = time.perf_counter()
+    latencies = asyncio.run(run_queries())
+    result["retrieval"] = summarize(latencies, seconds=time.perf_counter() - started)
+    index_cache.invalidate(pdf_id)
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+async def bench_api(workdir: str, documents: int, pages: int, chats: int, concurrency: int) -> dict:
+    """
+    Drive the HTTP API concurrently: upload documents, then chat with them.
+    """
+    import httpx
+    from main import app
+
+    paths = []
+    for number in range(documents):
+        path = os.path.join(workdir, f"api-{number}.pdf")
+        # Distinct seeds so uploads aren't deduplicated by digest
+        write_text_pdf(path, pages, seed=1000 + number)
+        paths.append(path)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+        async def upload(path):
+            async with semaphore:
+                started = time.perf_counter()
+                with open(path, "rb") as pdf_file:
+                    response = await client.post("/v1/pdf", files={"file": (os.path.basename(path), pdf_file, "application/pdf")})
+                response.raise_for_status()
+                pdf_id = response.json()["pdf_id"]
+                while (await client.get(f"/v1/pdf/{pdf_id}")).json()["status"] not in ("ready", "failed"):
+                    await asyncio.sleep(0.05)
+                return pdf_id, time.perf_counter() - started
+
+        started = time.perf_counter()
+        uploads = await asyncio.gather(*(upload(path) for path in paths))
+        upload_seconds = time.perf_counter() - started
+        pdf_ids = [pdf_id for pdf_id, _ in uploads]
+
+        async def chat(question, pdf_id):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post(f"/v1/chat/{pdf_id}", json={"message": question})
+                response.raise_for_status()
+                return time.perf_counter() - started, response.json()["usage"]["prompt_tokens"]
+
+        questions = random_questions(chats, seed=7)
+        started = time.perf_counter()
+        chat_results = await asyncio.gather(*(chat(question, pdf_ids[index % len(pdf_ids)]) for index, question in enumerate(questions)))
+        chat_seconds = time.perf_counter() - started
+
+    prompt_tokens = [tokens for _, tokens in chat_results]
+    return {
+        "upload_to_ready": summarize([seconds for _, seconds in uploads], seconds=upload_seconds),
+        "chat": {
+            **summarize([seconds for seconds, _ in chat_results], seconds=chat_seconds),
+            "mean_prompt_tokens": round(sum(prompt_tokens) / len(prompt_tokens), 1),
+        },
+        "concurrency": concurrency,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--text-pages", type=int, nargs="*", default=[1, 100, 2000])
+    parser.add_argument("--scanned-pages", type=int, nargs="*", default=[1, 10])
+    parser.add_argument("--mixed-pages", type=int, nargs="*", default=[50])
+    parser.add_argument("--queries", type=int, default=200, help="retrieval queries per document")
+    parser.add_argument("--api-documents", type=int, default=4)
+    parser.add_argument("--api-pages", type=int, default=50)
+    parser.add_argument("--api-chats", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds per answer of the local model")
+    parser.add_argument("--output", default=os.path.join(os.path.dirname(__file__), "results", "latest.json"))
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="pdf-chat-bench-")
+    # Offline providers and throwaway storage; set before any service module is imported
+    os.environ.update({
+        "PROVIDER": "local",
+        "LOCAL_LLM_LATENCY": str(args.llm_latency),
+        "INDEX_ROOT": os.path.join(workdir, "indexes"),
+        "CONTENT_DIR": os.path.join(workdir, "content"),
+        "UPLOAD_DIR": os.path.join(workdir, "uploads"),
+        "REGISTRY_PATH": os.path.join(workdir, "registry.db"),
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.db"),
+    })
+
+    try:
+        documents = []
+        writers = {"text": write_text_pdf, "scanned": write_scanned_pdf, "mixed": write_mixed_pdf}
+        for kind, sizes in (("text", args.text_pages), ("scanned", args.scanned_pages), ("mixed", args.mixed_pages)):
+            for pages in sizes:
+                path = os.path.join(workdir, f"{kind}-{pages}.pdf")
+                writers[kind](path, pages)
+                result = bench_document(kind, pages, path, workdir, args.queries)
+                print(json.dumps(result), flush=True)
+                documents.append(result)
+
+        api = asyncio.run(bench_api(workdir, args.api_documents, args.api_pages, args.api_chats, args.concurrency))
+        print(json.dumps({"api": api}), flush=True)
+
+        report = {
+            "commit": git_commit(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "parameters": vars(args),
+            "documents": documents,
+            "api": api,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+        print(f"Results written to {args.output}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import random
+
+WORDS = (
+    "pump valve pressure sensor calibration torque flange gasket manual procedure "
+    "inspection safety warning maintenance interval assembly bearing shaft seal "
+    "the of and to in is for with on that by this be are as at from"
+).split()
+
+
+def _page_lines(rng: random.Random, page_number: int, lines: int):
+    yield f"Page {page_number} section {page_number % 17} part number PN-{page_number:05d}"
+    for _ in range(lines - 1):
+        yield " ".join(rng.choice(WORDS) for _ in range(12)) + "."
+
+
+def write_text_pdf(path: str, pages: int, lines_per_page: int = 40, seed: int = 0):
+    """
+    Write a PDF with pages of searchable text. Objects are streamed to disk, so
+    generating large documents needs little memory.
+    """
+    rng = random.Random(seed)
+    offsets = []
+
+    with open(path, "wb") as pdf:
+        def add_object(body: bytes):
+            offsets.append(pdf.tell())
+            pdf.write(f"{len(offsets)} 0 obj\n".encode() + body + b"\nendobj\n")
+
+        pdf.write(b"%PDF-1.4\n")
+        # 1: catalog, 2: page tree, 3: font; then a page and a content stream per page
+        add_object(b"<< /Type /Catalog /Pages 2 0 R >>")
+        kids = " ".join(f"{4 + 2 * index} 0 R" for index in range(pages))
+        add_object(f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>".encode())
+        add_object(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+        for index in range(pages):
+            page_id = 4 + 2 * index
+            add_object(
+                f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_id + 1} 0 R >>".encode()
+            )
+            text = ["BT /F1 9 Tf 40 760 Td 11 TL"]
+            for line in _page_lines(rng, index + 1, lines_per_page):
+                text.append(f"({line}) '")
+            text.append("ET")
+            stream = "\n".join(text).encode("latin-1")
+            add_object(f"<< /Length {len(stream)} >>\nstream\n".encode() + stream + b"\nendstream")
+
+        xref_offset = pdf.tell()
+        pdf.write(f"xref\n0 {len(offsets) + 1}\n0000000000 65535 f \n".encode())
+        for offset in offsets:
+            pdf.write(f"{offset:010d} 00000 n \n".encode())
+        pdf.write(f"trailer\n<< /Size {len(offsets) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+
+
+def write_scanned_pdf(path: str, pages: int, lines_per_page: int = 30, seed: int = 0, dpi: int = 100):
+    """
+    Write a PDF of image-only pages showing rendered text, like a scan without
+    a text layer. All page images are held in memory while saving.
+    """
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    width, height = int(8.5 * dpi), int(11 * dpi)
+    images = []
+    for index in range(pages):
+        image = Image.new("L", (width, height), 255)
+        draw = ImageDraw.Draw(image)
+        for line_number, line in enumerate(_page_lines(rng, index + 1, lines_per_page)):
+            draw.text((dpi // 2, dpi // 2 + line_number * 14), line, fill=0)
+        images.append(image)
+    images[0].save(path, "PDF", resolution=dpi, save_all=True, append_images=images[1:])
+
+
+def write_mixed_pdf(path: str, pages: int, scanned_every: int = 5, seed: int = 0):
+    """
+    Write a PDF where every scanned_every-th page is a scan and the rest have
+    a text layer.
+    """
+    import os
+    import tempfile
+    from pypdf import PdfReader, PdfWriter
+
+    scanned_pages = pages // scanned_every
+    with tempfile.TemporaryDirectory() as workdir:
+        text_path = os.path.join(workdir, "text.pdf")
+        scanned_path = os.path.join(workdir, "scanned.pdf")
+        write_text_pdf(text_path, pages - scanned_pages, seed=seed)
+        text_reader = PdfReader(text_path)
+        scanned_reader = None
+        if scanned_pages:
+            write_scanned_pdf(scanned_path, scanned_pages, seed=seed + 1)
+            scanned_reader = PdfReader(scanned_path)
+
+        writer = PdfWriter()
+        text_index = scanned_index = 0
+        for number in range(1, pages + 1):
+            if scanned_reader and number % scanned_every == 0 and scanned_index < scanned_pages:
+                writer.add_page(scanned_reader.pages[scanned_index])
+                scanned_index += 1
+            else:
+                writer.add_page(text_reader.pages[text_index])
+                text_index += 1
+        with open(path, "wb") as pdf:
+            writer.write(pdf)
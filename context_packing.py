@@ -0,0 +1,135 @@
+import os
+import re
+import math
+import logging
+from typing import List
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+# Most tokens of retrieved text sent to Gemini per answer
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "8000"))
+# Average characters per Gemini token, used to estimate counts without an API call
+CHARS_PER_TOKEN = float(os.getenv("CHARS_PER_TOKEN", "4"))
+# Word-shingle Jaccard similarity above which a chunk is dropped as a near duplicate
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.8"))
+# A chunk is only truncated to fit the budget if at least this many tokens of it remain
+MIN_PARTIAL_TOKENS = 50
+
+# The stuff-documents chain joins documents with a blank line
+DOCUMENT_SEPARATOR = "\n\n"
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def count_tokens(text: str) -> int:
+    """
+    Estimate the Gemini token count of text.
+    """
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _shingles(text: str, size: int = 3) -> set:
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _jaccard(first: set, second: set) -> float:
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+class PackedContext:
+    def __init__(self, docs: List[Document], context_tokens: int, dropped: int):
+        self.docs = docs
+        self.context_tokens = context_tokens
+        self.dropped = dropped
+
+
+class ContextPacker:
+    """
+    Assemble the context for one answer from ranked chunks: the overlap
+    between neighbouring chunks of a page is sent once, near-duplicate chunks
+    are skipped, and chunks are added best first until the token budget is
+    spent.
+    """
+    def __init__(self, token_budget: int = CONTEXT_TOKEN_BUDGET, near_duplicate_threshold: float = NEAR_DUPLICATE_THRESHOLD,
+                 count=count_tokens):
+        self.token_budget = token_budget
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self._count = count
+
+    @staticmethod
+    def _trim_overlap(doc: Document, covered: dict) -> Document:
+        """
+        Drop the parts of doc that an already packed chunk of the same page
+        covers, using the chunk offsets stored at indexing time.
+        """
+        metadata = doc.metadata
+        if metadata.get("page") is None or metadata.get("start_index") is None:
+            return doc
+        start, end = metadata["start_index"], metadata["end_index"]
+        for packed_start, packed_end in covered.get((metadata.get("pdf_id"), metadata["page"]), ()):
+            if packed_start <= start < packed_end:
+                start = packed_end
+            if packed_start < end <= packed_end:
+                end = packed_start
+        if start >= end:
+            return None
+        if (start, end) == (metadata["start_index"], metadata["end_index"]):
+            return doc
+        offset = start - metadata["start_index"]
+        text = doc.page_content[offset:offset + end - start]
+        return doc.model_copy(update={"page_content": text, "metadata": {**metadata, "start_index": start, "end_index": end}})
+
+    def _truncate(self, doc: Document, tokens: int) -> Document:
+        text = doc.page_content
+        # Cut at the estimated character position, then back to a word boundary
+        cut = int(len(text) * tokens / max(self._count(text), 1))
+        while cut > 0 and self._count(text[:cut]) > tokens:
+            cut = int(cut * 0.9)
+        text = text[:cut].rsplit(" ", 1)[0]
+        metadata = dict(doc.metadata)
+        if metadata.get("start_index") is not None:
+            metadata["end_index"] = metadata["start_index"] + len(text)
+        return doc.model_copy(update={"page_content": text, "metadata": metadata})
+
+    def pack(self, docs: List[Document]) -> PackedContext:
+        packed = []
+        covered = {}
+        shingles = []
+        used = 0
+        dropped = 0
+        for doc in docs:
+            doc = self._trim_overlap(doc, covered)
+            if doc is None or not doc.page_content.strip():
+                dropped += 1
+                continue
+            doc_shingles = _shingles(doc.page_content)
+            if any(_jaccard(doc_shingles, other) >= self.near_duplicate_threshold for other in shingles):
+                dropped += 1
+                continue
+
+            separator = self._count(DOCUMENT_SEPARATOR) if packed else 0
+            tokens = self._count(doc.page_content) + separator
+            if used + tokens > self.token_budget:
+                remaining = self.token_budget - used - separator
+                if remaining < MIN_PARTIAL_TOKENS or packed and remaining < tokens // 2:
+                    dropped += 1
+                    continue
+                doc = self._truncate(doc, remaining)
+                tokens = self._count(doc.page_content) + separator
+
+            packed.append(doc)
+            shingles.append(doc_shingles)
+            used += tokens
+            metadata = doc.metadata
+            if metadata.get("page") is not None and metadata.get("start_index") is not None:
+                covered.setdefault((metadata.get("pdf_id"), metadata["page"]), []).append(
+                    (metadata["start_index"], metadata["end_index"]))
+        return PackedContext(packed, used, dropped)
+
+
+context_packer = ContextPacker()
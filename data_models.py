@@ -1,12 +1,64 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import Optional, List, Literal
+
+# Ingestion status of a PDF: pending -> parsing -> embedding -> ready | failed
+PENDING = "pending"
+PARSING = "parsing"
+EMBEDDING = "embedding"
+READY = "ready"
+FAILED = "failed"
+
+# Retrieval modes: embedding similarity, BM25, or both fused by reciprocal rank
+VECTOR = "vector"
+LEXICAL = "lexical"
+HYBRID = "hybrid"
+
 class PDF_File(BaseModel):
     pdf_id: str
     file_name: str
     size: int
-    content: str
-    metadata: str
-    page_count: int
+    metadata: str = "{}"
+    page_count: int = 0
+    digest: Optional[str] = None
+    status: str = PENDING
+    pages_parsed: int = 0
+    chunks_total: int = 0
+    chunks_embedded: int = 0
+    error: Optional[str] = None
 
-class Query(BaseModel):
+class RetrievalQuery(BaseModel):
     message: str
+    k: int = Field(4, ge=1, le=50)
+    fetch_k: int = Field(20, ge=1, le=200)
+    mode: Literal["hybrid", "vector", "lexical"] = HYBRID
+    mmr: bool = False
+
+class Query(RetrievalQuery):
+    session_id: Optional[str] = None
+
+class Collection(BaseModel):
+    collection_id: str
+    name: str
+    pdf_ids: List[str]
 
+class CollectionCreate(BaseModel):
+    name: str
+    pdf_ids: List[str] = Field(..., min_length=1)
+
+class MultiQuery(RetrievalQuery):
+    pdf_ids: List[str] = []
+    collection_id: Optional[str] = None
+
+class ChatTurn(BaseModel):
+    question: str
+    answer: str
+    chunk_ids: List[str] = []
+    created: float
+
+class ChatSession(BaseModel):
+    session_id: str
+    pdf_id: str
+    created: float
+    # Questions of turns that have left the history window
+    summary: str = ""
+    turns: List[ChatTurn] = []
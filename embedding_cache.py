@@ -0,0 +1,122 @@
+import os
+import sqlite3
+import hashlib
+import threading
+import logging
+from array import array
+from typing import List
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.db")
+# SQLite limits the number of bound parameters per statement
+LOOKUP_BATCH_SIZE = 500
+
+
+def embedding_key(model_name: str, text: str) -> str:
+    """
+    Content address of an embedding: hash of the model name and the chunk text.
+    """
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+def file_digest(file_stream) -> str:
+    """
+    SHA-256 of a file stream's bytes. The stream is rewound afterwards.
+    """
+    file_stream.seek(0)
+    digest = hashlib.sha256()
+    for block in iter(lambda: file_stream.read(1024 * 1024), b""):
+        digest.update(block)
+    file_stream.seek(0)
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent SQLite store of float32 embeddings keyed by embedding_key.
+    """
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get_many(self, keys: List[str]) -> dict:
+        """
+        Look up embeddings for keys in batches. Missing keys are absent from the result.
+        """
+        found = {}
+        with self._lock:
+            conn = self._connection()
+            for start in range(0, len(keys), LOOKUP_BATCH_SIZE):
+                batch = keys[start:start + LOOKUP_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                )
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+        return found
+
+    def put_many(self, items: dict):
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, array("f", vector).tobytes()) for key, vector in items.items()],
+            )
+            conn.commit()
+
+
+embedding_cache = EmbeddingCache()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that only sends texts missing from the cache to the
+    underlying embedder. Query embeddings are not cached.
+    on_progress(count) is called with the number of texts served from the cache.
+    """
+    def __init__(self, embeddings: Embeddings, model_name: str, cache: EmbeddingCache = None, on_progress=None):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache or embedding_cache
+        self.on_progress = on_progress
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [embedding_key(self.model_name, text) for text in texts]
+        vectors = self.cache.get_many(list(dict.fromkeys(keys)))
+
+        # Embed each missing text once, even if it repeats within the batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        if self.on_progress:
+            self.on_progress(len(texts) - len(missing))
+        if missing:
+            new_vectors = self.embeddings.embed_documents(list(missing.values()))
+            fresh = dict(zip(missing.keys(), new_vectors))
+            self.cache.put_many(fresh)
+            vectors.update(fresh)
+
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+        logger.info(f"Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} misses.")
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
@@ -0,0 +1,196 @@
+import os
+import time
+import random
+import threading
+import logging
+from contextlib import contextmanager
+from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import httpx
+from google.api_core import exceptions as google_exceptions
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+# Texts per embedding request (the Gemini batch endpoint accepts up to 100)
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+# Embedding requests in flight at once, per document
+EMBED_MAX_IN_FLIGHT = int(os.getenv("EMBED_MAX_IN_FLIGHT", "4"))
+# Embedding requests per minute allowed across the whole process
+EMBED_REQUESTS_PER_MINUTE = float(os.getenv("EMBED_REQUESTS_PER_MINUTE", "1500"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "6"))
+# Backoff parameters in seconds
+EMBED_BACKOFF_BASE = 1.0
+EMBED_BACKOFF_MAX = 60.0
+
+RETRYABLE_STATUS_CODES = {429, 500, 503}
+RETRYABLE_GOOGLE_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. acquire() blocks until a token is available.
+    """
+    def __init__(self, rate_per_second: float, capacity: Optional[float] = None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate_per_second
+        self.capacity = capacity if capacity is not None else max(1.0, rate_per_second)
+        self.tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens: float = 1.0):
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            self._sleep(wait)
+
+
+class EmbeddingMetrics:
+    """
+    Process-wide embedding throughput counters. Throughput is measured over
+    the time at least one embed_documents call was running, so calls that
+    overlap, e.g. for documents ingested together, aren't counted twice.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.chunks = 0
+        self.requests = 0
+        self.retries = 0
+        self.seconds = 0.0
+        self._running = 0
+        self._busy_since = 0.0
+
+    def record(self, chunks: int = 0, requests: int = 0, retries: int = 0):
+        with self._lock:
+            self.chunks += chunks
+            self.requests += requests
+            self.retries += retries
+
+    @contextmanager
+    def busy(self):
+        with self._lock:
+            if not self._running:
+                self._busy_since = time.monotonic()
+            self._running += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._running -= 1
+                if not self._running:
+                    self.seconds += time.monotonic() - self._busy_since
+
+    def stats(self) -> dict:
+        with self._lock:
+            seconds = self.seconds + (time.monotonic() - self._busy_since if self._running else 0.0)
+            return {
+                "chunks": self.chunks,
+                "requests": self.requests,
+                "retries": self.retries,
+                "chunks_per_second": self.chunks / seconds if seconds else 0.0,
+            }
+
+
+rate_limiter = TokenBucket(EMBED_REQUESTS_PER_MINUTE / 60.0)
+embedding_metrics = EmbeddingMetrics()
+
+
+def retry_after(exc: Exception) -> Optional[float]:
+    """
+    Return how long to wait before retrying after exc: the Retry-After header
+    when present, 0 for other retryable errors, or None if exc is not retryable.
+    The exception chain is inspected because wrappers re-raise API errors.
+    """
+    while exc is not None:
+        response = getattr(exc, "response", None)
+        retryable = isinstance(exc, RETRYABLE_GOOGLE_ERRORS) or (
+            isinstance(exc, httpx.HTTPStatusError) and response.status_code in RETRYABLE_STATUS_CODES
+        )
+        if retryable:
+            headers = getattr(response, "headers", None) or {}
+            try:
+                return max(0.0, float(headers.get("Retry-After", 0)))
+            except (TypeError, ValueError):
+                return 0.0
+        exc = exc.__cause__ or exc.__context__
+    return None
+
+
+def backoff_delay(attempt: int, server_delay: float = 0.0) -> float:
+    """
+    Exponential backoff with full jitter, never shorter than the server's Retry-After.
+    """
+    ceiling = min(EMBED_BACKOFF_MAX, EMBED_BACKOFF_BASE * (2 ** attempt))
+    return max(server_delay, random.uniform(0, ceiling))
+
+
+class BatchedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that sends fixed-size batches with a bounded number of
+    requests in flight, throttled by a shared token bucket and retried on
+    rate limits. on_progress(count) is called as each batch completes.
+    """
+    def __init__(self, embeddings: Embeddings, batch_size: int = None, max_in_flight: int = None,
+                 limiter: TokenBucket = None, metrics: EmbeddingMetrics = None, on_progress=None, sleep=time.sleep):
+        self.embeddings = embeddings
+        self.batch_size = batch_size or EMBED_BATCH_SIZE
+        self.max_in_flight = max_in_flight or EMBED_MAX_IN_FLIGHT
+        self.limiter = limiter or rate_limiter
+        self.metrics = metrics or embedding_metrics
+        self.on_progress = on_progress
+        self._sleep = sleep
+
+    def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            try:
+                vectors = self.embeddings.embed_documents(batch)
+                self.metrics.record(requests=1)
+                return vectors
+            except Exception as e:
+                server_delay = retry_after(e)
+                if server_delay is None or attempt >= EMBED_MAX_RETRIES:
+                    raise
+                delay = backoff_delay(attempt, server_delay)
+                logger.warning(f"Embedding request rate limited, retrying in {delay:.1f}s (attempt {attempt + 1})")
+                self.metrics.record(requests=1, retries=1)
+                self._sleep(delay)
+                attempt += 1
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        batches = [texts[start:start + self.batch_size] for start in range(0, len(texts), self.batch_size)]
+        results = [None] * len(batches)
+
+        with self.metrics.busy(), ThreadPoolExecutor(max_workers=min(self.max_in_flight, len(batches))) as executor:
+            futures = {executor.submit(self._embed_batch, batch): position for position, batch in enumerate(batches)}
+            for future in as_completed(futures):
+                position = futures[future]
+                results[position] = future.result()
+                if self.on_progress:
+                    self.on_progress(len(batches[position]))
+
+        self.metrics.record(chunks=len(texts))
+        return [vector for batch_vectors in results for vector in batch_vectors]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.limiter.acquire()
+        return self.embeddings.embed_query(text)
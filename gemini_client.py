@@ -1,28 +1,14 @@
-import os
 from dotenv import load_dotenv
-import google.generativeai as genai
-import time
 import httpx
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.chains.question_answering import load_qa_chain
-from langchain.prompts import PromptTemplate
+from functools import lru_cache
+from providers import create_chat_model, create_embeddings
+from langchain_core.prompts import PromptTemplate
 from fastapi import HTTPException
-from langchain.chains.combine_documents.stuff import create_stuff_documents_chain
 
+# The Gemini clients read GOOGLE_API_KEY from the environment when they are built
 load_dotenv()
 
-# Retrieve API key
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-
-if not GOOGLE_API_KEY:
-    raise ValueError("Gemini API Key not found in environment variables. Ensure it is set in the .env file.")
-
-genai.configure(api_key=GOOGLE_API_KEY)
-
-
-
-def get_conversational_chain(retry_count=0, max_retries=5):
-    prompt_template="""
+PROMPT_TEMPLATE="""
     You are a PDF chat assistant. Your role is to analyze and extract relevant information from PDF documents and answer user queries accurately and concisely based on the content of the uploaded PDF. Follow these guidelines when responding:
 
     Understand the User Query:
@@ -48,24 +34,39 @@ def get_conversational_chain(retry_count=0, max_retries=5):
     Context:\n{context}\n
     Question: \n{question}\n
     """
-    #model = genai.GenerativeModel("gemini-1.5-flash", temperature=0.3)
-    try: 
-        model = ChatGoogleGenerativeAI(model="gemini-1.5-flash")
-        prompt = PromptTemplate(template=prompt_template, input_variables=["context", "question"])
 
 
-        #chain = load_qa_chain(model, chain_type="stuff", prompt=prompt)
+def get_conversational_chain():
+    """
+    Build the question answering chain. Building it makes no API calls;
+    concurrency limits and rate-limit retries apply to each call, in llm_gateway.
+    """
+    # langchain.chains takes about a second to import, so it is imported when the chain is built
+    from langchain.chains.combine_documents.stuff import create_stuff_documents_chain
+
+    try: 
+        model = create_chat_model()
+        prompt = PromptTemplate(template=PROMPT_TEMPLATE, input_variables=["context", "question"])
         chain = create_stuff_documents_chain(llm=model, prompt=prompt)
         return chain
-    except httpx.HTTPStatusError as e:
-        if e.response.status_code == 429 and retry_count < max_retries:
-            retry_after = int(e.response.headers.get("Retry-After", 1))
-            print(f"Rate limited. Retrying after {retry_after} seconds...")
-            time.sleep(retry_after)
-            return get_conversational_chain(retry_count=retry_count + 1, max_retries=max_retries)  # Retry after delay
-        else:
-            raise HTTPException(status_code=e.response.status_code, detail=f"Gemini API Error: {e.response.text}")
     except httpx.RequestError as e:
         raise HTTPException(status_code=504, detail=f"Timeout or connection error: {str(e)}")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+
+
+@lru_cache(maxsize=None)
+def get_shared_chain():
+    """
+    Conversational chain shared by all requests, so the model client and its
+    connections are created once per process instead of once per request.
+    """
+    return get_conversational_chain()
+
+
+@lru_cache(maxsize=None)
+def get_query_embeddings():
+    """
+    Embeddings client shared by all requests for embedding chat queries.
+    """
+    return create_embeddings()
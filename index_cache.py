@@ -0,0 +1,220 @@
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import Future
+from metrics import INDEX_LOAD, timed_stage
+from index_factory import configure_search, index_bytes
+from index_store import CHUNKS_FILE, MANIFEST_FILE, VECTORS_FILE, has_index, load_store
+
+logger = logging.getLogger(__name__)
+
+# Directory for the service's data on disk
+DATA_ROOT = os.getenv("DATA_ROOT", "data")
+# Directory holding the per-PDF index directories
+INDEX_ROOT = os.getenv("INDEX_ROOT", os.path.join(DATA_ROOT, "indexes"))
+# Upper bound for the resident FAISS indexes (default 512 MB)
+INDEX_CACHE_MAX_BYTES = int(os.getenv("INDEX_CACHE_MAX_MB", "512")) * 1024 * 1024
+# Seconds between updates of an index's last-use time on disk
+INDEX_USE_RECORD_INTERVAL = 60
+
+_last_recorded = {}
+
+
+def estimate_index_size(vector_store) -> int:
+    """
+    Approximate the resident size of a FAISS vector store in bytes. Mapped
+    vectors count too, so the cache bounds what a process maps; chunk texts
+    only count if they are held in memory.
+    """
+    size = index_bytes(vector_store.index)
+    for doc in getattr(vector_store.docstore, "_dict", {}).values():
+        size += len(doc.page_content)
+    return size
+
+
+class IndexCache:
+    """
+    Process-wide LRU cache of loaded vector stores keyed by pdf_id,
+    bounded by the estimated memory footprint of the cached indexes.
+    Entries can carry the version of the files they were loaded from, so
+    files rewritten by another worker are loaded again.
+    """
+    def __init__(self, max_bytes: int = INDEX_CACHE_MAX_BYTES, sizeof=estimate_index_size):
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._entries = OrderedDict()
+        # pdf_id -> count of invalidations, so loads that started before one aren't cached
+        self._generations = {}
+        # pdf_id -> (Future, version) of the load in flight, shared by concurrent misses of that version
+        self._loading = {}
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, pdf_id: str, loader, version=None):
+        """
+        Return the cached store for pdf_id, calling loader() on a miss or
+        when the cached store was loaded from another version of its files.
+        Concurrent misses for the same pdf_id wait for a single load.
+        """
+        with self._lock:
+            entry = self._entries.get(pdf_id)
+            if entry is not None and entry[2] == version:
+                self._entries.move_to_end(pdf_id)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[pdf_id]
+                self.current_bytes -= entry[1]
+                logger.debug(f"Index {pdf_id} changed on disk, loading it again.")
+            self.misses += 1
+            pending, pending_version = self._loading.get(pdf_id, (None, None))
+            if pending is None or pending_version != version:
+                pending = Future()
+                self._loading[pdf_id] = (pending, version)
+                generation = self._generations.get(pdf_id, 0)
+                loading = True
+            else:
+                loading = False
+
+        if not loading:
+            return pending.result()
+
+        # Load outside the lock so a cold index doesn't block warm lookups
+        try:
+            store = loader()
+        except BaseException as e:
+            self._finish_load(pdf_id, pending)
+            pending.set_exception(e)
+            raise
+        self.put(pdf_id, store, generation, version)
+        self._finish_load(pdf_id, pending)
+        pending.set_result(store)
+        return store
+
+    def _finish_load(self, pdf_id: str, pending: Future):
+        with self._lock:
+            if self._loading.get(pdf_id, (None,))[0] is pending:
+                del self._loading[pdf_id]
+
+    def put(self, pdf_id: str, store, generation: int = None, version=None):
+        """
+        Cache store for pdf_id, loaded from version of its files. With the
+        generation read when its load started, the store is dropped if
+        pdf_id was invalidated since.
+        """
+        size = self._sizeof(store)
+        with self._lock:
+            if generation is not None and generation != self._generations.get(pdf_id, 0):
+                logger.debug(f"Index {pdf_id} changed while it was loading, not caching.")
+                return
+            previous = self._entries.pop(pdf_id, None)
+            if previous is not None:
+                self.current_bytes -= previous[1]
+            if size > self.max_bytes:
+                logger.warning(f"Index {pdf_id} ({size} bytes) exceeds the cache limit, not caching.")
+                return
+            self._entries[pdf_id] = (store, size, version)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                evicted_id, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+                logger.debug(f"Evicted index {evicted_id} from cache.")
+
+    def invalidate(self, pdf_id: str):
+        with self._lock:
+            self._generations[pdf_id] = self._generations.get(pdf_id, 0) + 1
+            # Later misses load the new files instead of waiting for a load of the old ones
+            self._loading.pop(pdf_id, None)
+            entry = self._entries.pop(pdf_id, None)
+            if entry is not None:
+                self.current_bytes -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+index_cache = IndexCache()
+
+
+def index_path(pdf_id: str) -> str:
+    return os.path.join(INDEX_ROOT, pdf_id)
+
+
+def files_version(directory: str, names) -> tuple:
+    """
+    Identity of the named files in directory. Indexes are rewritten by
+    replacing their files, so any rewrite, by any process, changes it.
+    """
+    version = []
+    for name in names:
+        try:
+            stat = os.stat(os.path.join(directory, name))
+        except FileNotFoundError:
+            version.append(None)
+            continue
+        version.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+    return tuple(version)
+
+
+def record_use(pdf_id: str):
+    """
+    Stamp the index directory of pdf_id with the current time, at most once
+    a minute, so restarted processes know which indexes to warm up.
+    """
+    now = time.time()
+    if now - _last_recorded.get(pdf_id, 0) < INDEX_USE_RECORD_INTERVAL:
+        return
+    _last_recorded[pdf_id] = now
+    try:
+        os.utime(index_path(pdf_id))
+    except OSError as e:
+        logger.debug(f"Could not record use of index {pdf_id}: {e}")
+
+
+def recently_used_indexes(count: int) -> list:
+    """
+    Ids of the count indexes used most recently, newest first.
+    """
+    if count <= 0 or not os.path.isdir(INDEX_ROOT):
+        return []
+    with os.scandir(INDEX_ROOT) as entries:
+        used = [(entry.stat().st_mtime, entry.name) for entry in entries if entry.is_dir() and has_index(entry.path)]
+    return [pdf_id for _, pdf_id in sorted(used, reverse=True)[:count]]
+
+
+def load_index(pdf_id: str, embeddings, record: bool = True):
+    """
+    Return the vector store for pdf_id, mapping it from disk only on a cache
+    miss or after its files were rewritten, e.g. by an update in another worker.
+    Pass record=False for loads that aren't a use of the index, like warmup.
+    """
+    if record:
+        record_use(pdf_id)
+    version = files_version(index_path(pdf_id), (MANIFEST_FILE, VECTORS_FILE, CHUNKS_FILE))
+
+    def load():
+        with timed_stage(INDEX_LOAD):
+            store = load_store(index_path(pdf_id), embeddings)
+        configure_search(store.index)
+        return store
+
+    return index_cache.get(pdf_id, load, version)
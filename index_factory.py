@@ -0,0 +1,211 @@
+import os
+import json
+import math
+import time
+import logging
+import numpy as np
+# faiss is imported by the functions that use it, so importing this module doesn't load it
+
+logger = logging.getLogger(__name__)
+
+FLAT = "flat"
+IVFPQ = "ivfpq"
+HNSWSQ = "hnswsq"
+
+# Index used once a document has INDEX_COMPRESS_MIN_CHUNKS chunks: "ivfpq", "hnswsq", or "flat" to never compress
+INDEX_TYPE = os.getenv("INDEX_TYPE", IVFPQ)
+INDEX_COMPRESS_MIN_CHUNKS = int(os.getenv("INDEX_COMPRESS_MIN_CHUNKS", "20000"))
+# IVF-PQ: dimensions per 8-bit product quantizer code (768 dimensions -> 192 bytes per vector) and lists probed per query.
+# Fewer codes train much faster but lose recall; training only happens on upload, updates reuse it
+IVFPQ_SUBVECTOR_DIMS = int(os.getenv("IVFPQ_SUBVECTOR_DIMS", "4"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))
+# HNSW: graph degree, and candidate list sizes while building and searching
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "80"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+
+INDEX_PARAMS_FILE = "index_params.json"
+# k-means wants about 39 training points per centroid; PQ codebooks have 256 centroids
+POINTS_PER_CENTROID = 39
+PQ_CENTROIDS = 256
+
+
+def choose_index_type(chunks: int, index_type: str = None) -> str:
+    """
+    Flat for documents below the compression threshold, the configured
+    compressed index above it. IVF-PQ also needs enough chunks to train its
+    codebooks.
+    """
+    index_type = index_type or INDEX_TYPE
+    if index_type not in (FLAT, IVFPQ, HNSWSQ):
+        raise ValueError(f"Unknown index type: {index_type}")
+    if index_type == FLAT or chunks < INDEX_COMPRESS_MIN_CHUNKS:
+        return FLAT
+    if index_type == IVFPQ and chunks < PQ_CENTROIDS * POINTS_PER_CENTROID:
+        return FLAT
+    return index_type
+
+
+def ivfpq_layout(chunks: int, dimensions: int):
+    """
+    Number of inverted lists and PQ sub-quantizers for a document: about
+    4 * sqrt(chunks) lists, each with enough points to train, and as many
+    sub-quantizers as fit IVFPQ_SUBVECTOR_DIMS dimensions each and divide the
+    dimension count.
+    """
+    nlist = max(1, min(int(4 * math.sqrt(chunks)), chunks // POINTS_PER_CENTROID))
+    m = max(1, dimensions // IVFPQ_SUBVECTOR_DIMS)
+    while dimensions % m:
+        m -= 1
+    return nlist, m
+
+
+def factory_string(index_type: str, chunks: int, dimensions: int) -> str:
+    if index_type == IVFPQ:
+        nlist, m = ivfpq_layout(chunks, dimensions)
+        # "np" skips polysemous training, which only helps Hamming-distance search
+        return f"IVF{nlist},PQ{m}np"
+    if index_type == HNSWSQ:
+        return f"HNSW{HNSW_M},SQ8"
+    return "Flat"
+
+
+def configure_search(index):
+    """
+    Apply the query-time parameters, which FAISS doesn't save with the index.
+    """
+    import faiss
+
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = IVF_NPROBE
+    elif isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    return index
+
+
+def build_index(flat_index, index_type: str = None):
+    """
+    Return the index to save for a document built as a flat index, with the
+    parameters describing it. Large documents are moved into a trained
+    compressed index; the vectors keep their positions, so the docstore
+    mapping stays valid.
+    """
+    chunks, dimensions = flat_index.ntotal, flat_index.d
+    chosen = choose_index_type(chunks, index_type)
+    factory = factory_string(chosen, chunks, dimensions)
+    params = {"type": chosen, "factory": factory, "chunks": chunks, "dimensions": dimensions}
+    if chosen == FLAT:
+        return flat_index, params
+
+    import faiss
+
+    started = time.perf_counter()
+    vectors = flat_index.reconstruct_n(0, chunks)
+    index = faiss.index_factory(dimensions, factory, faiss.METRIC_L2)
+    if chosen == IVFPQ:
+        # Retrieval reads vectors back by position for MMR
+        index.train(vectors)
+        index.add(vectors)
+        index.make_direct_map()
+        params["nprobe"] = IVF_NPROBE
+    else:
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.train(vectors)
+        index.add(vectors)
+        params["ef_search"] = HNSW_EF_SEARCH
+    params["train_seconds"] = round(time.perf_counter() - started, 3)
+    params["bytes_per_vector"] = round(index_bytes(index) / chunks, 1)
+    logger.info(f"Compressed index of {chunks} chunks into {factory} ({params['bytes_per_vector']} bytes per vector).")
+    return configure_search(index), params
+
+
+def compact_index(index, keep):
+    """
+    The index with only the vectors at positions keep, renumbered in that
+    order, without training it again. IVF-PQ codes are copied between the
+    trained inverted lists as they are. HNSW graphs can't drop nodes, so the
+    kept vectors are decoded and added to an emptied copy, whose trained
+    scalar quantizer encodes them to the same codes.
+    """
+    import faiss
+
+    keep = np.asarray(keep, dtype=np.int64)
+    if isinstance(index, faiss.IndexIVF):
+        new_positions = np.full(index.ntotal, -1, dtype=np.int64)
+        new_positions[keep] = np.arange(len(keep), dtype=np.int64)
+        compacted = faiss.clone_index(index)
+        # The direct map is rebuilt from the lists once they are filled
+        compacted.make_direct_map(False)
+        compacted.reset()
+        invlists = index.invlists
+        for list_no in range(index.nlist):
+            size = invlists.list_size(list_no)
+            if not size:
+                continue
+            ids = new_positions[faiss.rev_swig_ptr(invlists.get_ids(list_no), size)]
+            codes = faiss.rev_swig_ptr(invlists.get_codes(list_no), size * invlists.code_size).reshape(size, invlists.code_size)
+            kept = ids >= 0
+            if kept.any():
+                kept_ids = np.ascontiguousarray(ids[kept])
+                kept_codes = np.ascontiguousarray(codes[kept])
+                compacted.invlists.add_entries(list_no, len(kept_ids), faiss.swig_ptr(kept_ids), faiss.swig_ptr(kept_codes))
+        compacted.ntotal = len(keep)
+        if index.direct_map.type != faiss.DirectMap.NoMap:
+            compacted.make_direct_map()
+        return configure_search(compacted)
+    if isinstance(index, (faiss.IndexHNSW, faiss.IndexFlat)):
+        vectors = index.reconstruct_n(0, index.ntotal)[keep]
+        compacted = faiss.clone_index(index)
+        compacted.reset()
+        if len(vectors):
+            compacted.add(vectors)
+        return configure_search(compacted)
+    raise ValueError(f"A {type(index).__name__} index can't be updated in place.")
+
+
+def is_flat(index) -> bool:
+    import faiss
+    return isinstance(index, faiss.IndexFlat)
+
+
+def flat_index(vectors, dimensions: int):
+    import faiss
+    index = faiss.IndexFlatL2(dimensions)
+    if len(vectors):
+        index.add(np.asarray(vectors, dtype=np.float32))
+    return index
+
+
+def index_bytes(index) -> int:
+    """
+    Approximate resident size of a FAISS index in bytes.
+    """
+    import faiss
+
+    if isinstance(index, faiss.IndexIVFPQ):
+        # Codes and ids in the inverted lists, plus the coarse centroids and codebooks
+        return index.ntotal * (index.pq.code_size + 8) + index.nlist * index.d * 4 + index.pq.M * PQ_CENTROIDS * index.pq.dsub * 4
+    if isinstance(index, faiss.IndexHNSW):
+        storage = faiss.downcast_index(index.storage)
+        return index.ntotal * (storage.code_size + index.hnsw.nb_neighbors(0) * 4)
+    return index.ntotal * index.d * 4  # float32 vectors
+
+
+def save_index_params(directory: str, params: dict):
+    # Swapped in whole, so readers never see a partly written file
+    path = os.path.join(directory, INDEX_PARAMS_FILE)
+    os.makedirs(directory, exist_ok=True)
+    with open(path + ".tmp", "w") as params_file:
+        json.dump({**params, "created": time.time()}, params_file, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def load_index_params(directory: str) -> dict:
+    """
+    Parameters recorded when the index was built; flat for indexes written before they were recorded.
+    """
+    path = os.path.join(directory, INDEX_PARAMS_FILE)
+    if not os.path.exists(path):
+        return {"type": FLAT}
+    with open(path) as params_file:
+        return json.load(params_file)
@@ -0,0 +1,339 @@
+import os
+import json
+import fcntl
+import shutil
+import sqlite3
+import logging
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+from collections.abc import Mapping
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional, Tuple, Union
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+# Bytes of each chunk database SQLite reads through mmap instead of its own page cache
+CHUNKS_MMAP_BYTES = int(os.getenv("CHUNKS_MMAP_MB", "256")) * 1024 * 1024
+
+# Names the current vectors file, a FAISS index, and chunks file, chunk texts and metadata in SQLite by position
+MANIFEST_FILE = "manifest.json"
+# Vectors and chunks of indexes saved before the manifest, under fixed names
+VECTORS_FILE = "vectors.faiss"
+CHUNKS_FILE = "chunks.sqlite"
+# Held by the process writing an index directory
+LOCK_FILE = ".lock"
+# Files written by FAISS.save_local, which pickles the docstore
+LEGACY_INDEX_FILE = "index.faiss"
+LEGACY_DOCSTORE_FILE = "index.pkl"
+# Leading fourcc FAISS writes for IVF-PQ indexes, current and older format
+IVFPQ_FOURCCS = (b"IwPQ", b"IvPQ")
+
+
+class ChunkStore(Docstore):
+    """
+    Read-only docstore over the chunk database of one index. Chunks are read
+    on demand, so loading costs nothing per chunk, and the database pages are
+    shared by every worker through the OS page cache.
+    """
+    def __init__(self, path: str):
+        # Files are replaced, never modified in place, so readers can skip locking
+        uri = Path(path).absolute().as_uri() + "?mode=ro&immutable=1"
+        self._conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self._conn.execute(f"PRAGMA mmap_size={CHUNKS_MMAP_BYTES}")
+        self._lock = threading.Lock()
+
+    def _fetch(self, query: str, args=()):
+        with self._lock:
+            return self._conn.execute(query, args).fetchall()
+
+    def search(self, search: str) -> Union[str, Document]:
+        rows = self._fetch("SELECT text, metadata FROM chunks WHERE id = ?", (search,))
+        if not rows:
+            return f"ID {search} not found."
+        text, metadata = rows[0]
+        return Document(id=search, page_content=text, metadata=json.loads(metadata))
+
+    def id_at(self, position: int) -> Optional[str]:
+        rows = self._fetch("SELECT id FROM chunks WHERE position = ?", (position,))
+        return rows[0][0] if rows else None
+
+    def positions(self, doc_ids: Iterable[str]) -> Dict[str, int]:
+        doc_ids = list(doc_ids)
+        if not doc_ids:
+            return {}
+        placeholders = ",".join("?" * len(doc_ids))
+        return dict(self._fetch(f"SELECT id, position FROM chunks WHERE id IN ({placeholders})", doc_ids))
+
+    def __len__(self) -> int:
+        return self._fetch("SELECT COUNT(*) FROM chunks")[0][0]
+
+    def close(self):
+        self._conn.close()
+
+
+class ChunkIds(Mapping):
+    """
+    The position -> chunk id mapping LangChain's FAISS store expects, looked
+    up in the chunk database instead of held in a dict.
+    """
+    def __init__(self, chunks: ChunkStore):
+        self._chunks = chunks
+
+    def __getitem__(self, position) -> str:
+        doc_id = self._chunks.id_at(int(position))
+        if doc_id is None:
+            raise KeyError(position)
+        return doc_id
+
+    def __iter__(self):
+        return iter(range(len(self)))
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+
+def faiss_store_class():
+    """
+    LangChain's FAISS vector store class. It and the faiss library are
+    imported on first use, so processes that never open an index don't pay
+    for importing them.
+    """
+    from langchain_community.vectorstores import FAISS
+    return FAISS
+
+
+def has_index(directory: str) -> bool:
+    return _has_store(directory) or os.path.isfile(os.path.join(directory, LEGACY_INDEX_FILE))
+
+
+def _has_store(directory: str) -> bool:
+    return os.path.isfile(os.path.join(directory, MANIFEST_FILE)) or os.path.isfile(os.path.join(directory, VECTORS_FILE))
+
+
+def store_files(directory: str) -> Tuple[str, str]:
+    """
+    Paths of the vectors and chunks files of the index in directory.
+    """
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE)) as manifest_file:
+            manifest = json.load(manifest_file)
+    except FileNotFoundError:
+        return os.path.join(directory, VECTORS_FILE), os.path.join(directory, CHUNKS_FILE)
+    return os.path.join(directory, manifest["vectors"]), os.path.join(directory, manifest["chunks"])
+
+
+@contextmanager
+def write_lock(directory: str):
+    """
+    Hold the lock of an index directory, so one process at a time writes
+    it. Readers don't take it.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_FILE), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _new_file(directory: str, prefix: str, suffix: str) -> str:
+    fd, path = tempfile.mkstemp(prefix=prefix, suffix=suffix, dir=directory)
+    os.close(fd)
+    return path
+
+
+def _write_chunks(vector_store, path: str):
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("CREATE TABLE chunks (position INTEGER PRIMARY KEY, id TEXT NOT NULL, text TEXT NOT NULL, metadata TEXT NOT NULL)")
+        rows = []
+        for position in range(vector_store.index.ntotal):
+            doc_id = vector_store.index_to_docstore_id[position]
+            doc = vector_store.docstore.search(doc_id)
+            rows.append((position, doc_id, doc.page_content, json.dumps(doc.metadata)))
+        conn.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?)", rows)
+        conn.execute("CREATE UNIQUE INDEX chunks_id ON chunks (id)")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _is_store_file(name: str) -> bool:
+    # Files save_store writes, by itself or by an earlier version
+    return (
+        (name.startswith("vectors-") and name.endswith(".faiss"))
+        or (name.startswith("chunks-") and name.endswith(".sqlite"))
+        or (name.startswith("manifest-") and name.endswith(".tmp"))
+        or name in (VECTORS_FILE, CHUNKS_FILE, LEGACY_INDEX_FILE, LEGACY_DOCSTORE_FILE)
+    )
+
+
+def _publish(vector_store, directory: str):
+    import faiss
+
+    vectors_path = _new_file(directory, "vectors-", ".faiss")
+    chunks_path = _new_file(directory, "chunks-", ".sqlite")
+    manifest_path = _new_file(directory, "manifest-", ".tmp")
+    try:
+        faiss.write_index(vector_store.index, vectors_path)
+        _write_chunks(vector_store, chunks_path)
+        with open(manifest_path, "w") as manifest_file:
+            json.dump({"vectors": os.path.basename(vectors_path), "chunks": os.path.basename(chunks_path)}, manifest_file)
+        os.replace(manifest_path, os.path.join(directory, MANIFEST_FILE))
+    except BaseException:
+        for path in (vectors_path, chunks_path, manifest_path):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    # Processes that have the previous files open keep reading them until they close them
+    published = {os.path.basename(vectors_path), os.path.basename(chunks_path)}
+    for name in os.listdir(directory):
+        if _is_store_file(name) and name not in published:
+            os.remove(os.path.join(directory, name))
+
+
+def save_store(vector_store, directory: str):
+    """
+    Write a vector store as a FAISS index file and a chunk database under
+    new names, then publish both at once by replacing the manifest that
+    names them. Readers see either the old pair or the new one.
+    """
+    with write_lock(directory):
+        _publish(vector_store, directory)
+
+
+def load_store(directory: str, embeddings, writable: bool = False):
+    """
+    Open the vector store saved in directory. By default the vectors are
+    memory-mapped and chunks are read from disk on demand, so opening takes
+    the same time and memory for any index size. A writable store is read
+    fully into memory so it can be updated and saved again.
+    """
+    if not _has_store(directory):
+        if not os.path.isfile(os.path.join(directory, LEGACY_INDEX_FILE)):
+            raise FileNotFoundError(f"No index in {directory}")
+        convert_legacy_index(directory, embeddings)
+    for attempt in range(3):
+        vectors_path, chunks_path = store_files(directory)
+        try:
+            return _open_store(vectors_path, chunks_path, embeddings, writable)
+        except (OSError, RuntimeError, sqlite3.OperationalError):
+            # The files were replaced and removed between reading the manifest and opening them
+            if attempt == 2 or store_files(directory) == (vectors_path, chunks_path):
+                raise
+
+
+def _open_store(vectors_path: str, chunks_path: str, embeddings, writable: bool):
+    import faiss
+
+    FAISS = faiss_store_class()
+    if writable:
+        from langchain_community.docstore.in_memory import InMemoryDocstore
+
+        index = faiss.read_index(vectors_path)
+        conn = sqlite3.connect(Path(chunks_path).absolute().as_uri() + "?mode=ro", uri=True)
+        try:
+            rows = conn.execute("SELECT position, id, text, metadata FROM chunks ORDER BY position").fetchall()
+        finally:
+            conn.close()
+        docstore = InMemoryDocstore({
+            doc_id: Document(id=doc_id, page_content=text, metadata=json.loads(metadata)) for _, doc_id, text, metadata in rows
+        })
+        return FAISS(embeddings, index, docstore, {position: doc_id for position, doc_id, _, _ in rows})
+
+    # Inverted lists are mapped with IO_FLAG_MMAP, flat and scalar-quantized codes with IO_FLAG_MMAP_IFC.
+    # The type comes from the index file itself, which is never modified once written.
+    mmap = faiss.IO_FLAG_MMAP if index_fourcc(vectors_path) in IVFPQ_FOURCCS else faiss.IO_FLAG_MMAP_IFC
+    index = faiss.read_index(vectors_path, mmap | faiss.IO_FLAG_READ_ONLY)
+    chunks = ChunkStore(chunks_path)
+    return FAISS(embeddings, index, chunks, ChunkIds(chunks))
+
+
+def index_fourcc(path: str) -> bytes:
+    """
+    The fourcc FAISS writes at the start of an index file to name its type.
+    """
+    with open(path, "rb") as index_file:
+        return index_file.read(4)
+
+
+def prefetch(directory: str):
+    """
+    Ask the OS to read the files of an index into the page cache in the
+    background, so the first searches of a mapped index don't wait on disk.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    for path in store_files(directory):
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+
+
+def chunk_positions(vector_store, doc_ids: Iterable[str]) -> Dict[str, int]:
+    """
+    Positions of chunks in the FAISS index of a store, by chunk id.
+    """
+    if isinstance(vector_store.docstore, ChunkStore):
+        return vector_store.docstore.positions(doc_ids)
+    wanted = set(doc_ids)
+    return {doc_id: position for position, doc_id in vector_store.index_to_docstore_id.items() if doc_id in wanted}
+
+
+def convert_legacy_index(directory: str, embeddings=None) -> bool:
+    """
+    Rewrite an index saved with FAISS.save_local in the current format. The
+    pickle was written by this service, so it is trusted this one time.
+    Returns False if another process converted it first.
+    """
+    with write_lock(directory):
+        if _has_store(directory):
+            return False
+        vector_store = faiss_store_class().load_local(directory, embeddings, allow_dangerous_deserialization=True)
+        _publish(vector_store, directory)
+    logger.info(f"Converted legacy index in {directory}.")
+    return True
+
+
+def migrate_indexes(source_root: str, index_root: str) -> int:
+    """
+    Move the legacy index directories in source_root, e.g. the working
+    directory used before INDEX_ROOT moved under DATA_ROOT, to index_root
+    in the current format. Returns the number migrated.
+    """
+    migrated = 0
+    for name in os.listdir(source_root):
+        source = os.path.join(source_root, name)
+        if not os.path.isfile(os.path.join(source, LEGACY_DOCSTORE_FILE)):
+            continue
+        target = os.path.join(index_root, name)
+        if os.path.abspath(source) != os.path.abspath(target):
+            if os.path.exists(target):
+                logger.warning(f"{target} already exists, not migrating {source}.")
+                continue
+            shutil.move(source, target)
+        convert_legacy_index(target)
+        migrated += 1
+    return migrated
+
+
+if __name__ == "__main__":
+    from index_cache import INDEX_ROOT
+
+    parser = argparse.ArgumentParser(description="Migrate indexes saved with FAISS.save_local to INDEX_ROOT.")
+    parser.add_argument("source_root", nargs="?", default=".", help="directory holding the legacy index directories")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    os.makedirs(INDEX_ROOT, exist_ok=True)
+    print(f"Migrated {migrate_indexes(args.source_root, INDEX_ROOT)} indexes to {INDEX_ROOT}.")
@@ -0,0 +1,169 @@
+import os
+import asyncio
+import shutil
+import logging
+import tempfile
+import zipfile
+from typing import AsyncIterator, Iterator, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from data_models import PARSING, EMBEDDING, READY, FAILED
+from pdf_processor import process_pdf_file, get_vector_store, update_vector_store, read_pages, PDFPasswordProtectedError, PARSE_WORKERS
+from index_cache import index_path
+from index_store import has_index
+from metrics import PARSE, EMBED, ingest_queue_depth, observe_stage
+from logging_config import worker_logging_args
+
+logger = logging.getLogger(__name__)
+
+# Directory where uploads are spooled until ingestion finishes
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+# Documents allowed to embed at the same time
+EMBED_CONCURRENCY = int(os.getenv("INGEST_EMBED_CONCURRENCY", "2"))
+# Documents of a batch upload admitted into the pipeline at once; enough to keep parsing and embedding busy together
+BATCH_IN_FLIGHT = int(os.getenv("INGEST_BATCH_IN_FLIGHT", str(2 * (PARSE_WORKERS + EMBED_CONCURRENCY))))
+
+_parse_executor = None
+_embed_semaphore = None
+
+
+def _get_parse_executor():
+    global _parse_executor
+    if _parse_executor is None:
+        _parse_executor = ProcessPoolExecutor(max_workers=PARSE_WORKERS, **worker_logging_args())
+    return _parse_executor
+
+
+def _get_embed_semaphore():
+    global _embed_semaphore
+    if _embed_semaphore is None:
+        _embed_semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+    return _embed_semaphore
+
+
+def spool_upload(file_stream, pdf_id: str) -> str:
+    """
+    Copy an uploaded file to UPLOAD_DIR so a worker process can open it by
+    path. Every upload gets its own file, even several for the same pdf_id.
+    """
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix=f"{pdf_id}-", suffix=".pdf", dir=UPLOAD_DIR)
+    file_stream.seek(0)
+    with os.fdopen(fd, "wb") as spooled:
+        shutil.copyfileobj(file_stream, spooled)
+    return path
+
+
+def iter_zip_pdfs(file_stream) -> Iterator[Tuple[str, int, object]]:
+    """
+    Yield (name, size, stream) for each PDF in a zip archive, skipping
+    directories and macOS resource forks.
+    """
+    with zipfile.ZipFile(file_stream) as archive:
+        for info in archive.infolist():
+            name = info.filename
+            if info.is_dir() or name.startswith("__MACOSX/") or not name.lower().endswith(".pdf"):
+                continue
+            with archive.open(info) as member:
+                yield os.path.basename(name), info.file_size, member
+
+
+async def ingest_batch(staged: AsyncIterator[Tuple[dict, Optional[Tuple[str, str, str]]]], registry) -> AsyncIterator[dict]:
+    """
+    Ingest the documents of a batch as they are staged and yield each one's
+    result as soon as it is known. staged yields (result, document) pairs:
+    a document (file_name, pdf_id, path) starts ingesting at once, while a
+    pair without one, e.g. a rejected file, is yielded as it is. At most
+    BATCH_IN_FLIGHT documents are in the pipeline at a time, and the next
+    one is only staged when there is room, so uploads are spooled while
+    earlier documents are parsed and embedded. Documents already admitted
+    keep ingesting if the consumer stops listening.
+    """
+    admission = asyncio.Semaphore(BATCH_IN_FLIGHT)
+    results = asyncio.Queue()
+
+    async def run(file_name: str, pdf_id: str, path: str):
+        try:
+            await ingest_pdf(pdf_id, path, registry)
+        finally:
+            admission.release()
+        pdf_file = registry.get(pdf_id)
+        await results.put({"file_name": file_name, "pdf_id": pdf_id, "status": pdf_file.status, "error": pdf_file.error})
+
+    async def feed():
+        tasks = []
+        try:
+            while True:
+                await admission.acquire()
+                try:
+                    result, document = await anext(staged)
+                except StopAsyncIteration:
+                    admission.release()
+                    break
+                if document is None:
+                    admission.release()
+                    await results.put(result)
+                else:
+                    tasks.append(asyncio.create_task(run(*document)))
+        except Exception as e:
+            logger.error(f"Batch upload stopped staging files: {e}")
+        finally:
+            # asyncio.wait, unlike gather, doesn't cancel the ingestions if feeding is cancelled
+            if tasks:
+                await asyncio.wait(tasks)
+            results.put_nowait(None)
+
+    feeder = asyncio.create_task(feed())
+    try:
+        while (result := await results.get()) is not None:
+            yield result
+    finally:
+        feeder.cancel()
+
+
+async def ingest_pdf(pdf_id: str, path: str, registry):
+    """
+    Parse, embed and index a spooled PDF, recording each stage's progress in
+    the registry. The PDF becomes available for chat once its status is ready.
+    If pdf_id already has an index, the new version is diffed against it and
+    only changed chunks are embedded.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        registry.update(pdf_id, status=PARSING)
+        # The worker streams page texts straight to the content file instead of returning them
+        content_path = registry.content_path(pdf_id)
+        with ingest_queue_depth.labels(stage=PARSE).track_inprogress():
+            pdf_data = await loop.run_in_executor(_get_parse_executor(), process_pdf_file, path, content_path)
+        # The worker process times its own stages; record them here where the metrics are served
+        for stage, seconds in pdf_data.get("timings", {}).items():
+            observe_stage(stage, seconds)
+        registry.update(
+            pdf_id,
+            status=EMBEDDING,
+            metadata=pdf_data["metadata"],
+            page_count=pdf_data["page_count"],
+            pages_parsed=pdf_data["page_count"],
+        )
+
+        def on_progress(chunks_embedded, chunks_total):
+            registry.update(pdf_id, chunks_embedded=chunks_embedded, chunks_total=chunks_total)
+
+        with ingest_queue_depth.labels(stage=EMBED).track_inprogress():
+            async with _get_embed_semaphore():
+                if has_index(index_path(pdf_id)):
+                    changes = await asyncio.to_thread(update_vector_store, pages=read_pages(content_path), pdf_id=pdf_id, on_progress=on_progress)
+                    logger.info(f"Index of {pdf_id} updated: {changes}")
+                else:
+                    await asyncio.to_thread(get_vector_store, pages=read_pages(content_path), pdf_id=pdf_id, on_progress=on_progress)
+        logger.info(f"vector_store retrieved for {pdf_id} successfully.")
+
+        registry.update(pdf_id, status=READY)
+        logger.info(f"PDF with {pdf_id} is stored successfully.")
+    except PDFPasswordProtectedError as e:
+        registry.update(pdf_id, status=FAILED, error=str(e))
+    except Exception as e:
+        logger.warning(f"Ingestion of {pdf_id} failed: {e}")
+        registry.update(pdf_id, status=FAILED, error=f"Error processing PDF: {e}")
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,141 @@
+import os
+import re
+import json
+import math
+import heapq
+import logging
+from collections import Counter
+from typing import Iterable, List, Optional, Tuple
+from index_cache import IndexCache, files_version, index_path
+from metrics import INDEX_LOAD, timed_stage
+
+logger = logging.getLogger(__name__)
+
+# BM25 term frequency saturation and document length normalization
+BM25_K1 = float(os.getenv("BM25_K1", "1.5"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+# Upper bound for the resident lexical indexes (default 128 MB)
+LEXICAL_CACHE_MAX_BYTES = int(os.getenv("LEXICAL_CACHE_MAX_MB", "128")) * 1024 * 1024
+
+LEXICAL_INDEX_FILE = "bm25.json"
+
+# Identifiers such as "PN-00012" or "v2.1" are kept whole, and their parts are indexed too
+TOKEN_PATTERN = re.compile(r"\w+(?:[-./]\w+)*")
+PART_PATTERN = re.compile(r"[-./]")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        token = match.group()
+        tokens.append(token)
+        if PART_PATTERN.search(token):
+            tokens.extend(part for part in PART_PATTERN.split(token) if part)
+    return tokens
+
+
+class BM25Index:
+    """
+    Inverted index over the chunks of one document, scored with Okapi BM25.
+    Chunks are referenced by their docstore ids in the FAISS index.
+    """
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.doc_ids = []
+        self.lengths = []
+        self.postings = {}
+        self.total_length = 0
+
+    def add(self, doc_id: str, text: str):
+        position = len(self.doc_ids)
+        terms = tokenize(text)
+        self.doc_ids.append(doc_id)
+        self.lengths.append(len(terms))
+        self.total_length += len(terms)
+        for term, frequency in Counter(terms).items():
+            self.postings.setdefault(term, []).append((position, frequency))
+
+    def add_many(self, items: Iterable[Tuple[str, str]]):
+        for doc_id, text in items:
+            self.add(doc_id, text)
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """
+        Return up to k (doc_id, score) pairs for chunks sharing terms with the
+        query, best first.
+        """
+        count = len(self.doc_ids)
+        if not count:
+            return []
+        average_length = self.total_length / count or 1.0
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for position, frequency in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[position] / average_length)
+                scores[position] = scores.get(position, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.doc_ids[position], score) for position, score in best]
+
+    def estimated_size(self) -> int:
+        """
+        Approximate resident size in bytes, for the index cache budget.
+        """
+        entries = sum(len(postings) for postings in self.postings.values())
+        return entries * 72 + len(self.postings) * 120 + len(self.doc_ids) * 100
+
+    def save(self, directory: str):
+        """
+        Write the index next to the old file and swap it in, so readers never see a partial file.
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, LEXICAL_INDEX_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as index_file:
+            json.dump({
+                "k1": self.k1,
+                "b": self.b,
+                "doc_ids": self.doc_ids,
+                "lengths": self.lengths,
+                "postings": self.postings,
+            }, index_file)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, directory: str) -> "BM25Index":
+        with open(os.path.join(directory, LEXICAL_INDEX_FILE), encoding="utf-8") as index_file:
+            data = json.load(index_file)
+        index = cls(k1=data["k1"], b=data["b"])
+        index.doc_ids = data["doc_ids"]
+        index.lengths = data["lengths"]
+        index.total_length = sum(index.lengths)
+        index.postings = {term: [tuple(posting) for posting in postings] for term, postings in data["postings"].items()}
+        return index
+
+
+lexical_cache = IndexCache(max_bytes=LEXICAL_CACHE_MAX_BYTES, sizeof=lambda index: index.estimated_size() if index else 0)
+
+
+def _load_lexical_index(pdf_id: str) -> Optional[BM25Index]:
+    directory = index_path(pdf_id)
+    if not os.path.exists(os.path.join(directory, LEXICAL_INDEX_FILE)):
+        logger.info(f"No lexical index for {pdf_id}, using vector search only.")
+        return None
+    with timed_stage(INDEX_LOAD):
+        return BM25Index.load(directory)
+
+
+def load_lexical_index(pdf_id: str) -> Optional[BM25Index]:
+    """
+    Return the BM25 index for pdf_id, or None for documents indexed before
+    lexical indexes were built. Like vector stores, it is loaded again once
+    its file was rewritten.
+    """
+    version = files_version(index_path(pdf_id), (LEXICAL_INDEX_FILE,))
+    return lexical_cache.get(pdf_id, lambda: _load_lexical_index(pdf_id), version)
@@ -0,0 +1,215 @@
+import os
+import math
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+from fastapi import HTTPException
+from embedding_client import backoff_delay, retry_after
+from metrics import LLM_QUEUE, LLM_TOTAL, llm_in_flight, llm_queue_depth, llm_rejections, timed_stage
+
+logger = logging.getLogger(__name__)
+
+# Model calls in flight at once across the process
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+# Requests allowed to wait for a slot; more are turned away with 503
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", "64"))
+# Seconds a request may wait for a slot before it is turned away with 503
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+# Retries of a rate-limited or failed model call, with jittered exponential backoff
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+
+
+class LLMOverloadedError(HTTPException):
+    """
+    503 with a Retry-After header, raised when a model call can't be admitted
+    or the model stays rate limited after all retries.
+    """
+    def __init__(self, detail: str, retry_after_seconds: float):
+        super().__init__(status_code=503, detail=detail, headers={"Retry-After": str(max(1, math.ceil(retry_after_seconds)))})
+
+
+class Lease:
+    """
+    A slot of the gateway; releasing it more than once has no effect.
+    """
+    def __init__(self, gateway: "LLMGateway"):
+        self._gateway = gateway
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._gateway._release()
+
+
+class LLMGateway:
+    """
+    Admission control for model calls shared by all requests of a process.
+    At most max_concurrency calls run at once. Further requests wait in
+    per-client FIFO queues that are served round-robin, so one busy client
+    can't starve the others. A request is turned away with a 503 when
+    max_queue requests are already waiting or it waits longer than
+    queue_timeout. Rate-limited calls are retried inside their slot, after
+    the server's Retry-After or a jittered backoff.
+    """
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, max_queue: int = LLM_QUEUE_SIZE,
+                 queue_timeout: float = LLM_QUEUE_TIMEOUT, max_retries: int = LLM_MAX_RETRIES, sleep=asyncio.sleep):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self._sleep = sleep
+        self._active = 0
+        self._waiting = 0
+        # client -> waiters; clients rotate to the end when served
+        self._queues = OrderedDict()
+        # Moving average of how long a slot is held, for Retry-After estimates
+        self._hold_seconds = 1.0
+        self.rejected = 0
+
+    def _update_gauges(self):
+        llm_in_flight.set(self._active)
+        llm_queue_depth.set(self._waiting)
+
+    def retry_after(self) -> float:
+        """
+        Estimated seconds until the queue ahead of a new request has drained.
+        """
+        return self._hold_seconds * (self._waiting + 1) / max(1, self.max_concurrency)
+
+    def _reject(self, reason: str, detail: str):
+        self.rejected += 1
+        llm_rejections.labels(reason=reason).inc()
+        logger.warning(f"LLM request rejected: {detail}")
+        raise LLMOverloadedError(detail, self.retry_after())
+
+    async def acquire(self, client: str = "") -> Lease:
+        """
+        Wait for a slot; raises LLMOverloadedError when the queue is full or the wait times out.
+        The wait is recorded as the llm_queue stage.
+        """
+        with timed_stage(LLM_QUEUE):
+            return await self._acquire(client)
+
+    async def _acquire(self, client: str) -> Lease:
+        if self._active < self.max_concurrency and not self._waiting:
+            self._active += 1
+            self._update_gauges()
+            return Lease(self)
+        if self._waiting >= self.max_queue:
+            self._reject("queue_full", "Too many requests are waiting for the model. Retry later.")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(client, deque()).append(waiter)
+        self._waiting += 1
+        self._update_gauges()
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over as the wait ended; pass it on
+                self._release()
+            else:
+                self._discard(client, waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject("timeout", f"No model capacity became free within {self.queue_timeout:g}s. Retry later.")
+            raise
+        return Lease(self)
+
+    def _discard(self, client: str, waiter):
+        queue = self._queues.get(client)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        if not queue:
+            del self._queues[client]
+        self._waiting -= 1
+        self._update_gauges()
+
+    def _release(self):
+        # Hand the slot to the longest waiting request of the next client in turn
+        while self._queues:
+            client, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            if queue:
+                self._queues.move_to_end(client)
+            else:
+                del self._queues[client]
+            self._waiting -= 1
+            if not waiter.done():
+                waiter.set_result(None)
+                self._update_gauges()
+                return
+        self._active -= 1
+        self._update_gauges()
+
+    @asynccontextmanager
+    async def slot(self, client: str = ""):
+        lease = await self.acquire(client)
+        started = time.perf_counter()
+        try:
+            yield lease
+        finally:
+            self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * (time.perf_counter() - started)
+            lease.release()
+
+    async def _backoff(self, attempt: int, exc: Exception):
+        server_delay = retry_after(exc)
+        if server_delay is None:
+            raise exc
+        if attempt >= self.max_retries:
+            raise LLMOverloadedError("The model is rate limited. Retry later.", max(server_delay, 1.0)) from exc
+        delay = backoff_delay(attempt, server_delay)
+        logger.warning(f"Model call rate limited, retrying in {delay:.1f}s (attempt {attempt + 1})")
+        await self._sleep(delay)
+
+    async def invoke(self, chain, inputs: dict, client: str = ""):
+        """
+        Run chain.ainvoke(inputs) in a slot, retrying rate-limited calls.
+        Time in the slot is recorded as the llm_total stage.
+        """
+        async with self.slot(client):
+            with timed_stage(LLM_TOTAL):
+                for attempt in range(self.max_retries + 1):
+                    try:
+                        return await chain.ainvoke(inputs)
+                    except Exception as e:
+                        await self._backoff(attempt, e)
+
+    async def stream(self, chain, inputs: dict, lease: Lease) -> AsyncIterator:
+        """
+        Stream chain.astream(inputs) in the slot held by lease, which is
+        released when the stream ends. Calls are retried only until the
+        first token has been sent.
+        """
+        started = time.perf_counter()
+        try:
+            for attempt in range(self.max_retries + 1):
+                sent = False
+                try:
+                    async for token in chain.astream(inputs):
+                        sent = True
+                        yield token
+                    return
+                except Exception as e:
+                    if sent:
+                        raise
+                    await self._backoff(attempt, e)
+        finally:
+            self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * (time.perf_counter() - started)
+            lease.release()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self._active,
+            "queued": self._waiting,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+        }
+
+
+llm_gateway = LLMGateway()
@@ -1,5 +1,12 @@
+import os
+import atexit
 import logging
+import multiprocessing
 from logging.config import dictConfig
+from logging.handlers import QueueHandler, QueueListener
+
+# File the JSON log records are written to
+LOG_FILE = os.getenv("LOG_FILE", "app.log")
 
 LOGGING_CONFIG = {
     "version": 1,
@@ -21,7 +28,7 @@ LOGGING_CONFIG = {
         },
         "file": {
             "class": "logging.FileHandler",
-            "filename": "app.log",
+            "filename": LOG_FILE,
             "formatter": "json",  # Use structured JSON format
         },
     },
@@ -31,8 +38,76 @@ LOGGING_CONFIG = {
     },
 }
 
+_listener = None
+# Queue the listener drains; shared with worker processes through worker_logging_args
+_records = None
+
+
+def stop_logging():
+    """
+    Write out queued records, stop the logging thread and attach the handlers
+    to the root logger directly again.
+    """
+    global _listener
+    if _listener is None:
+        return
+    root = logging.getLogger()
+    for handler in [handler for handler in root.handlers if isinstance(handler, QueueHandler)]:
+        root.removeHandler(handler)
+    _listener.stop()
+    for handler in _listener.handlers:
+        root.addHandler(handler)
+    _listener = None
+# Queue the listener drains; shared with worker processes through worker_logging_args
+_records = None
+
+
 # Function to configure logging
 def configure_logging():
+    """
+    Apply LOGGING_CONFIG behind a queue: callers, including the event loop,
+    only enqueue records, and a background thread formats them and writes
+    them to the console and LOG_FILE. The queue is a multiprocessing one, so
+    pool workers started with worker_logging_args log through it too.
+    """
+    global _listener, _records
+    stop_logging()
     dictConfig(LOGGING_CONFIG)
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    _records = multiprocessing.Queue()
+    for handler in handlers:
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(_records))
+    _listener = QueueListener(_records, *handlers, respect_handler_level=True)
+    _listener.start()
     logger = logging.getLogger(__name__)
     return logger
+
+
+def configure_worker_logging(records):
+    """
+    Pool initializer: send the records of a worker process to the queue of
+    the parent's listener. A forked worker inherits the parent's queue
+    handler but not its listener thread, and a spawned one has no handlers.
+    """
+    global _records
+    if records is None:
+        return
+    _records = records
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(records))
+    root.setLevel(LOGGING_CONFIG["root"]["level"])
+
+
+def worker_logging_args() -> dict:
+    """
+    Keyword arguments for a ProcessPoolExecutor whose workers should log
+    through the listener of this process, or of the process that started it.
+    """
+    return {"initializer": configure_worker_logging, "initargs": (_records,)}
+
+
+atexit.register(stop_logging)
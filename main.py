@@ -1,36 +1,64 @@
 from dotenv import load_dotenv
-from fastapi import FastAPI, UploadFile, HTTPException, Path, Body, Request
+from fastapi import FastAPI, UploadFile, HTTPException, Path, Body, Request, BackgroundTasks
+from starlette.concurrency import run_in_threadpool
 import uuid
-from pdf_processor import process_pdf, process_metadata, PDFPasswordProtectedError, get_vector_store
+import time
+from pdf_processor import check_pdf_access, delete_indexes, PDFPasswordProtectedError
+from ingestion import ingest_batch, ingest_pdf, iter_zip_pdfs, spool_upload
+from registry import registry, IN_PROGRESS
 from pydantic import BaseModel, Field
-from typing import Any
-from gemini_client import get_conversational_chain
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores import FAISS
-import google.generativeai as genai
+from typing import Any, List, Optional
+from gemini_client import get_shared_chain, get_query_embeddings, PROMPT_TEMPLATE
+from context_packing import context_packer, count_tokens
+from contextlib import asynccontextmanager
+from index_cache import index_cache
+from lexical_index import lexical_cache
+from embedding_cache import file_digest
+from embedding_client import embedding_metrics
 import os
+import json
+import zipfile
 from error_handler import CustomErrorHandlerMiddleware
 import logging
-from logging_config import configure_logging
+from logging_config import configure_logging, stop_logging
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
-from data_models import PDF_File, Query
-from langchain_core.caches import InMemoryCache
-from langchain_core.globals import set_llm_cache
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from data_models import PDF_File, Query, MultiQuery, Collection, CollectionCreate, ChatSession, PENDING, READY, FAILED
+from retrieval import scatter_gather_search, cite_sources, warm_indexes
+from semantic_cache import semantic_cache
+from llm_gateway import llm_gateway
+from starlette.background import BackgroundTask
+from sessions import add_turn, condense_query, prior_chunk_ids, question_with_history
+from metrics import (
+    EMBED_QUERY, RETRIEVE, LLM_FIRST_TOKEN, LLM_TOTAL,
+    ServerTimingMiddleware, observe_stage, register_stats, render_metrics, timed_stage,
+)
 
 load_dotenv()
 
 logger = configure_logging()
-# Retrieve API key
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-genai.configure(api_key=GOOGLE_API_KEY)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pick up indexes written before a restart and fail ingestions it interrupted
+    await run_in_threadpool(registry.rebuild)
+    await run_in_threadpool(registry.recover_interrupted)
+    # Build the shared model, chain and embeddings clients and load the recently used
+    # indexes before serving requests, so the server only accepts connections once warm
+    get_shared_chain()
+    await run_in_threadpool(warm_indexes, get_query_embeddings())
+    yield
+    # Flush log records still queued for the handlers
+    stop_logging()
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(CustomErrorHandlerMiddleware)
+app.add_middleware(ServerTimingMiddleware)
 
-set_llm_cache(InMemoryCache())
-# Global storage for PDFs (in-memory)
-pdf_storage = {}
+register_stats(
+    caches={"index": index_cache.stats, "lexical": lexical_cache.stats, "semantic": semantic_cache.stats},
+    embedding_stats=embedding_metrics.stats,
+)
 
 
 @app.exception_handler(RequestValidationError)
@@ -46,50 +74,208 @@ async def root():
     logger.info("Root endpoint was accessed")
     return {"message": "Welcome to the FastAPI application!"}
 
+@app.get("/v1/cache/stats")
+async def cache_stats():
+    """
+    Endpoint exposing hit/miss/eviction counters of the in-process caches.
+    """
+    return {
+        "index_cache": index_cache.stats(),
+        "lexical_cache": lexical_cache.stats(),
+        "semantic_cache": semantic_cache.stats(),
+    }
+
+@app.get("/v1/embeddings/stats")
+async def embedding_stats():
+    """
+    Endpoint exposing embedding throughput and retry counters.
+    """
+    return embedding_metrics.stats()
+
+@app.get("/v1/llm/stats")
+async def llm_stats():
+    """
+    Endpoint exposing the model calls in flight, queued and turned away by the LLM gateway.
+    """
+    return llm_gateway.stats()
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Endpoint exposing stage latency histograms, cache and retry counters and
+    ingestion queue depth in the Prometheus text format.
+    """
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
 
 
 # Maximum file size limit (100 MB)
 MAX_FILE_SIZE = 100 * 1024 * 1024
-@app.post("/v1/pdf")
-async def upload_pdf(file: UploadFile):
+# Content types of zip archives accepted by the batch upload
+ZIP_TYPES = ("application/zip", "application/x-zip-compressed")
+# Status reported for a file of a batch upload that was not ingested
+REJECTED = "rejected"
+
+async def read_upload(file: UploadFile):
+    """
+    Validate the type and size of an uploaded PDF. Returns its size and digest.
+    """
+    # Validate file type
+    if file.content_type != "application/pdf":
+        raise HTTPException(status_code=415, detail="Unsupported file type. Only PDFs are allowed.")
+
+    # Check file size
+    file_size = file.file.seek(0, 2)  # Move to the end of the file
+    if file_size > MAX_FILE_SIZE:
+        raise HTTPException(status_code=413, detail="File size exceeds the 100 MB limit.")
+    file.file.seek(0)  # Reset file pointer to the beginning
+
+    digest = await run_in_threadpool(file_digest, file.file)
+    return file_size, digest
+
+@app.post("/v1/pdf", status_code=202)
+async def upload_pdf(file: UploadFile, background_tasks: BackgroundTasks):
     """
     Endpoint for uploading and registering a PDF.
+    The PDF is processed in the background; poll GET /v1/pdf/{pdf_id} for its status.
     """
     logger.info(f"Received file upload request: {file.filename}")
     try:
+        file_size, digest = await read_upload(file)
 
-        # Validate file type
-        if file.content_type != "application/pdf":
-            raise HTTPException(status_code=415, detail="Unsupported file type. Only PDFs are allowed.")
-        
-        # Check file size
-        file_size = file.file.seek(0, 2)  # Move to the end of the file
-        if file_size > MAX_FILE_SIZE:
-            raise HTTPException(status_code=413, detail="File size exceeds the 100 MB limit.")
-        file.file.seek(0)  # Reset file pointer to the beginning
+        # A byte-identical upload reuses the existing index without any processing
+        existing = registry.find_by_digest(digest)
+        if existing and existing.status != FAILED:
+            logger.info(f"Identical PDF already stored as {existing.pdf_id}, reusing its index.")
+            return {"pdf_id": existing.pdf_id, "status": existing.status}
+
+        await run_in_threadpool(check_pdf_access, file.file)
 
         # Generate a unique PDF ID
         pdf_id = str(uuid.uuid4())
 
-        # Process the PDF
-        pdf_data = process_pdf(file.file)
+        path = await run_in_threadpool(spool_upload, file.file, pdf_id)
+        pdf_file = PDF_File(pdf_id=pdf_id, file_name=file.filename, size=file_size, digest=digest)
+        registry.put(pdf_file)
+        background_tasks.add_task(ingest_pdf, pdf_id, path, registry)
+        logger.info(f"PDF {pdf_id} queued for ingestion.")
 
-        pdf_file = PDF_File(
-            pdf_id = pdf_id,
-            file_name= file.filename,
-            size= file_size,
-            content= pdf_data["text"],
-            metadata= process_metadata(pdf_data["metadata"]),
-            page_count= len(pdf_data["text"].split("\f")) - 1
-        )
+        return {"pdf_id": pdf_id, "status": pdf_file.status}
+    
+    except PDFPasswordProtectedError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+    except HTTPException as http_exc:
+        logger.warning(f"File upload failed: {http_exc.detail}")
+        raise http_exc
+    except Exception as e:
+        logger.warning(f"File upload failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Error processing PDF: {e}")
 
-        get_vector_store(content=pdf_file.content, pdf_id=pdf_id)
-        logger.info(f"vector_store retrieved for {pdf_id} successfully.")
-        pdf_storage[pdf_id] = pdf_file
-        logger.info(f"PDF with {pdf_id} is stored successfully.")
+def spool_batch_file(file_stream, pdf_id: str):
+    """
+    Spool one file of a batch upload and return its path and digest.
+    """
+    path = spool_upload(file_stream, pdf_id)
+    with open(path, "rb") as spooled:
+        return path, file_digest(spooled)
+
+def check_spooled_pdf(path: str):
+    with open(path, "rb") as spooled:
+        check_pdf_access(spooled)
+
+async def stage_batch_file(file_name: str, size: int, file_stream):
+    """
+    Validate, deduplicate and register one PDF of a batch upload. Returns its
+    result line and, if it was accepted, the document to ingest.
+    """
+    result = {"file_name": file_name, "pdf_id": None, "status": REJECTED, "error": None}
+    if size > MAX_FILE_SIZE:
+        result["error"] = "File size exceeds the 100 MB limit."
+        return result, None
+
+    pdf_id = str(uuid.uuid4())
+    path, digest = await run_in_threadpool(spool_batch_file, file_stream, pdf_id)
+    try:
+        existing = registry.find_by_digest(digest)
+        if existing and existing.status != FAILED:
+            os.remove(path)
+            result.update(pdf_id=existing.pdf_id, status=existing.status, duplicate=True)
+            return result, None
+        await run_in_threadpool(check_spooled_pdf, path)
+    except Exception as e:
+        if os.path.exists(path):
+            os.remove(path)
+        result["error"] = str(e) if isinstance(e, PDFPasswordProtectedError) else f"Error processing PDF: {e}"
+        return result, None
+
+    pdf_file = PDF_File(pdf_id=pdf_id, file_name=file_name, size=size, digest=digest)
+    registry.put(pdf_file)
+    result.update(pdf_id=pdf_id, status=pdf_file.status)
+    return result, (file_name, pdf_id, path)
+
+@app.post("/v1/pdf/batch")
+async def upload_pdf_batch(files: List[UploadFile]):
+    """
+    Endpoint for uploading many PDFs at once, as separate files and/or zip archives of PDFs.
+    Each PDF is validated, registered and handed to ingestion as soon as it is
+    spooled, so later files are spooled while earlier ones are parsed and embedded.
+    The response streams one NDJSON line per PDF: rejected files and duplicates
+    when they are reached, accepted PDFs as soon as their ingestion finishes.
+    """
+    logger.info(f"Received batch upload of {len(files)} files.")
+
+    # The uploaded files stay open until the streamed response has ended
+    async def staged():
+        for file in files:
+            if file.content_type in ZIP_TYPES:
+                try:
+                    for name, size, member in iter_zip_pdfs(file.file):
+                        yield await stage_batch_file(name, size, member)
+                except zipfile.BadZipFile as e:
+                    yield {"file_name": file.filename, "pdf_id": None, "status": REJECTED,
+                           "error": f"Invalid zip archive: {e}"}, None
+            elif file.content_type == "application/pdf":
+                yield await stage_batch_file(file.filename, file.file.seek(0, 2), file.file)
+            else:
+                yield {"file_name": file.filename, "pdf_id": None, "status": REJECTED,
+                       "error": "Unsupported file type. Only PDFs and zip archives are allowed."}, None
+
+    async def results():
+        async for result in ingest_batch(staged(), registry):
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+@app.put("/v1/pdf/{pdf_id}", status_code=202)
+async def replace_pdf(file: UploadFile, background_tasks: BackgroundTasks,
+                      pdf_id: str = Path(..., description="The unique identifier for the PDF")):
+    """
+    Endpoint for uploading a new version of a PDF under the same pdf_id.
+    The new text is diffed against the indexed chunks, so only changed chunks
+    are embedded. Poll GET /v1/pdf/{pdf_id} until it is ready again.
+    """
+    logger.info(f"Received new version of {pdf_id}: {file.filename}")
+    try:
+        pdf_file = registry.get(pdf_id)
+        if not pdf_file:
+            raise HTTPException(status_code=404, detail="PDF not found")
+        if pdf_file.status in IN_PROGRESS:
+            raise HTTPException(status_code=409, detail=f"PDF is still being processed (status: {pdf_file.status}).")
+        file_size, digest = await read_upload(file)
+        if digest == pdf_file.digest and pdf_file.status == READY:
+            logger.info(f"New version of {pdf_id} is identical, keeping its index.")
+            return {"pdf_id": pdf_id, "status": pdf_file.status}
+
+        await run_in_threadpool(check_pdf_access, file.file)
+        path = await run_in_threadpool(spool_upload, file.file, pdf_id)
+        # Checked again atomically: another request may have claimed the document since it was read
+        if not registry.claim(PDF_File(pdf_id=pdf_id, file_name=file.filename, size=file_size, digest=digest)):
+            os.remove(path)
+            raise HTTPException(status_code=409, detail="PDF is being processed or was deleted by another request.")
+        background_tasks.add_task(ingest_pdf, pdf_id, path, registry)
+        logger.info(f"New version of {pdf_id} queued for ingestion.")
+        return {"pdf_id": pdf_id, "status": PENDING}
 
-        return {"pdf_id": pdf_id}
-    
     except PDFPasswordProtectedError as e:
         raise HTTPException(status_code=401, detail=str(e))
     except HTTPException as http_exc:
@@ -99,28 +285,140 @@ async def upload_pdf(file: UploadFile):
         logger.warning(f"File upload failed: {e}")
         raise HTTPException(status_code=500, detail=f"Error processing PDF: {e}")
 
+@app.delete("/v1/pdf/{pdf_id}", status_code=204)
+async def delete_pdf(pdf_id: str = Path(..., description="The unique identifier for the PDF")):
+    """
+    Endpoint removing a PDF with its indexes, extracted text, chat sessions
+    and collection memberships.
+    """
+    pdf_file = registry.get(pdf_id)
+    if not pdf_file:
+        raise HTTPException(status_code=404, detail="PDF not found")
+    if pdf_file.status in IN_PROGRESS:
+        raise HTTPException(status_code=409, detail=f"PDF is still being processed (status: {pdf_file.status}).")
+    await run_in_threadpool(delete_indexes, pdf_id)
+    registry.delete_content(pdf_id)
+    registry.delete(pdf_id)
+    logger.info(f"PDF {pdf_id} deleted.")
+
+@app.get("/v1/pdf/{pdf_id}")
+async def get_pdf_status(pdf_id: str = Path(..., description="The unique identifier for the PDF")):
+    """
+    Endpoint reporting the ingestion progress and final status of a PDF.
+    """
+    pdf_file = registry.get(pdf_id)
+    if not pdf_file:
+        raise HTTPException(status_code=404, detail="PDF not found")
+    return pdf_file.model_dump(exclude={"digest"})
+
+def get_ready_pdf(pdf_id: str) -> PDF_File:
+    """
+    Return the stored PDF, or raise 404 if unknown and 409 if it is not ready for chat.
+    """
+    pdf_file = registry.get(pdf_id)
+    if not pdf_file:
+        raise HTTPException(status_code=404, detail="PDF not found")
+    if pdf_file.status == FAILED:
+        raise HTTPException(status_code=409, detail=f"PDF processing failed: {pdf_file.error}")
+    if pdf_file.status != READY:
+        raise HTTPException(status_code=409, detail=f"PDF is not ready yet (status: {pdf_file.status}).")
+    return pdf_file
+
+def format_sse(event: str, data: dict) -> str:
+    """
+    Encode a Server-Sent Event.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def answer_version(pdf_file: PDF_File, query: Query) -> str:
+    """
+    Cached answers are only reused for the same document and retrieval settings.
+    """
+    return f"{pdf_file.digest or ''}:{query.mode}:{query.k}:{query.fetch_k}:{int(query.mmr)}"
+
+# Tokens of the fixed instructions around the context and question
+PROMPT_TOKENS = count_tokens(PROMPT_TEMPLATE.format(context="", question=""))
+# Usage reported for answers served from the answer cache, which cost no Gemini tokens
+CACHED_USAGE = {"prompt_tokens": 0, "context_tokens": 0, "chunks_dropped": 0}
+
+def pack_context(docs, question: str):
+    """
+    Fit the retrieved chunks into the context token budget. Returns the
+    chunks to send and the token usage of the resulting prompt.
+    """
+    packed = context_packer.pack(docs)
+    usage = {
+        "prompt_tokens": PROMPT_TOKENS + count_tokens(question) + packed.context_tokens,
+        "context_tokens": packed.context_tokens,
+        "chunks_dropped": packed.dropped,
+    }
+    logger.info(f"Prompt packed: {usage}")
+    return packed.docs, usage
+
+async def embed_query(embeddings, text: str):
+    with timed_stage(EMBED_QUERY):
+        return await embeddings.aembed_query(text)
+
+async def retrieve(pdf_ids, embeddings, query_vector, query, query_text: str = None, prior_ids=()):
+    with timed_stage(RETRIEVE):
+        return await scatter_gather_search(
+            pdf_ids, embeddings, query_vector,
+            k=query.k, query_text=query_text or query.message, fetch_k=query.fetch_k, mode=query.mode, mmr=query.mmr,
+            prior_ids=prior_ids,
+        )
+
+def client_key(request: Request) -> str:
+    """
+    Identify the caller for fair queueing of model calls: the X-Client-ID
+    header when set, else the client address.
+    """
+    return request.headers.get("X-Client-ID") or (request.client.host if request.client else "")
+
+def get_chat_session(pdf_id: str, session_id: Optional[str]) -> Optional[ChatSession]:
+    if not session_id:
+        return None
+    session = registry.get_session(session_id)
+    if not session or session.pdf_id != pdf_id:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return session
+
+def record_turn(session: Optional[ChatSession], question: str, answer: str, chunk_ids):
+    if session:
+        registry.put_session(add_turn(session, question, answer, list(chunk_ids), time.time()))
+
 @app.post("/v1/chat/{pdf_id}")
-async def chat_with_pdf(pdf_id: str = Path(..., description="The unique identifier for the PDF"), query: Query = Body(...)):
+async def chat_with_pdf(request: Request, pdf_id: str = Path(..., description="The unique identifier for the PDF"), query: Query = Body(...)):
     # Validate the pdf_id and retrieve the associated PDF content
     try:
-        pdf_file = pdf_storage.get(pdf_id)
-        if not pdf_file:
-            
-            raise HTTPException(status_code=404, detail="PDF not found")
-        
-        #pdf_content = pdf_storage[pdf_id]["content"]
-        embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-        new_db = FAISS.load_local(pdf_id, embeddings, allow_dangerous_deserialization=True)
-        docs = new_db.similarity_search(query.message)
-        chain = get_conversational_chain()
-
-        response = chain.invoke({"context": docs, "question": query.message}, return_only_outputs=True)
-        print(response)
-        # Use the Gemini API to generate a response based on the PDF content and user query
-        #response_text = query_gemini_api(pdf_content, query.message)
-        
-        #return Response(response=response_text)
-        return {"response": response.strip()}
+        pdf_file = get_ready_pdf(pdf_id)
+        session = get_chat_session(pdf_id, query.session_id)
+        search_text = condense_query(session, query.message)
+
+        # The query embedding serves both the answer cache and retrieval
+        embeddings = get_query_embeddings()
+        query_vector = await embed_query(embeddings, search_text)
+        version = answer_version(pdf_file, query)
+        # Answers to follow-ups depend on the conversation, so only opening questions use the answer cache
+        use_cache = not (session and session.turns)
+        cached = semantic_cache.lookup(pdf_id, version, query_vector) if use_cache else None
+        if cached:
+            record_turn(session, query.message, cached.answer, cached.chunk_ids)
+            return {"response": cached.answer, "sources": cached.sources, "usage": CACHED_USAGE}
+
+        question = question_with_history(session, query.message)
+        docs = await retrieve([pdf_id], embeddings, query_vector, query, search_text, prior_chunk_ids(session))
+        docs, usage = pack_context(docs, question)
+        chain = get_shared_chain()
+
+        # The gateway times the queue wait and the call separately
+        response = await llm_gateway.invoke(chain, {"context": docs, "question": question}, client_key(request))
+        answer = response.strip()
+        sources = cite_sources(docs)
+        chunk_ids = [doc.id for doc in docs]
+        if use_cache:
+            semantic_cache.store(pdf_id, version, query_vector, answer, chunk_ids, sources)
+        record_turn(session, query.message, answer, chunk_ids)
+        return {"response": answer, "sources": sources, "usage": usage}
     except FileNotFoundError:
         logger.error(f"PDF with {pdf_id} not found in db: {str(FileNotFoundError)}")
         raise HTTPException(status_code=500, detail="Vector store for the PDF not found. Ensure it was correctly processed.")
@@ -131,3 +429,158 @@ async def chat_with_pdf(pdf_id: str = Path(..., description="The unique identifi
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+
+
+@app.post("/v1/chat/{pdf_id}/stream")
+async def stream_chat_with_pdf(request: Request, pdf_id: str = Path(..., description="The unique identifier for the PDF"), query: Query = Body(...)):
+    """
+    Endpoint streaming the answer as Server-Sent Events: one "token" event per
+    generated chunk, then an "end" event with the ids and citations of the retrieved chunks.
+    """
+    try:
+        pdf_file = get_ready_pdf(pdf_id)
+        session = get_chat_session(pdf_id, query.session_id)
+        search_text = condense_query(session, query.message)
+        version = answer_version(pdf_file, query)
+        embeddings = get_query_embeddings()
+        query_vector = await embed_query(embeddings, search_text)
+        use_cache = not (session and session.turns)
+        cached = semantic_cache.lookup(pdf_id, version, query_vector) if use_cache else None
+        lease = None
+        if not cached:
+            question = question_with_history(session, query.message)
+            docs = await retrieve([pdf_id], embeddings, query_vector, query, search_text, prior_chunk_ids(session))
+            docs, usage = pack_context(docs, question)
+            chain = get_shared_chain()
+            # Admit the model call before the response starts, so overload is still a 503
+            lease = await llm_gateway.acquire(client_key(request))
+    except FileNotFoundError:
+        logger.error(f"Vector store for {pdf_id} not found on disk")
+        raise HTTPException(status_code=500, detail="Vector store for the PDF not found. Ensure it was correctly processed.")
+    except HTTPException as e:
+        logger.error(f"{str(e)}")
+        raise e
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+
+    async def event_stream():
+        if cached:
+            record_turn(session, query.message, cached.answer, cached.chunk_ids)
+            yield format_sse("token", {"text": cached.answer})
+            yield format_sse("end", {"chunk_ids": cached.chunk_ids, "sources": cached.sources, "usage": CACHED_USAGE})
+            return
+        try:
+            tokens = []
+            # The slot is already held, so the queue wait isn't counted as model time
+            started = time.perf_counter()
+            async for token in llm_gateway.stream(chain, {"context": docs, "question": question}, lease):
+                if not tokens:
+                    observe_stage(LLM_FIRST_TOKEN, time.perf_counter() - started)
+                tokens.append(token)
+                yield format_sse("token", {"text": token})
+            observe_stage(LLM_TOTAL, time.perf_counter() - started)
+            answer = "".join(tokens).strip()
+            chunk_ids = [doc.id for doc in docs]
+            sources = cite_sources(docs)
+            if use_cache:
+                semantic_cache.store(pdf_id, version, query_vector, answer, chunk_ids, sources)
+            record_turn(session, query.message, answer, chunk_ids)
+            yield format_sse("end", {"chunk_ids": chunk_ids, "sources": sources, "usage": usage})
+        except Exception as e:
+            # Headers are already sent, so errors are reported in-band
+            logger.error(f"Streaming chat for {pdf_id} failed: {str(e)}")
+            yield format_sse("error", {"detail": f"Unexpected error: {str(e)}"})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Frees the slot if the client disconnects before the stream starts
+        background=BackgroundTask(lease.release) if lease else None,
+    )
+
+
+@app.post("/v1/chat/{pdf_id}/sessions", status_code=201)
+async def create_chat_session(pdf_id: str = Path(..., description="The unique identifier for the PDF")):
+    """
+    Endpoint for starting a conversation about a PDF. Pass the returned
+    session_id with chat requests to ask follow-up questions.
+    """
+    if not registry.get(pdf_id):
+        raise HTTPException(status_code=404, detail="PDF not found")
+    session = ChatSession(session_id=str(uuid.uuid4()), pdf_id=pdf_id, created=time.time())
+    registry.put_session(session)
+    return session
+
+@app.get("/v1/chat/{pdf_id}/sessions/{session_id}")
+async def get_chat_session_history(pdf_id: str = Path(..., description="The unique identifier for the PDF"),
+                                   session_id: str = Path(..., description="The unique identifier for the session")):
+    return get_chat_session(pdf_id, session_id)
+
+@app.delete("/v1/chat/{pdf_id}/sessions/{session_id}", status_code=204)
+async def delete_chat_session(pdf_id: str = Path(..., description="The unique identifier for the PDF"),
+                              session_id: str = Path(..., description="The unique identifier for the session")):
+    get_chat_session(pdf_id, session_id)
+    registry.delete_session(session_id)
+
+@app.post("/v1/collections", status_code=201)
+async def create_collection(collection: CollectionCreate = Body(...)):
+    """
+    Endpoint for grouping uploaded PDFs into a collection that can be queried together.
+    """
+    missing = [pdf_id for pdf_id in collection.pdf_ids if not registry.get(pdf_id)]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"PDFs not found: {', '.join(missing)}")
+    created = Collection(collection_id=str(uuid.uuid4()), name=collection.name, pdf_ids=list(dict.fromkeys(collection.pdf_ids)))
+    registry.put_collection(created)
+    logger.info(f"Collection {created.collection_id} created with {len(created.pdf_ids)} PDFs.")
+    return created
+
+@app.get("/v1/collections/{collection_id}")
+async def get_collection(collection_id: str = Path(..., description="The unique identifier for the collection")):
+    collection = registry.get_collection(collection_id)
+    if not collection:
+        raise HTTPException(status_code=404, detail="Collection not found")
+    return collection
+
+@app.post("/v1/chat")
+async def chat_with_pdfs(request: Request, query: MultiQuery = Body(...)):
+    """
+    Endpoint for asking one question across several PDFs, given as pdf_ids,
+    a collection_id, or both. The top k chunks across all documents are used as context.
+    """
+    try:
+        pdf_ids = list(query.pdf_ids)
+        if query.collection_id:
+            collection = registry.get_collection(query.collection_id)
+            if not collection:
+                raise HTTPException(status_code=404, detail="Collection not found")
+            pdf_ids.extend(collection.pdf_ids)
+        pdf_ids = list(dict.fromkeys(pdf_ids))
+        if not pdf_ids:
+            raise HTTPException(status_code=422, detail="Provide pdf_ids or a collection_id.")
+        for pdf_id in pdf_ids:
+            get_ready_pdf(pdf_id)
+
+        embeddings = get_query_embeddings()
+        query_vector = await embed_query(embeddings, query.message)
+        docs, usage = pack_context(await retrieve(pdf_ids, embeddings, query_vector, query), query.message)
+        chain = get_shared_chain()
+
+        # The gateway times the queue wait and the call separately
+        response = await llm_gateway.invoke(chain, {"context": docs, "question": query.message}, client_key(request))
+        return {
+            "response": response.strip(),
+            "sources": cite_sources(docs),
+            "usage": usage,
+        }
+    except FileNotFoundError:
+        logger.error("Vector store for a PDF in the query not found on disk")
+        raise HTTPException(status_code=500, detail="Vector store for the PDF not found. Ensure it was correctly processed.")
+    except HTTPException as e:
+        logger.error(f"{str(e)}")
+        raise e
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
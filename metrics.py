@@ -0,0 +1,147 @@
+import time
+import logging
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict
+from fastapi import Request
+from starlette.middleware.base import BaseHTTPMiddleware
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+# Stages of ingestion and chat that are timed
+PARSE = "parse"
+OCR = "ocr"
+CHUNK = "chunk"
+EMBED = "embed"
+INDEX_BUILD = "index_build"
+INDEX_LOAD = "index_load"
+EMBED_QUERY = "embed_query"
+RETRIEVE = "retrieve"
+LLM_QUEUE = "llm_queue"
+LLM_FIRST_TOKEN = "llm_first_token"
+LLM_TOTAL = "llm_total"
+
+# Buckets from 1 ms to 10 minutes: retrieval sits at the low end, OCR of large documents at the top
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+stage_seconds = Histogram(
+    "pdf_chat_stage_seconds", "Time spent in each ingestion and chat stage.", ["stage"], buckets=STAGE_BUCKETS,
+)
+ingest_queue_depth = Gauge(
+    "pdf_chat_ingest_queue_depth", "Documents waiting for or running an ingestion stage.", ["stage"],
+)
+llm_in_flight = Gauge("pdf_chat_llm_in_flight", "Model calls holding a gateway slot.")
+llm_queue_depth = Gauge("pdf_chat_llm_queue_depth", "Requests waiting for a gateway slot.")
+llm_rejections = Counter("pdf_chat_llm_rejections", "Requests turned away by the LLM gateway with 503.", ["reason"])
+
+# Stage timings of the request being handled, reported in its Server-Timing header
+_request_timings: ContextVar = ContextVar("request_timings", default=None)
+
+
+def observe_stage(stage: str, seconds: float):
+    """
+    Record the duration of a stage in its histogram and in the Server-Timing
+    header of the current request.
+    """
+    stage_seconds.labels(stage=stage).observe(seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] += seconds
+
+
+@contextmanager
+def timed_stage(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+class StageClock:
+    """
+    Accumulate time per stage over interleaved steps, such as the chunk,
+    embed and index steps of a streamed document, so each stage is observed
+    once per document. Also usable in worker processes, whose totals are
+    returned to the parent and observed there.
+    """
+    def __init__(self):
+        self.seconds = defaultdict(float)
+
+    @contextmanager
+    def measure(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[stage] += time.perf_counter() - started
+
+    def observe(self):
+        for stage, seconds in self.seconds.items():
+            observe_stage(stage, seconds)
+
+
+class StatsCollector:
+    """
+    Expose the counters that components already keep in their stats() as
+    Prometheus metrics, read at scrape time.
+    """
+    def __init__(self, caches: Dict[str, Callable[[], dict]], embedding_stats: Callable[[], dict]):
+        self.caches = caches
+        self.embedding_stats = embedding_stats
+
+    def collect(self):
+        lookups = CounterMetricFamily("pdf_chat_cache_lookups", "Cache lookups by result.", labels=["cache", "result"])
+        evictions = CounterMetricFamily("pdf_chat_cache_evictions", "Entries evicted from each cache.", labels=["cache"])
+        entries = GaugeMetricFamily("pdf_chat_cache_entries", "Entries resident in each cache.", labels=["cache"])
+        for name, stats in self.caches.items():
+            values = stats()
+            lookups.add_metric([name, "hit"], values["hits"])
+            lookups.add_metric([name, "miss"], values["misses"])
+            evictions.add_metric([name], values["evictions"])
+            entries.add_metric([name], values["entries"])
+        yield lookups
+        yield evictions
+        yield entries
+
+        values = self.embedding_stats()
+        yield CounterMetricFamily("pdf_chat_embedding_requests", "Embedding API requests.", value=values["requests"])
+        yield CounterMetricFamily("pdf_chat_embedding_retries", "Embedding requests retried after a 429.", value=values["retries"])
+        yield CounterMetricFamily("pdf_chat_embedded_chunks", "Chunks embedded through the API.", value=values["chunks"])
+
+
+def register_stats(caches: Dict[str, Callable[[], dict]], embedding_stats: Callable[[], dict]):
+    REGISTRY.register(StatsCollector(caches, embedding_stats))
+
+
+def render_metrics():
+    """
+    Return the Prometheus text exposition of all metrics and its content type.
+    """
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def format_server_timing(timings: dict) -> str:
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+
+
+class ServerTimingMiddleware(BaseHTTPMiddleware):
+    """
+    Report the stages timed while handling a request in a Server-Timing
+    header, with the total handler time as "app". Streaming responses only
+    include the stages finished before the first byte was sent.
+    """
+    async def dispatch(self, request: Request, call_next):
+        timings = defaultdict(float)
+        token = _request_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            response = await call_next(request)
+        finally:
+            _request_timings.reset(token)
+        timings["app"] = time.perf_counter() - started
+        response.headers["Server-Timing"] = format_server_timing(timings)
+        return response
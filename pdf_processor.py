@@ -1,18 +1,48 @@
-import re
 #from PyPDF2 import PdfReader
 from pypdf import PdfReader
 import json
-from pdf2image import convert_from_bytes
-import pytesseract
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
 import os
-import google.generativeai as genai
+import time
+import shutil
+import hashlib
+import tempfile
+import uuid
 import logging
+from itertools import islice
+from functools import lru_cache
+from typing import Iterable, Iterator, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from index_cache import index_cache, index_path
+from index_store import faiss_store_class, load_store, save_store
+from semantic_cache import semantic_cache
+from embedding_cache import CachedEmbeddings
+from embedding_client import BatchedEmbeddings
+from providers import create_embeddings, embedding_limiter, embedding_model_name
+from lexical_index import BM25Index, lexical_cache
+from text_chunker import normalize_text, text_chunker
+from index_factory import build_index, compact_index, index_bytes, is_flat, load_index_params, save_index_params
+from metrics import PARSE, OCR, CHUNK, EMBED, INDEX_BUILD, INDEX_LOAD, StageClock
+from logging_config import worker_logging_args
 
 logger = logging.getLogger(__name__)
 
+# Worker processes for CPU-bound parsing and OCR, each with its own OCR pool
+PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS", "2"))
+# OCR settings: rasterization resolution, tesseract languages and worker processes per parse worker,
+# by default splitting the CPUs between the parse workers' pools
+OCR_DPI = int(os.getenv("OCR_DPI", "200"))
+OCR_LANG = os.getenv("OCR_LANG", "tur+eng")
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(max(1, (os.cpu_count() or 1) // max(1, PARSE_WORKERS)))))
+# Pages buffered while scanned pages in them are OCR'd in parallel
+OCR_WINDOW_PAGES = max(OCR_WORKERS, 1) * 4
+# Chunks embedded and added to the index per step while streaming a document
+EMBED_STREAM_CHUNKS = int(os.getenv("EMBED_STREAM_CHUNKS", "1000"))
+# Separates page records in extracted content files
+PAGE_SEPARATOR = "\f"
+
+_ocr_executor = None
+
 class PDFPasswordProtectedError(Exception):
     """Exception raised for password-protected PDFs."""
     def __init__(self, message="PDF is password protected and cannot be accessed without the correct password."):
@@ -21,12 +51,9 @@ class PDFPasswordProtectedError(Exception):
 
 def preprocess_text(text: str) -> str:
     """
-    Clean and preprocess extracted text.
+    Clean and preprocess extracted text, keeping its paragraph breaks.
     """
-    # Remove extra whitespace
-    text = re.sub(r'^\s*\w{1,2}\s*$', '', text, flags=re.MULTILINE)
-    text = re.sub(r'\s+', ' ', text, flags=re.MULTILINE)
-    return text.strip()
+    return normalize_text(text)
 
 def process_metadata(metadata):
     """
@@ -37,24 +64,107 @@ def process_metadata(metadata):
         return json.dumps({k: str(v) if v else "" for k, v in metadata.items()}, indent=4)
     return "{}"  # Return empty JSON string if no metadata
 
-def extract_text_with_ocr(pdf_file_stream):
+def _get_ocr_executor():
+    global _ocr_executor
+    if _ocr_executor is None:
+        _ocr_executor = ProcessPoolExecutor(max_workers=OCR_WORKERS, **worker_logging_args())
+    return _ocr_executor
+
+def _ocr_page(pdf_path: str, page_number: int, dpi: int, lang: str) -> str:
+    """
+    Rasterize a single page and run OCR on it, so only one page image is held at a time.
+    """
+    # The OCR stack is only imported by processes that OCR pages
+    import pytesseract
+    from pdf2image import convert_from_path
+
+    # Pages are already OCR'd in parallel; keep tesseract itself single-threaded
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+    images = convert_from_path(pdf_path, dpi=dpi, first_page=page_number, last_page=page_number)
+    if not images:
+        return ""
+    return pytesseract.image_to_string(images[0], lang=lang)
+
+def extract_text_with_ocr(pdf_file_stream, page_numbers=None, dpi=None, lang=None) -> dict:
     """
-    Extract text from a PDF file stream using OCR.
+    Extract text from a PDF file stream using OCR, one page per task.
+    Returns a dict mapping 1-based page numbers to their text; all pages are
+    processed when page_numbers is None.
     """
-    # Move to the beginning of the file stream
-    pdf_file_stream.seek(0)
-    # Read the entire file into a bytes object
-    pdf_bytes = pdf_file_stream.read()
+    dpi = dpi or OCR_DPI
+    lang = lang or OCR_LANG
 
-    # Convert PDF bytes to images
-    images = convert_from_bytes(pdf_bytes)
+    # Workers open the PDF by path; spool streams that aren't backed by a file
+    pdf_path = getattr(pdf_file_stream, "name", None)
+    temporary_path = None
+    if not isinstance(pdf_path, str) or not os.path.isfile(pdf_path):
+        pdf_file_stream.seek(0)
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as spooled:
+            for block in iter(lambda: pdf_file_stream.read(1024 * 1024), b""):
+                spooled.write(block)
+        pdf_path = temporary_path = spooled.name
 
-    # Extract text from each image using pytesseract
-    text = ''
-    for image in images:
-        text += pytesseract.image_to_string(image, lang='tur+eng')
+    try:
+        if page_numbers is None:
+            from pdf2image import pdfinfo_from_path
+            page_numbers = range(1, pdfinfo_from_path(pdf_path)["Pages"] + 1)
+        page_numbers = list(page_numbers)
+        args = ([pdf_path] * len(page_numbers), page_numbers, [dpi] * len(page_numbers), [lang] * len(page_numbers))
+
+        if OCR_WORKERS <= 1 or len(page_numbers) <= 1:
+            texts = map(_ocr_page, *args)
+        else:
+            texts = _get_ocr_executor().map(_ocr_page, *args)
+        return dict(zip(page_numbers, texts))
+    finally:
+        if temporary_path:
+            os.remove(temporary_path)
+
+def open_pdf(pdf_file) -> PdfReader:
+    """
+    Open a PDF for reading, raising PDFPasswordProtectedError if it cannot be
+    decrypted without a password.
+    """
+    reader = PdfReader(pdf_file)
+    if reader.is_encrypted and not reader.decrypt(''):
+        logger.error(f"Password-protected PDF error")
+        raise PDFPasswordProtectedError()
+    return reader
+
+def iter_pdf_pages(reader: PdfReader, pdf_file, clock: StageClock = None) -> Iterator[Tuple[int, str]]:
+    """
+    Yield (page_number, cleaned_text) for every page in order. Pages without a
+    text layer are buffered and OCR'd together, OCR_WINDOW_PAGES at a time.
+    Time spent in OCR is added to clock.
+    """
+    window = []
+    clock = clock or StageClock()
 
-    return text
+    def flush():
+        scanned = [number for number, text in window if not text]
+        ocr_texts = {}
+        if scanned:
+            with clock.measure(OCR):
+                ocr_texts = extract_text_with_ocr(pdf_file, page_numbers=scanned)
+        for number, text in window:
+            yield number, text or preprocess_text(ocr_texts.get(number, ""))
+        window.clear()
+
+    for number, page in enumerate(reader.pages, start=1):
+        raw_text = page.extract_text()
+        text = preprocess_text(raw_text) if raw_text else ""
+        # Parsed content streams and pages are not needed again, so don't let the object cache or
+        # the flattened page list grow with the page count; page count and metadata stay available
+        reader.resolved_objects.clear()
+        reader.flattened_pages[number - 1] = None
+        if text and not window:
+            yield number, text
+            continue
+        window.append((number, text))
+        if len(window) >= OCR_WINDOW_PAGES:
+            yield from flush()
+    if window:
+        yield from flush()
 
 def process_pdf(pdf_file) -> dict:
     """
@@ -62,47 +172,268 @@ def process_pdf(pdf_file) -> dict:
     """
     try:
         logger.info("Starting PDF processing")
-        reader = PdfReader(pdf_file)
+        reader = open_pdf(pdf_file)
+        text_content = "".join(text for _, text in iter_pdf_pages(reader, pdf_file))
         logger.info("PDF processed successfully")
-        text_content = ""
-
-        # Check if the PDF is encrypted
-        if reader.is_encrypted:
-            # If the PDF is encrypted and we cannot decrypt it (i.e., no password or wrong password provided)
-            if not reader.decrypt(''):  # You can replace '' with a password variable if needed
-                logger.error(f"Password-protected PDF error")
-                raise PDFPasswordProtectedError()
-
-        for page in reader.pages:
-            raw_text = page.extract_text()
-            if raw_text:
-                text_content += preprocess_text(raw_text)
-        
-        if not text_content:
-            # Attempt OCR if no text extracted
-            text_content = extract_text_with_ocr(pdf_file)
-
-        metadata = reader.metadata or {}
-
-
         return {
             "text": text_content,
-            "metadata": metadata
+            "metadata": reader.metadata or {},
+            "page_count": len(reader.pages)
         }
     except PDFPasswordProtectedError:
         raise
     except Exception as e:
-        print("Error processing the PDF")
         logger.error(f"Error processing PDF: {e}")
         raise RuntimeError(f"Error processing PDF: {e}")
 
+def check_pdf_access(pdf_file):
+    """
+    Raise PDFPasswordProtectedError if the PDF cannot be opened without a password.
+    """
+    open_pdf(pdf_file)
+    pdf_file.seek(0)
+
+def process_pdf_file(path: str, content_path: str) -> dict:
+    """
+    Extract a PDF stored on disk page by page into content_path, one page per
+    PAGE_SEPARATOR-terminated record. Runs in a worker process, so the result
+    only contains picklable values; stage timings are returned for the parent
+    to record.
+    """
+    os.makedirs(os.path.dirname(content_path) or ".", exist_ok=True)
+    clock = StageClock()
+    started = time.perf_counter()
+    # Hand pypdf the open file: given a path it would copy the whole document into memory
+    with open(path, "rb") as pdf_file, open(content_path, "w", encoding="utf-8") as content_file:
+        try:
+            reader = open_pdf(pdf_file)
+            for _, text in iter_pdf_pages(reader, pdf_file, clock):
+                content_file.write(text)
+                content_file.write(PAGE_SEPARATOR)
+            page_count = len(reader.pages)
+            metadata = process_metadata(reader.metadata or {})
+        except PDFPasswordProtectedError:
+            raise
+        except Exception as e:
+            logger.error(f"Error processing PDF: {e}")
+            raise RuntimeError(f"Error processing PDF: {e}")
+    # Parsing is everything but OCR
+    clock.seconds[PARSE] = time.perf_counter() - started - clock.seconds.get(OCR, 0.0)
+    return {
+        "metadata": metadata,
+        "page_count": page_count,
+        "timings": dict(clock.seconds),
+    }
+
+def read_pages(content_path: str, block_size: int = 1 << 20) -> Iterator[Tuple[int, str]]:
+    """
+    Yield (page_number, text) from a content file written by process_pdf_file
+    without reading the whole file into memory.
+    """
+    number = 0
+    pending = ""
+    with open(content_path, encoding="utf-8") as content_file:
+        while True:
+            block = content_file.read(block_size)
+            if not block:
+                break
+            *pages, pending = (pending + block).split(PAGE_SEPARATOR)
+            for text in pages:
+                number += 1
+                yield number, text
+    if pending:
+        yield number + 1, pending
+
 def get_text_chunks(text: str):
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-    chunks = text_splitter.split_text(text)
-    return chunks
-
-def get_vector_store(content: str, pdf_id: str):
-    text_chunks = get_text_chunks(content)
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-    vector_store = FAISS.from_texts(text_chunks, embedding=embeddings)
-    vector_store.save_local(pdf_id)    
\ No newline at end of file
+    return text_chunker.split(text)
+
+def iter_text_chunks(pages: Iterable[Tuple[int, str]]) -> Iterator[Tuple[str, dict]]:
+    """
+    Split each page into chunks as the pages arrive. Yields (text, metadata)
+    where metadata holds the page number, the chunk's character offsets within
+    the page text and its position in the document.
+    """
+    chunk_index = 0
+    for number, text in pages:
+        for start, end in text_chunker.spans(text):
+            yield text[start:end], {
+                "page": number,
+                "start_index": start,
+                "end_index": end,
+                "chunk_index": chunk_index,
+            }
+            chunk_index += 1
+
+def get_vector_store(pages: Iterable[Tuple[int, str]], pdf_id: str, on_progress=None):
+    """
+    Embed the chunks of the (page_number, text) pairs and save them, with their
+    page metadata, as the FAISS index for pdf_id, next to a BM25 index of the
+    same chunks. Chunks are embedded EMBED_STREAM_CHUNKS at a time, so the
+    whole document is never held in memory. on_progress(chunks_embedded,
+    chunks_total) is called after every batch; chunks_total grows as pages are read.
+    """
+    chunks_embedded = 0
+    chunks_total = 0
+
+    def advance(count):
+        nonlocal chunks_embedded
+        chunks_embedded += count
+        if on_progress:
+            on_progress(chunks_embedded, chunks_total)
+
+    embeddings = _document_embeddings(advance)
+    vector_store = None
+    lexical_index = BM25Index()
+    clock = StageClock()
+    chunks = iter_text_chunks(pages)
+    while True:
+        # Pages are read and split lazily, so chunking time is spent here
+        with clock.measure(CHUNK):
+            step = list(islice(chunks, EMBED_STREAM_CHUNKS))
+        if not step:
+            break
+        text_chunks = [text for text, _ in step]
+        metadatas = [metadata for _, metadata in step]
+        # Both indexes refer to a chunk by the same docstore id
+        ids = [str(uuid.uuid4()) for _ in step]
+        chunks_total += len(text_chunks)
+        with clock.measure(EMBED):
+            vectors = embeddings.embed_documents(text_chunks)
+        with clock.measure(INDEX_BUILD):
+            if vector_store is None:
+                vector_store = faiss_store_class().from_embeddings(list(zip(text_chunks, vectors)), embedding=embeddings, metadatas=metadatas, ids=ids)
+            else:
+                vector_store.add_embeddings(list(zip(text_chunks, vectors)), metadatas=metadatas, ids=ids)
+            lexical_index.add_many(zip(ids, text_chunks))
+    if vector_store is None:
+        raise ValueError("No text could be extracted from the PDF.")
+
+    _save_indexes(vector_store, lexical_index, pdf_id, clock)
+
+@lru_cache(maxsize=None)
+def get_document_embeddings():
+    """
+    Embeddings client shared by every document ingested in this process, so
+    concurrent and batch ingestion reuse one client and its connections.
+    """
+    return create_embeddings()
+
+def _document_embeddings(on_progress) -> CachedEmbeddings:
+    # Cache misses are embedded in concurrent, rate-limited batches
+    batched = BatchedEmbeddings(get_document_embeddings(), limiter=embedding_limiter(), on_progress=on_progress)
+    return CachedEmbeddings(batched, embedding_model_name(), on_progress=on_progress)
+
+def _save_indexes(vector_store, lexical_index: BM25Index, pdf_id: str, clock: StageClock, params: dict = None):
+    with clock.measure(INDEX_BUILD):
+        if is_flat(vector_store.index):
+            # Documents are built flat; large ones are compressed before saving
+            vector_store.index, params = build_index(vector_store.index)
+        else:
+            # A compressed index updated in place keeps its parameters and training
+            chunks = vector_store.index.ntotal
+            params = {**params, "chunks": chunks, "bytes_per_vector": round(index_bytes(vector_store.index) / max(1, chunks), 1)}
+        save_index_params(index_path(pdf_id), params)
+        save_store(vector_store, index_path(pdf_id))
+        lexical_index.save(index_path(pdf_id))
+    clock.observe()
+    # Drop any stale copy so the next chat loads the rewritten index
+    index_cache.invalidate(pdf_id)
+    lexical_cache.invalidate(pdf_id)
+    semantic_cache.invalidate(pdf_id)
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def update_vector_store(pages: Iterable[Tuple[int, str]], pdf_id: str, on_progress=None) -> dict:
+    """
+    Bring the saved indexes of pdf_id in line with a new version of the
+    document. Chunks whose text is already indexed keep their vectors and ids
+    and only get their page metadata refreshed; new chunks are embedded and
+    added, and chunks no longer present are deleted. The BM25 index, which
+    needs no embedding, is rebuilt. Returns the number of chunks kept, added
+    and removed.
+
+    Compressed indexes are updated in place: new vectors are encoded with
+    the trained codebooks and removed ones are dropped, so nothing is
+    embedded or trained again for the chunks that stay.
+    """
+    chunks_done = 0
+    chunks_total = 0
+
+    def advance(count):
+        nonlocal chunks_done
+        chunks_done += count
+        if on_progress:
+            on_progress(chunks_done, chunks_total)
+
+    embeddings = _document_embeddings(advance)
+    clock = StageClock()
+    with clock.measure(INDEX_LOAD):
+        vector_store = load_store(index_path(pdf_id), embeddings, writable=True)
+        params = load_index_params(index_path(pdf_id))
+    # Unclaimed ids of the stored chunks by text hash; a text can occur more than once
+    stored = {}
+    for doc_id in vector_store.index_to_docstore_id.values():
+        stored.setdefault(chunk_hash(vector_store.docstore.search(doc_id).page_content), []).append(doc_id)
+
+    kept = added = 0
+    chunks = iter_text_chunks(pages)
+    while True:
+        with clock.measure(CHUNK):
+            step = list(islice(chunks, EMBED_STREAM_CHUNKS))
+        if not step:
+            break
+        chunks_total += len(step)
+        new_chunks = []
+        for text, metadata in step:
+            ids = stored.get(chunk_hash(text))
+            if ids:
+                doc_id = ids.pop()
+                # The docstore has no update method, and add() replaces its dict, so write to the current one
+                vector_store.docstore._dict[doc_id] = Document(id=doc_id, page_content=text, metadata=metadata)
+                kept += 1
+            else:
+                new_chunks.append((text, metadata))
+        advance(len(step) - len(new_chunks))
+        if not new_chunks:
+            continue
+        text_chunks = [text for text, _ in new_chunks]
+        with clock.measure(EMBED):
+            vectors = embeddings.embed_documents(text_chunks)
+        with clock.measure(INDEX_BUILD):
+            vector_store.add_embeddings(
+                list(zip(text_chunks, vectors)),
+                metadatas=[metadata for _, metadata in new_chunks],
+                ids=[str(uuid.uuid4()) for _ in new_chunks],
+            )
+        added += len(new_chunks)
+
+    removed = [doc_id for ids in stored.values() for doc_id in ids]
+    if kept + added == 0:
+        raise ValueError("No text could be extracted from the PDF.")
+    with clock.measure(INDEX_BUILD):
+        if removed:
+            _delete_chunks(vector_store, removed)
+        lexical_index = BM25Index()
+        lexical_index.add_many(
+            (doc_id, vector_store.docstore.search(doc_id).page_content) for doc_id in vector_store.index_to_docstore_id.values()
+        )
+    _save_indexes(vector_store, lexical_index, pdf_id, clock, params)
+    return {"kept": kept, "added": added, "removed": len(removed)}
+
+def _delete_chunks(vector_store, doc_ids):
+    # LangChain's delete assumes FAISS renumbers the remaining vectors, which IVF indexes don't
+    removed = set(doc_ids)
+    keep = [position for position in range(vector_store.index.ntotal) if vector_store.index_to_docstore_id[position] not in removed]
+    vector_store.index = compact_index(vector_store.index, keep)
+    vector_store.index_to_docstore_id = {position: vector_store.index_to_docstore_id[old] for position, old in enumerate(keep)}
+    vector_store.docstore.delete(list(removed))
+
+def delete_indexes(pdf_id: str):
+    """
+    Remove the saved indexes of pdf_id and every cached copy of them.
+    """
+    shutil.rmtree(index_path(pdf_id), ignore_errors=True)
+    index_cache.invalidate(pdf_id)
+    lexical_cache.invalidate(pdf_id)
+    semantic_cache.invalidate(pdf_id)
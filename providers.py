@@ -0,0 +1,150 @@
+import os
+import time
+import asyncio
+import hashlib
+from typing import Any, AsyncIterator, Iterator, List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from embedding_client import rate_limiter
+from lexical_index import tokenize
+
+GOOGLE = "google"
+LOCAL = "local"
+
+# Backends for embeddings and answers: "google" (Gemini) or "local" (offline, for benchmarks and tests)
+PROVIDER = os.getenv("PROVIDER", GOOGLE)
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", PROVIDER)
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", PROVIDER)
+
+GOOGLE_EMBEDDING_MODEL = os.getenv("GOOGLE_EMBEDDING_MODEL", "models/embedding-001")
+GOOGLE_CHAT_MODEL = os.getenv("GOOGLE_CHAT_MODEL", "gemini-1.5-flash")
+LOCAL_EMBEDDING_DIM = int(os.getenv("LOCAL_EMBEDDING_DIM", "256"))
+# Simulated generation time of one local answer, spread over its streamed tokens
+LOCAL_LLM_LATENCY = float(os.getenv("LOCAL_LLM_LATENCY", "0"))
+LOCAL_LLM_MAX_WORDS = 60
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic offline embeddings: words and word bigrams are hashed into
+    signed buckets and the vector is L2-normalized. Texts sharing vocabulary
+    get similar vectors, which is enough to exercise retrieval end to end.
+    """
+    def __init__(self, dimensions: int = LOCAL_EMBEDDING_DIM):
+        self.dimensions = dimensions
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        words = tokenize(text)
+        for feature in words + [f"{first} {second}" for first, second in zip(words, words[1:])]:
+            bucket = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+            vector[bucket % self.dimensions] += 1.0 if bucket >> 63 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+class EchoChatModel(BaseChatModel):
+    """
+    Offline chat model that answers by quoting the start of the context it was
+    given, after a configurable delay. Streams one word per chunk.
+    """
+    latency: float = LOCAL_LLM_LATENCY
+    max_words: int = LOCAL_LLM_MAX_WORDS
+
+    @property
+    def _llm_type(self) -> str:
+        return "local-echo"
+
+    def _reply(self, messages: List[BaseMessage]) -> List[str]:
+        prompt = messages[-1].content
+        before_question, _, question = prompt.rpartition("Question:")
+        context = before_question.rpartition("Context:")[2].split()
+        words = context[:self.max_words] if context else question.split()
+        return [f"{word} " for word in words] or ["No context."]
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(self._reply(messages))))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(self._reply(messages))))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        words = self._reply(messages)
+        for word in words:
+            time.sleep(self.latency / len(words))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        words = self._reply(messages)
+        for word in words:
+            await asyncio.sleep(self.latency / len(words))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word))
+
+
+class UnlimitedRate:
+    """
+    Stand-in for the embedding rate limiter when embeddings are computed locally.
+    """
+    def acquire(self, tokens: float = 1.0):
+        pass
+
+
+def _require_google_api_key():
+    if not os.getenv("GOOGLE_API_KEY"):
+        raise ValueError("Gemini API Key not found in environment variables. Ensure it is set in the .env file.")
+
+
+def embedding_model_name(provider: str = None) -> str:
+    """
+    Name identifying the embedding model, used to key cached vectors.
+    """
+    provider = provider or EMBEDDING_PROVIDER
+    if provider == GOOGLE:
+        return GOOGLE_EMBEDDING_MODEL
+    if provider == LOCAL:
+        return f"local-hashing-{LOCAL_EMBEDDING_DIM}"
+    raise ValueError(f"Unknown embedding provider: {provider}")
+
+
+def create_embeddings(provider: str = None) -> Embeddings:
+    provider = provider or EMBEDDING_PROVIDER
+    if provider == GOOGLE:
+        _require_google_api_key()
+        # The Gemini SDK takes seconds to import, so it is only imported when a Google client is built
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        return GoogleGenerativeAIEmbeddings(model=GOOGLE_EMBEDDING_MODEL)
+    if provider == LOCAL:
+        return HashingEmbeddings()
+    raise ValueError(f"Unknown embedding provider: {provider}")
+
+
+def embedding_limiter(provider: str = None):
+    """
+    Request limiter for the embedding provider: the shared token bucket for
+    the Gemini API, none for local embeddings.
+    """
+    return rate_limiter if (provider or EMBEDDING_PROVIDER) == GOOGLE else UnlimitedRate()
+
+
+def create_chat_model(provider: str = None) -> BaseChatModel:
+    provider = provider or LLM_PROVIDER
+    if provider == GOOGLE:
+        _require_google_api_key()
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        # Rate-limited calls are retried only by llm_gateway, honoring Retry-After and
+        # LLM_MAX_RETRIES; the client's own retries would add their sleeps inside the slot
+        return ChatGoogleGenerativeAI(model=GOOGLE_CHAT_MODEL, max_retries=0)
+    if provider == LOCAL:
+        return EchoChatModel()
+    raise ValueError(f"Unknown LLM provider: {provider}")
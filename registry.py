@@ -0,0 +1,409 @@
+import os
+import socket
+import sqlite3
+import threading
+import logging
+from abc import ABC, abstractmethod
+from typing import Optional, List
+from data_models import PDF_File, Collection, ChatSession, PENDING, PARSING, EMBEDDING, READY, FAILED
+from index_cache import INDEX_ROOT
+from index_store import has_index
+
+logger = logging.getLogger(__name__)
+
+# Registry backend: "sqlite" (default, shared by all workers) or "memory"
+REGISTRY_BACKEND = os.getenv("REGISTRY_BACKEND", "sqlite")
+REGISTRY_PATH = os.getenv("REGISTRY_PATH", "registry.db")
+# Extracted text is kept on disk and only read on demand
+CONTENT_DIR = os.getenv("CONTENT_DIR", "content")
+
+FIELDS = list(PDF_File.model_fields)
+# Statuses of an ingestion owned by the process running it
+IN_PROGRESS = (PENDING, PARSING, EMBEDDING)
+INTERRUPTED_ERROR = "Ingestion was interrupted because the process running it stopped. Upload the file again."
+
+
+def _process_start(pid: int) -> Optional[str]:
+    """
+    Start time of process pid, which tells it apart from a later process
+    reusing the pid, or None if no such process is running.
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            return stat.read().rsplit(")", 1)[1].split()[19]
+    except OSError:
+        pass
+    # Without /proc, only check that the pid exists
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return None
+    except PermissionError:
+        pass
+    return ""
+
+
+def process_owner() -> str:
+    """
+    Identifier of the current process, recorded with the ingestions it runs.
+    """
+    pid = os.getpid()
+    return f"{socket.gethostname()}:{pid}:{_process_start(pid)}"
+
+
+def owner_alive(owner: Optional[str]) -> bool:
+    # Rows written before owners were recorded belong to processes that are gone
+    if not owner:
+        return False
+    host, pid, started = owner.rsplit(":", 2)
+    if host != socket.gethostname():
+        # Processes on other hosts can't be checked from here
+        return True
+    return _process_start(int(pid)) == started
+
+
+class DocumentRegistry(ABC):
+    """
+    Base class for PDF metadata, collection and chat session stores. Subclasses implement the
+    abstract storage methods; extracted text is kept in CONTENT_DIR.
+    """
+    def __init__(self, content_dir: str = CONTENT_DIR):
+        self.content_dir = content_dir
+
+    @abstractmethod
+    def get(self, pdf_id: str) -> Optional[PDF_File]:
+        ...
+
+    @abstractmethod
+    def put(self, pdf_file: PDF_File):
+        ...
+
+    @abstractmethod
+    def update(self, pdf_id: str, **fields):
+        ...
+
+    @abstractmethod
+    def claim(self, pdf_file: PDF_File) -> bool:
+        """
+        Replace the document with pdf_file, a new version to ingest, only if
+        it is ready or failed. Returns whether it was replaced, so of two
+        concurrent replacements only one goes ahead.
+        """
+
+    @abstractmethod
+    def delete(self, pdf_id: str):
+        """
+        Remove a document together with its chat sessions and its place in collections.
+        """
+
+    @abstractmethod
+    def find_by_digest(self, digest: str) -> Optional[PDF_File]:
+        ...
+
+    @abstractmethod
+    def list_ids(self) -> List[str]:
+        ...
+
+    @abstractmethod
+    def put_collection(self, collection: Collection):
+        ...
+
+    @abstractmethod
+    def get_collection(self, collection_id: str) -> Optional[Collection]:
+        ...
+
+    @abstractmethod
+    def put_session(self, session: ChatSession):
+        ...
+
+    @abstractmethod
+    def get_session(self, session_id: str) -> Optional[ChatSession]:
+        ...
+
+    @abstractmethod
+    def delete_session(self, session_id: str):
+        ...
+
+    def content_path(self, pdf_id: str) -> str:
+        return os.path.join(self.content_dir, f"{pdf_id}.txt")
+
+    def save_content(self, pdf_id: str, text: str):
+        os.makedirs(self.content_dir, exist_ok=True)
+        with open(self.content_path(pdf_id), "w", encoding="utf-8") as content_file:
+            content_file.write(text)
+
+    def load_content(self, pdf_id: str) -> str:
+        with open(self.content_path(pdf_id), encoding="utf-8") as content_file:
+            return content_file.read()
+
+    def delete_content(self, pdf_id: str):
+        if os.path.exists(self.content_path(pdf_id)):
+            os.remove(self.content_path(pdf_id))
+
+    def rebuild(self, index_root: str = INDEX_ROOT) -> int:
+        """
+        Register index directories left on disk that the registry doesn't
+        know about, e.g. from before a restart. Returns the number registered.
+        """
+        if not os.path.isdir(index_root):
+            return 0
+        known = set(self.list_ids())
+        registered = 0
+        for name in os.listdir(index_root):
+            if name in known or not has_index(os.path.join(index_root, name)):
+                continue
+            content_size = os.path.getsize(self.content_path(name)) if os.path.exists(self.content_path(name)) else 0
+            self.put(PDF_File(pdf_id=name, file_name="", size=content_size, status=READY))
+            registered += 1
+        if registered:
+            logger.info(f"Registered {registered} existing indexes from {index_root}")
+        return registered
+
+    def recover_interrupted(self) -> int:
+        """
+        Mark ingestions whose process stopped, e.g. in a restart, as failed,
+        so the document can be uploaded, replaced or deleted again. Returns
+        the number recovered. Memory registries don't outlive their process,
+        so they have nothing to recover.
+        """
+        return 0
+
+
+class MemoryRegistry(DocumentRegistry):
+    """
+    Registry held in process memory. Only suitable for a single worker.
+    """
+    def __init__(self, content_dir: str = CONTENT_DIR):
+        super().__init__(content_dir)
+        self._documents = {}
+        self._collections = {}
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, pdf_id: str) -> Optional[PDF_File]:
+        with self._lock:
+            pdf_file = self._documents.get(pdf_id)
+            return pdf_file.model_copy() if pdf_file else None
+
+    def put(self, pdf_file: PDF_File):
+        with self._lock:
+            self._documents[pdf_file.pdf_id] = pdf_file.model_copy()
+
+    def update(self, pdf_id: str, **fields):
+        with self._lock:
+            pdf_file = self._documents.get(pdf_id)
+            if pdf_file:
+                self._documents[pdf_id] = pdf_file.model_copy(update=fields)
+
+    def claim(self, pdf_file: PDF_File) -> bool:
+        with self._lock:
+            current = self._documents.get(pdf_file.pdf_id)
+            if not current or current.status not in (READY, FAILED):
+                return False
+            self._documents[pdf_file.pdf_id] = pdf_file.model_copy()
+            return True
+
+    def delete(self, pdf_id: str):
+        with self._lock:
+            self._documents.pop(pdf_id, None)
+            for collection in self._collections.values():
+                if pdf_id in collection.pdf_ids:
+                    collection.pdf_ids = [member for member in collection.pdf_ids if member != pdf_id]
+            self._sessions = {key: session for key, session in self._sessions.items() if session.pdf_id != pdf_id}
+
+    def find_by_digest(self, digest: str) -> Optional[PDF_File]:
+        with self._lock:
+            matches = [pdf_file for pdf_file in self._documents.values() if pdf_file.digest == digest]
+        # Prefer a usable copy over a failed ingestion of the same file
+        matches.sort(key=lambda pdf_file: pdf_file.status == FAILED)
+        return matches[0].model_copy() if matches else None
+
+    def list_ids(self) -> List[str]:
+        with self._lock:
+            return list(self._documents)
+
+    def put_collection(self, collection: Collection):
+        with self._lock:
+            self._collections[collection.collection_id] = collection.model_copy()
+
+    def get_collection(self, collection_id: str) -> Optional[Collection]:
+        with self._lock:
+            collection = self._collections.get(collection_id)
+            return collection.model_copy() if collection else None
+
+    def put_session(self, session: ChatSession):
+        with self._lock:
+            self._sessions[session.session_id] = session.model_copy(deep=True)
+
+    def get_session(self, session_id: str) -> Optional[ChatSession]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return session.model_copy(deep=True) if session else None
+
+    def delete_session(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+class SQLiteRegistry(DocumentRegistry):
+    """
+    Registry stored in a SQLite database in WAL mode, so every uvicorn worker
+    sees the same documents and ingestion status.
+    """
+    def __init__(self, path: str = REGISTRY_PATH, content_dir: str = CONTENT_DIR):
+        super().__init__(content_dir)
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                "pdf_id TEXT PRIMARY KEY, file_name TEXT, size INTEGER, metadata TEXT, page_count INTEGER, "
+                "digest TEXT, status TEXT, pages_parsed INTEGER, chunks_total INTEGER, chunks_embedded INTEGER, "
+                "error TEXT)"
+            )
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(documents)")]
+            if "owner" not in columns:
+                # Process running the ingestion, see process_owner
+                self._conn.execute("ALTER TABLE documents ADD COLUMN owner TEXT")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS documents_digest ON documents (digest)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS collections (collection_id TEXT PRIMARY KEY, name TEXT)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS collection_documents ("
+                "collection_id TEXT, position INTEGER, pdf_id TEXT, PRIMARY KEY (collection_id, position))"
+            )
+            # Sessions are small and bounded, so each one is stored as a JSON document
+            self._conn.execute("CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, pdf_id TEXT, data TEXT)")
+            self._conn.commit()
+        return self._conn
+
+    def _query(self, sql: str, params=()):
+        with self._lock:
+            return self._connection().execute(sql, params).fetchall()
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(sql, params)
+            conn.commit()
+
+    def get(self, pdf_id: str) -> Optional[PDF_File]:
+        rows = self._query(f"SELECT {', '.join(FIELDS)} FROM documents WHERE pdf_id = ?", (pdf_id,))
+        return PDF_File(**dict(zip(FIELDS, rows[0]))) if rows else None
+
+    def put(self, pdf_file: PDF_File):
+        values = pdf_file.model_dump()
+        owner = process_owner() if pdf_file.status in IN_PROGRESS else None
+        self._execute(
+            f"INSERT OR REPLACE INTO documents ({', '.join(FIELDS)}, owner) VALUES ({', '.join('?' * (len(FIELDS) + 1))})",
+            [*(values[field] for field in FIELDS), owner],
+        )
+
+    def update(self, pdf_id: str, **fields):
+        unknown = set(fields) - set(FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown registry fields: {unknown}")
+        columns = dict(fields)
+        if "status" in fields:
+            columns["owner"] = process_owner() if fields["status"] in IN_PROGRESS else None
+        assignments = ", ".join(f"{column} = ?" for column in columns)
+        self._execute(f"UPDATE documents SET {assignments} WHERE pdf_id = ?", [*columns.values(), pdf_id])
+
+    def claim(self, pdf_file: PDF_File) -> bool:
+        values = pdf_file.model_dump()
+        columns = [field for field in FIELDS if field != "pdf_id"]
+        owner = process_owner() if pdf_file.status in IN_PROGRESS else None
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                cursor = conn.execute(
+                    f"UPDATE documents SET {', '.join(f'{column} = ?' for column in columns)}, owner = ? "
+                    "WHERE pdf_id = ? AND status IN (?, ?)",
+                    [*(values[column] for column in columns), owner, pdf_file.pdf_id, READY, FAILED],
+                )
+        return cursor.rowcount == 1
+
+    def recover_interrupted(self) -> int:
+        rows = self._query(f"SELECT pdf_id, owner FROM documents WHERE status IN ({', '.join('?' * len(IN_PROGRESS))})", IN_PROGRESS)
+        recovered = 0
+        for pdf_id, owner in rows:
+            if owner_alive(owner):
+                continue
+            # Only if no process claimed the document since it was read
+            with self._lock:
+                conn = self._connection()
+                with conn:
+                    cursor = conn.execute(
+                        "UPDATE documents SET status = ?, error = ?, owner = NULL WHERE pdf_id = ? AND owner IS ?",
+                        (FAILED, INTERRUPTED_ERROR, pdf_id, owner),
+                    )
+            recovered += cursor.rowcount
+        if recovered:
+            logger.warning(f"Marked {recovered} interrupted ingestions as failed")
+        return recovered
+
+    def delete(self, pdf_id: str):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute("DELETE FROM documents WHERE pdf_id = ?", (pdf_id,))
+                conn.execute("DELETE FROM collection_documents WHERE pdf_id = ?", (pdf_id,))
+                conn.execute("DELETE FROM sessions WHERE pdf_id = ?", (pdf_id,))
+
+    def find_by_digest(self, digest: str) -> Optional[PDF_File]:
+        rows = self._query(f"SELECT {', '.join(FIELDS)} FROM documents WHERE digest = ? ORDER BY status = ? LIMIT 1", (digest, FAILED))
+        return PDF_File(**dict(zip(FIELDS, rows[0]))) if rows else None
+
+    def list_ids(self) -> List[str]:
+        return [row[0] for row in self._query("SELECT pdf_id FROM documents")]
+
+    def put_collection(self, collection: Collection):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO collections (collection_id, name) VALUES (?, ?)",
+                    (collection.collection_id, collection.name),
+                )
+                conn.execute("DELETE FROM collection_documents WHERE collection_id = ?", (collection.collection_id,))
+                conn.executemany(
+                    "INSERT INTO collection_documents (collection_id, position, pdf_id) VALUES (?, ?, ?)",
+                    [(collection.collection_id, position, pdf_id) for position, pdf_id in enumerate(collection.pdf_ids)],
+                )
+
+    def get_collection(self, collection_id: str) -> Optional[Collection]:
+        rows = self._query("SELECT name FROM collections WHERE collection_id = ?", (collection_id,))
+        if not rows:
+            return None
+        pdf_ids = self._query(
+            "SELECT pdf_id FROM collection_documents WHERE collection_id = ? ORDER BY position", (collection_id,)
+        )
+        return Collection(collection_id=collection_id, name=rows[0][0], pdf_ids=[row[0] for row in pdf_ids])
+
+    def put_session(self, session: ChatSession):
+        self._execute(
+            "INSERT OR REPLACE INTO sessions (session_id, pdf_id, data) VALUES (?, ?, ?)",
+            (session.session_id, session.pdf_id, session.model_dump_json()),
+        )
+
+    def get_session(self, session_id: str) -> Optional[ChatSession]:
+        rows = self._query("SELECT data FROM sessions WHERE session_id = ?", (session_id,))
+        return ChatSession.model_validate_json(rows[0][0]) if rows else None
+
+    def delete_session(self, session_id: str):
+        self._execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+
+def create_registry(backend: str = REGISTRY_BACKEND) -> DocumentRegistry:
+    if backend == "sqlite":
+        return SQLiteRegistry()
+    if backend == "memory":
+        return MemoryRegistry()
+    raise ValueError(f"Unknown registry backend: {backend}")
+
+
+registry = create_registry()
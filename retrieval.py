@@ -0,0 +1,175 @@
+import os
+import time
+import asyncio
+import logging
+from typing import List, Optional, Tuple
+import numpy as np
+from langchain_core.documents import Document
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+from index_cache import index_path, load_index, recently_used_indexes
+from index_store import chunk_positions, faiss_store_class, prefetch
+from lexical_index import load_lexical_index
+from data_models import VECTOR, LEXICAL, HYBRID
+
+logger = logging.getLogger(__name__)
+
+# Per-document index searches running at once for a multi-document query
+SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", "16"))
+# Rank offset of reciprocal rank fusion; larger values flatten the weight of top ranks
+RRF_K = int(os.getenv("RRF_K", "60"))
+# MMR trade-off between relevance (1.0) and diversity (0.0)
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.5"))
+# Characters of chunk text quoted in a citation
+SNIPPET_CHARS = int(os.getenv("CITATION_SNIPPET_CHARS", "200"))
+# Most recently used indexes loaded at startup, before the process serves requests
+INDEX_WARMUP_COUNT = int(os.getenv("INDEX_WARMUP_COUNT", "0"))
+
+
+def cite_sources(docs) -> List[dict]:
+    """
+    Describe retrieved chunks as citations: chunk id, page, character offsets
+    within the page text and a snippet. Indexes built before chunks carried
+    page metadata report the page as None.
+    """
+    sources = []
+    for doc in docs:
+        snippet = doc.page_content
+        if len(snippet) > SNIPPET_CHARS:
+            snippet = snippet[:SNIPPET_CHARS].rsplit(" ", 1)[0] + "..."
+        source = {
+            "chunk_id": doc.id,
+            "page": doc.metadata.get("page"),
+            "start_index": doc.metadata.get("start_index"),
+            "end_index": doc.metadata.get("end_index"),
+            "snippet": snippet,
+        }
+        if "pdf_id" in doc.metadata:
+            source = {"pdf_id": doc.metadata["pdf_id"], **source}
+        sources.append(source)
+    return sources
+
+
+def reciprocal_rank_fusion(rankings: List[List[Document]], k: int = RRF_K) -> List[Document]:
+    """
+    Merge ranked lists of chunks by summing 1 / (k + rank) over the lists each
+    chunk appears in.
+    """
+    scores = {}
+    docs = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            key = (doc.metadata.get("pdf_id"), doc.id)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            docs.setdefault(key, doc)
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+
+def _scaled_to_best(hits: List[Tuple[Document, float]]) -> List[Tuple[Document, float]]:
+    # BM25 hits of one document, scored relative to its best hit
+    best = max((score for _, score in hits), default=0.0)
+    return [(doc, score / best) for doc, score in hits] if best > 0 else hits
+
+
+def _tag(doc: Document, pdf_id: str) -> Document:
+    # Copy so the cached index's documents aren't modified
+    return doc.model_copy(update={"metadata": {**doc.metadata, "pdf_id": pdf_id}})
+
+
+def warm_indexes(embeddings, count: int = INDEX_WARMUP_COUNT) -> List[str]:
+    """
+    Import the FAISS stack and load the count most recently used vector and
+    BM25 indexes into their caches, with their files read ahead into the
+    page cache, so the first chat requests don't pay for it. Returns the
+    ids of the loaded indexes.
+    """
+    started = time.perf_counter()
+    faiss_store_class()
+    warmed = []
+    for pdf_id in recently_used_indexes(count):
+        try:
+            prefetch(index_path(pdf_id))
+            # Not a use, or every restart would warm the same indexes again
+            load_index(pdf_id, embeddings, record=False)
+            load_lexical_index(pdf_id)
+        except Exception as e:
+            logger.warning(f"Could not warm up index {pdf_id}: {e}")
+            continue
+        warmed.append(pdf_id)
+    logger.info(f"Warmed up {len(warmed)} indexes in {time.perf_counter() - started:.2f}s.")
+    return warmed
+
+
+def _search_index(pdf_id: str, embeddings, query_text: Optional[str], query_vector, fetch_k: int, mode: str, with_vectors: bool):
+    vector_store = load_index(pdf_id, embeddings)
+    lexical = []
+    lexical_index = load_lexical_index(pdf_id) if mode != VECTOR and query_text else None
+    if lexical_index is not None:
+        for doc_id, score in lexical_index.search(query_text, fetch_k):
+            doc = vector_store.docstore.search(doc_id)
+            if isinstance(doc, Document):
+                lexical.append((_tag(doc, pdf_id), score))
+
+    dense = []
+    # Documents indexed before lexical indexes existed fall back to vector search
+    if mode != LEXICAL or lexical_index is None:
+        dense = [(_tag(doc, pdf_id), distance)
+                 for doc, distance in vector_store.similarity_search_with_score_by_vector(query_vector, k=fetch_k)]
+
+    vectors = {}
+    if with_vectors:
+        positions = chunk_positions(vector_store, {doc.id for doc, _ in dense + lexical})
+        for doc, _ in dense + lexical:
+            vectors[(pdf_id, doc.id)] = vector_store.index.reconstruct(positions[doc.id])
+    return dense, lexical, vectors
+
+
+async def scatter_gather_search(pdf_ids: List[str], embeddings, query_vector, k: int = 4, query_text: str = None,
+                                fetch_k: int = None, mode: str = VECTOR, mmr: bool = False, prior_ids: List[str] = ()):
+    """
+    Search every document's indexes in parallel and merge the results into
+    the overall top k. All FAISS indexes share one embedding model, so their
+    L2 distances are directly comparable. BM25 scores depend on each
+    document's own term statistics, so they are scaled by the document's
+    best score before its hits are merged with the others.
+
+    mode "vector" ranks by embedding distance, "lexical" by BM25 and "hybrid"
+    fuses both rankings with reciprocal rank fusion. fetch_k candidates are
+    gathered from each ranking; with mmr the final k are picked from them by
+    maximal marginal relevance to avoid near-duplicate context. Candidates
+    in prior_ids, the chunks behind the previous answer in a conversation,
+    are ranked up so a follow-up keeps the context it builds on.
+    """
+    fetch_k = max(fetch_k or k, k)
+    semaphore = asyncio.Semaphore(SEARCH_CONCURRENCY)
+
+    async def search(pdf_id):
+        async with semaphore:
+            # Index loads and FAISS searches release the GIL, so threads run them in parallel
+            return await asyncio.to_thread(_search_index, pdf_id, embeddings, query_text, query_vector, fetch_k, mode, mmr)
+
+    per_document = await asyncio.gather(*(search(pdf_id) for pdf_id in pdf_ids))
+    dense = sorted((hit for hits, _, _ in per_document for hit in hits), key=lambda hit: hit[1])[:fetch_k]
+    lexical = sorted((hit for _, hits, _ in per_document for hit in _scaled_to_best(hits)), key=lambda hit: hit[1], reverse=True)[:fetch_k]
+    dense_docs = [doc for doc, _ in dense]
+    lexical_docs = [doc for doc, _ in lexical]
+
+    if mode == HYBRID:
+        ranked = reciprocal_rank_fusion([dense_docs, lexical_docs])
+    else:
+        ranked = (lexical_docs or dense_docs) if mode == LEXICAL else dense_docs
+
+    if prior_ids:
+        prior_ids = set(prior_ids)
+        ranked = reciprocal_rank_fusion([ranked, [doc for doc in ranked if doc.id in prior_ids]])
+
+    if mmr and len(ranked) > k:
+        vectors = {key: vector for _, _, document_vectors in per_document for key, vector in document_vectors.items()}
+        candidates = ranked[:fetch_k]
+        selected = maximal_marginal_relevance(
+            np.asarray(query_vector, dtype=np.float32),
+            [vectors[(doc.metadata["pdf_id"], doc.id)] for doc in candidates],
+            lambda_mult=MMR_LAMBDA,
+            k=k,
+        )
+        return [candidates[index] for index in selected]
+    return ranked[:k]
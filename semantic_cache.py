@@ -0,0 +1,117 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from itertools import count
+from typing import Optional, List
+import numpy as np
+
+# Minimum cosine similarity between questions for a cached answer to be reused
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "10000"))
+SEMANTIC_CACHE_TTL_SECONDS = float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "3600"))
+
+
+class CachedAnswer:
+    def __init__(self, pdf_id: str, version: str, vector: np.ndarray, answer: str, chunk_ids: List[str], created: float,
+                 sources: List[dict] = None):
+        self.pdf_id = pdf_id
+        self.version = version
+        self.vector = vector
+        self.answer = answer
+        self.chunk_ids = chunk_ids
+        self.created = created
+        self.sources = sources or []
+
+
+class SemanticCache:
+    """
+    LRU cache of answers per pdf_id, looked up by cosine similarity of the
+    question embedding. Entries are only reused for the same document version.
+    """
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD, max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = SEMANTIC_CACHE_TTL_SECONDS, clock=time.monotonic):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._by_pdf = {}
+        self._ids = count()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        keys = self._by_pdf[entry.pdf_id]
+        keys.remove(entry_id)
+        if not keys:
+            del self._by_pdf[entry.pdf_id]
+
+    def lookup(self, pdf_id: str, version: str, vector) -> Optional[CachedAnswer]:
+        """
+        Return the cached answer to the most similar earlier question, if it is
+        within the threshold, or None.
+        """
+        query = self._normalize(vector)
+        now = self._clock()
+        with self._lock:
+            candidates = []
+            for entry_id in list(self._by_pdf.get(pdf_id, ())):
+                entry = self._entries[entry_id]
+                if entry.version != version or now - entry.created > self.ttl_seconds:
+                    self._remove(entry_id)
+                    continue
+                candidates.append(entry_id)
+
+            if candidates:
+                similarities = np.stack([self._entries[entry_id].vector for entry_id in candidates]) @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self._entries.move_to_end(candidates[best])
+                    self.hits += 1
+                    return self._entries[candidates[best]]
+            self.misses += 1
+            return None
+
+    def store(self, pdf_id: str, version: str, vector, answer: str, chunk_ids: List[str] = None, sources: List[dict] = None):
+        entry = CachedAnswer(pdf_id, version, self._normalize(vector), answer, chunk_ids or [], self._clock(), sources)
+        with self._lock:
+            entry_id = next(self._ids)
+            self._entries[entry_id] = entry
+            self._by_pdf.setdefault(pdf_id, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, pdf_id: str):
+        with self._lock:
+            for entry_id in list(self._by_pdf.get(pdf_id, ())):
+                self._remove(entry_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_pdf.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+semantic_cache = SemanticCache()
@@ -0,0 +1,76 @@
+import os
+import re
+from typing import List, Optional
+from data_models import ChatSession, ChatTurn
+
+# Turns kept verbatim in a session; older turns only keep their question in the summary
+SESSION_HISTORY_TURNS = int(os.getenv("SESSION_HISTORY_TURNS", "4"))
+# Characters of each earlier answer repeated in the prompt
+SESSION_ANSWER_CHARS = int(os.getenv("SESSION_ANSWER_CHARS", "600"))
+SESSION_SUMMARY_CHARS = int(os.getenv("SESSION_SUMMARY_CHARS", "1000"))
+
+# Short questions, or questions referring back with one of these words, are follow-ups
+FOLLOW_UP_MAX_WORDS = 4
+FOLLOW_UP_WORDS = {
+    "it", "its", "this", "that", "these", "those", "they", "them", "their", "he", "she", "his", "her",
+    "above", "previous", "same", "also", "more", "else", "other",
+    "bu", "şu", "o", "bunu", "onu", "bunun", "onun", "bunlar", "onlar", "aynı", "peki",
+}
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def is_follow_up(message: str) -> bool:
+    words = WORD_PATTERN.findall(message.lower())
+    return len(words) <= FOLLOW_UP_MAX_WORDS or any(word in FOLLOW_UP_WORDS for word in words)
+
+
+def condense_query(session: Optional[ChatSession], message: str) -> str:
+    """
+    Build the retrieval query for a message: a follow-up is searched together
+    with the previous question it refers to, a standalone question on its own.
+    """
+    if not session or not session.turns or not is_follow_up(message):
+        return message
+    return f"{session.turns[-1].question} {message}"
+
+
+def prior_chunk_ids(session: Optional[ChatSession]) -> List[str]:
+    """
+    Chunks that answered the previous turn, to be preferred if they are still
+    among the candidates for this one.
+    """
+    if not session or not session.turns:
+        return []
+    return session.turns[-1].chunk_ids
+
+
+def question_with_history(session: Optional[ChatSession], message: str) -> str:
+    """
+    Prefix the question with the summary and window of earlier turns.
+    """
+    if not session or not session.turns:
+        return message
+    lines = []
+    if session.summary:
+        lines.append(f"Earlier questions: {session.summary}")
+    for turn in session.turns:
+        answer = turn.answer
+        if len(answer) > SESSION_ANSWER_CHARS:
+            answer = answer[:SESSION_ANSWER_CHARS].rsplit(" ", 1)[0] + "..."
+        lines.append(f"User: {turn.question}\nAssistant: {answer}")
+    history = "\n".join(lines)
+    return f"Conversation so far:\n{history}\n\nCurrent question: {message}"
+
+
+def add_turn(session: ChatSession, question: str, answer: str, chunk_ids: List[str], created: float) -> ChatSession:
+    """
+    Append a turn, moving turns beyond SESSION_HISTORY_TURNS into the summary.
+    """
+    turns = [*session.turns, ChatTurn(question=question, answer=answer, chunk_ids=chunk_ids, created=created)]
+    summary = session.summary
+    while len(turns) > SESSION_HISTORY_TURNS:
+        dropped = turns.pop(0).question
+        summary = f"{summary}; {dropped}" if summary else dropped
+    if len(summary) > SESSION_SUMMARY_CHARS:
+        summary = "..." + summary[-SESSION_SUMMARY_CHARS:]
+    return session.model_copy(update={"turns": turns, "summary": summary})
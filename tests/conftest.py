@@ -0,0 +1,7 @@
+import os
+import tempfile
+
+
+def pytest_configure(config):
+    # Log records of test runs go to a temporary directory instead of app.log in the working directory
+    os.environ.setdefault("LOG_FILE", os.path.join(tempfile.mkdtemp(prefix="pdf-chat-tests-"), "app.log"))
@@ -0,0 +1,85 @@
+import pytest
+import asyncio
+import time
+from unittest.mock import MagicMock, AsyncMock, patch
+import sys
+import os
+import httpx
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from main import app
+from llm_gateway import LLMGateway
+from registry import MemoryRegistry
+from data_models import PDF_File, READY
+
+# Simulated Gemini latency per answer
+LLM_LATENCY = 0.1
+
+
+async def slow_answer(inputs):
+    await asyncio.sleep(LLM_LATENCY)
+    return "answer"
+
+
+async def run_chats(concurrency: int, requests: int) -> float:
+    """Send requests chats with at most concurrency in flight; return the elapsed seconds."""
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        async def chat():
+            async with semaphore:
+                response = await client.post("/v1/chat/load-pdf", json={"message": "Question?"})
+                assert response.status_code == 200
+
+        started = time.perf_counter()
+        await asyncio.gather(*(chat() for _ in range(requests)))
+        return time.perf_counter() - started
+
+
+@pytest.fixture
+def stubbed_chat():
+    registry = MemoryRegistry()
+    registry.put(PDF_File(pdf_id="load-pdf", file_name="load.pdf", size=1, status=READY))
+    chain = MagicMock()
+    chain.ainvoke = slow_answer
+    embeddings = MagicMock()
+    embeddings.aembed_query = AsyncMock(return_value=[1.0])
+    # Every question is identical, so the answer cache is disabled to measure Gemini calls
+    answer_cache = MagicMock()
+    answer_cache.lookup.return_value = None
+    with patch("main.registry", registry), \
+         patch("main.scatter_gather_search", AsyncMock(return_value=[])), \
+         patch("main.get_shared_chain", return_value=chain), \
+         patch("main.get_query_embeddings", return_value=embeddings), \
+         patch("main.semantic_cache", answer_cache):
+        yield
+
+
+def test_chat_throughput_scales_with_concurrency(stubbed_chat):
+    """Load test: one worker keeps many slow Gemini calls in flight at once."""
+    requests = 20
+    serial = asyncio.run(run_chats(concurrency=1, requests=requests))
+    concurrent = asyncio.run(run_chats(concurrency=requests, requests=requests))
+
+    assert serial >= requests * LLM_LATENCY
+    # With a non-blocking handler all 20 calls overlap instead of queueing
+    assert concurrent < serial / 5
+
+
+def test_overload_degrades_to_503_with_retry_after(stubbed_chat):
+    """Load test: beyond the gateway's capacity and queue, requests get 503s instead of 500s."""
+    gateway = LLMGateway(max_concurrency=2, max_queue=4, queue_timeout=5)
+
+    async def burst():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*(client.post("/v1/chat/load-pdf", json={"message": "Question?"}) for _ in range(20)))
+
+    with patch("main.llm_gateway", gateway):
+        responses = asyncio.run(burst())
+
+    statuses = [response.status_code for response in responses]
+    # Two calls run and four wait; the rest are turned away at once
+    assert statuses.count(200) == 6
+    assert statuses.count(503) == 14
+    assert all(int(response.headers["Retry-After"]) >= 1 for response in responses if response.status_code == 503)
@@ -0,0 +1,69 @@
+import pytest
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from langchain_core.documents import Document
+from context_packing import ContextPacker, count_tokens
+
+
+def chunk(doc_id, text, page=1, start=0, pdf_id="pdf-1"):
+    return Document(id=doc_id, page_content=text,
+                    metadata={"pdf_id": pdf_id, "page": page, "start_index": start, "end_index": start + len(text)})
+
+
+def test_count_tokens_estimate():
+    """Test the character based token estimate."""
+    assert count_tokens("") == 0
+    assert count_tokens("abcd") == 1
+    assert count_tokens("abcde") == 2
+
+
+def test_pack_sends_chunk_overlap_once():
+    """Test that the overlap between neighbouring chunks of a page is removed."""
+    page = "".join(f"word{i} " for i in range(60))
+    first = chunk("c-1", page[:200], start=0)
+    second = chunk("c-2", page[150:350], start=150)
+
+    packed = ContextPacker(token_budget=1000).pack([first, second])
+
+    assert [doc.page_content for doc in packed.docs] == [page[:200], page[200:350]]
+    assert packed.docs[1].metadata["start_index"] == 200
+    # The retrieved documents are not modified
+    assert second.page_content == page[150:350]
+
+
+def test_pack_drops_covered_and_near_duplicate_chunks():
+    """Test that chunks adding nothing new are skipped."""
+    text = "The pump must be calibrated every twelve months by a certified technician on site."
+    packed = ContextPacker(token_budget=1000).pack([
+        chunk("c-1", text, page=1),
+        chunk("c-2", text[10:40], page=1, start=10),
+        chunk("c-3", text + " Again.", page=7),
+        chunk("c-4", "Valves are replaced after ten thousand cycles.", page=8),
+    ])
+
+    assert [doc.id for doc in packed.docs] == ["c-1", "c-4"]
+    assert packed.dropped == 2
+
+
+def test_pack_respects_token_budget():
+    """Test that packing stops at the budget and truncates a chunk that would overflow it."""
+    docs = [chunk(f"c-{i}", " ".join(f"term{i}x{j}" for j in range(80)), page=i) for i in range(5)]
+    packer = ContextPacker(token_budget=400)
+
+    packed = packer.pack(docs)
+
+    assert packed.context_tokens <= 400
+    assert sum(count_tokens(doc.page_content) for doc in packed.docs) <= 400
+    assert packed.docs[0].page_content == docs[0].page_content
+
+
+def test_pack_truncates_single_oversized_chunk():
+    """Test that a first chunk larger than the whole budget is cut instead of overflowing."""
+    doc = chunk("c-1", "alpha " * 500)
+    packed = ContextPacker(token_budget=100).pack([doc])
+
+    assert len(packed.docs) == 1
+    assert 0 < packed.context_tokens <= 100
+    assert packed.docs[0].metadata["end_index"] == len(packed.docs[0].page_content)
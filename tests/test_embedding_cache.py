@@ -0,0 +1,57 @@
+import pytest
+from unittest.mock import MagicMock
+from io import BytesIO
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from embedding_cache import EmbeddingCache, CachedEmbeddings, embedding_key, file_digest
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return EmbeddingCache(str(tmp_path / "embeddings.db"))
+
+
+def test_embedding_key_depends_on_model_and_text():
+    """Test that the cache key changes with either the model or the text."""
+    assert embedding_key("m1", "text") == embedding_key("m1", "text")
+    assert embedding_key("m1", "text") != embedding_key("m2", "text")
+    assert embedding_key("m1", "text") != embedding_key("m1", "other")
+
+
+def test_file_digest_rewinds_stream():
+    """Test hashing a stream leaves it at the beginning."""
+    stream = BytesIO(b"%PDF-1.4 content")
+    digest = file_digest(stream)
+    assert len(digest) == 64
+    assert stream.read() == b"%PDF-1.4 content"
+
+
+def test_cached_embeddings_only_embeds_misses(cache):
+    """Test that only uncached, deduplicated texts reach the embedder."""
+    embedder = MagicMock()
+    embedder.embed_documents.side_effect = lambda texts: [[float(len(t)), 0.5] for t in texts]
+    cached = CachedEmbeddings(embedder, "model", cache=cache)
+
+    first = cached.embed_documents(["a", "bb", "a"])
+    assert first == [[1.0, 0.5], [2.0, 0.5], [1.0, 0.5]]
+    embedder.embed_documents.assert_called_once_with(["a", "bb"])
+
+    embedder.embed_documents.reset_mock()
+    second = cached.embed_documents(["bb", "ccc"])
+    assert second == [[2.0, 0.5], [3.0, 0.5]]
+    embedder.embed_documents.assert_called_once_with(["ccc"])
+
+
+def test_cached_embeddings_full_hit_makes_no_calls(cache):
+    """Test that re-embedding identical chunks never calls the embedder."""
+    embedder = MagicMock()
+    embedder.embed_documents.side_effect = lambda texts: [[1.0] for _ in texts]
+    CachedEmbeddings(embedder, "model", cache=cache).embed_documents(["x", "y"])
+
+    embedder.embed_documents.reset_mock()
+    again = CachedEmbeddings(embedder, "model", cache=cache)
+    assert again.embed_documents(["x", "y"]) == [[1.0], [1.0]]
+    embedder.embed_documents.assert_not_called()
+    assert again.hits == 2
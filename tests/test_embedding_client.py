@@ -0,0 +1,123 @@
+import pytest
+from unittest.mock import MagicMock
+import sys
+import os
+import time
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from google.api_core import exceptions as google_exceptions
+from embedding_client import TokenBucket, EmbeddingMetrics, BatchedEmbeddings, retry_after, backoff_delay
+
+
+def rate_limit_error(retry_after_seconds="2"):
+    response = httpx.Response(429, headers={"Retry-After": retry_after_seconds}, request=httpx.Request("POST", "http://test"))
+    return httpx.HTTPStatusError("429 Too Many Requests", request=response.request, response=response)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_token_bucket_throttles_to_rate():
+    """Test that acquiring past the burst capacity waits for refills."""
+    clock = FakeClock()
+    bucket = TokenBucket(rate_per_second=2, capacity=2, clock=clock, sleep=clock.sleep)
+    for _ in range(6):
+        bucket.acquire()
+    # Two tokens are available immediately, the other four refill at 2/s
+    assert clock.now == pytest.approx(2.0)
+
+
+def test_retry_after_reads_header_and_exception_chain():
+    """Test Retry-After extraction, including from wrapped exceptions."""
+    assert retry_after(rate_limit_error("3")) == 3.0
+
+    try:
+        try:
+            raise google_exceptions.ResourceExhausted("quota")
+        except Exception as e:
+            raise RuntimeError("Error embedding content") from e
+    except RuntimeError as wrapped:
+        assert retry_after(wrapped) == 0.0
+
+    assert retry_after(ValueError("bad input")) is None
+
+
+def test_backoff_delay_respects_server_delay():
+    """Test that jittered backoff never undercuts Retry-After."""
+    assert backoff_delay(0, server_delay=5.0) >= 5.0
+    assert 0 <= backoff_delay(3) <= 8.0
+
+
+def make_batched(embedder, **kwargs):
+    limiter = MagicMock()
+    sleep = MagicMock()
+    batched = BatchedEmbeddings(embedder, limiter=limiter, metrics=EmbeddingMetrics(), sleep=sleep, **kwargs)
+    return batched, limiter, sleep
+
+
+def test_batched_embeddings_preserves_order():
+    """Test fixed-size batches are embedded concurrently and reassembled in order."""
+    embedder = MagicMock()
+    embedder.embed_documents.side_effect = lambda batch: [[float(text)] for text in batch]
+    progress = []
+    batched, limiter, _ = make_batched(embedder, batch_size=3, max_in_flight=2, on_progress=progress.append)
+
+    texts = [str(i) for i in range(10)]
+    vectors = batched.embed_documents(texts)
+
+    assert vectors == [[float(i)] for i in range(10)]
+    assert embedder.embed_documents.call_count == 4
+    assert limiter.acquire.call_count == 4
+    assert sum(progress) == 10
+    assert batched.metrics.stats()["chunks"] == 10
+
+
+def test_throughput_counts_overlapping_calls_once():
+    """Test that concurrent embed_documents calls share their elapsed time instead of adding it up."""
+    def slow_embed(batch):
+        time.sleep(0.1)
+        return [[1.0] for _ in batch]
+
+    embedder = MagicMock()
+    embedder.embed_documents.side_effect = slow_embed
+    batched, _, _ = make_batched(embedder, batch_size=5, max_in_flight=2)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        list(executor.map(batched.embed_documents, [["a"] * 10, ["b"] * 10]))
+
+    assert batched.metrics.stats()["chunks"] == 20
+    # Four 0.1 s requests, two calls of two concurrent batches each, all running at once
+    assert batched.metrics.seconds < 0.18
+    assert batched.metrics.stats()["chunks_per_second"] > 20 / 0.18
+
+
+def test_batched_embeddings_retries_rate_limits():
+    """Test 429 responses are retried after at least the Retry-After delay."""
+    embedder = MagicMock()
+    embedder.embed_documents.side_effect = [rate_limit_error("2"), [[1.0]]]
+    batched, _, sleep = make_batched(embedder, batch_size=5)
+
+    assert batched.embed_documents(["a"]) == [[1.0]]
+    assert sleep.call_args.args[0] >= 2.0
+    assert batched.metrics.stats()["retries"] == 1
+
+
+def test_batched_embeddings_raises_non_retryable_errors():
+    """Test that errors other than rate limits fail immediately."""
+    embedder = MagicMock()
+    embedder.embed_documents.side_effect = ValueError("invalid text")
+    batched, _, sleep = make_batched(embedder)
+
+    with pytest.raises(ValueError):
+        batched.embed_documents(["a"])
+    sleep.assert_not_called()
@@ -0,0 +1,204 @@
+import pytest
+from unittest.mock import MagicMock, patch
+import sys
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from index_cache import IndexCache, INDEX_ROOT, estimate_index_size, load_index, index_cache, recently_used_indexes, record_use
+
+
+def make_cache(max_bytes):
+    """Cache whose entries report their own size."""
+    return IndexCache(max_bytes=max_bytes, sizeof=lambda store: store["size"])
+
+
+def test_index_cache_hit_and_miss():
+    """Test that the loader only runs on a cache miss."""
+    cache = make_cache(100)
+    loader = MagicMock(return_value={"size": 10})
+
+    first = cache.get("pdf-1", loader)
+    second = cache.get("pdf-1", loader)
+
+    assert first is second
+    loader.assert_called_once()
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["bytes"] == 10
+
+
+def test_index_cache_evicts_least_recently_used():
+    """Test LRU eviction once the memory budget is exceeded."""
+    cache = make_cache(25)
+    cache.get("a", lambda: {"size": 10})
+    cache.get("b", lambda: {"size": 10})
+    cache.get("a", lambda: {"size": 10})  # "a" becomes most recently used
+    cache.get("c", lambda: {"size": 10})
+
+    loader = MagicMock(return_value={"size": 10})
+    cache.get("a", loader)
+    loader.assert_not_called()
+    cache.get("b", loader)
+    loader.assert_called_once()
+    assert cache.stats()["evictions"] >= 1
+    assert cache.stats()["bytes"] <= 25
+
+
+def test_index_cache_skips_oversized_entries():
+    """Test that an index larger than the whole budget is not cached."""
+    cache = make_cache(5)
+    cache.get("big", lambda: {"size": 10})
+    assert cache.stats()["entries"] == 0
+
+
+def test_index_cache_invalidate():
+    """Test that invalidation forces a reload."""
+    cache = make_cache(100)
+    cache.get("pdf-1", lambda: {"size": 10})
+    cache.invalidate("pdf-1")
+
+    loader = MagicMock(return_value={"size": 10})
+    cache.get("pdf-1", loader)
+    loader.assert_called_once()
+    assert cache.stats()["bytes"] == 10
+
+
+def test_index_cache_drops_load_invalidated_while_in_flight():
+    """Test that a store loaded before an invalidation isn't cached after it."""
+    cache = make_cache(100)
+
+    def stale_loader():
+        cache.invalidate("pdf-1")  # e.g. an update saved the index while it was loading
+        return {"size": 10, "version": "old"}
+
+    assert cache.get("pdf-1", stale_loader)["version"] == "old"
+    assert cache.get("pdf-1", lambda: {"size": 10, "version": "new"})["version"] == "new"
+    assert cache.get("pdf-1", stale_loader)["version"] == "new"
+
+
+def test_index_cache_shares_concurrent_loads():
+    """Test that concurrent misses for the same key run the loader once."""
+    cache = make_cache(100)
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {"size": 10}
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        first = pool.submit(cache.get, "pdf-1", loader)
+        started.wait(5)
+        others = [pool.submit(cache.get, "pdf-1", loader) for _ in range(3)]
+        release.set()
+        results = [first.result()] + [other.result() for other in others]
+
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+
+
+def test_index_cache_failed_load_is_retried():
+    """Test that a failing loader raises and the next lookup loads again."""
+    cache = make_cache(100)
+    with pytest.raises(OSError):
+        cache.get("pdf-1", MagicMock(side_effect=OSError("missing")))
+    assert cache.get("pdf-1", lambda: {"size": 10}) == {"size": 10}
+
+
+def test_estimate_index_size():
+    """Test size estimation from vector count, dimension and stored text."""
+    store = MagicMock()
+    store.index.ntotal = 3
+    store.index.d = 4
+    doc = MagicMock()
+    doc.page_content = "abcde"
+    store.docstore._dict = {"1": doc}
+    assert estimate_index_size(store) == 3 * 4 * 4 + 5
+
+
+@patch("index_cache.load_store")
+def test_load_index_uses_process_cache(mock_load_store):
+    """Test that repeated loads of the same pdf_id skip disk."""
+    index_cache.clear()
+    store = MagicMock()
+    store.index.ntotal = 1
+    store.index.d = 1
+    store.docstore._dict = {}
+    mock_load_store.return_value = store
+
+    embeddings = MagicMock()
+    assert load_index("pdf-x", embeddings) is store
+    assert load_index("pdf-x", embeddings) is store
+    mock_load_store.assert_called_once_with(os.path.join(INDEX_ROOT, "pdf-x"), embeddings)
+    index_cache.clear()
+
+
+@patch("index_cache.record_use")
+@patch("index_cache.load_store")
+def test_load_index_without_record_leaves_use_time(mock_load_store, mock_record_use):
+    """Test that loads marked as not a use, like warmup, don't stamp the index as used."""
+    index_cache.clear()
+    store = MagicMock()
+    store.index.ntotal = 1
+    store.index.d = 1
+    store.docstore._dict = {}
+    mock_load_store.return_value = store
+
+    load_index("pdf-x", MagicMock(), record=False)
+    mock_record_use.assert_not_called()
+    load_index("pdf-x", MagicMock())
+    mock_record_use.assert_called_once_with("pdf-x")
+    index_cache.clear()
+
+
+def test_recently_used_indexes_orders_by_last_use(tmp_path):
+    """Test that indexes are listed newest use first and used indexes move to the front."""
+    for age, pdf_id in enumerate(["new", "mid", "old"]):
+        directory = tmp_path / pdf_id
+        directory.mkdir()
+        (directory / "vectors.faiss").write_bytes(b"")
+        os.utime(directory, (1000 - age, 1000 - age))
+    (tmp_path / "not-an-index").mkdir()
+
+    with patch("index_cache.INDEX_ROOT", str(tmp_path)), patch.dict("index_cache._last_recorded", clear=True):
+        assert recently_used_indexes(2) == ["new", "mid"]
+        record_use("old")
+        assert recently_used_indexes(5) == ["old", "new", "mid"]
+        assert recently_used_indexes(0) == []
+
+
+def test_load_index_reloads_files_rewritten_by_another_worker(tmp_path):
+    """Test that cached vector and BM25 indexes are loaded again once their files are replaced."""
+    from langchain_community.vectorstores import FAISS
+    from index_store import save_store
+    from lexical_index import BM25Index, load_lexical_index, lexical_cache
+
+    def write(text):
+        save_store(FAISS.from_embeddings([(text, [1.0, 0.0])], embedding=None), str(tmp_path / "pdf-1"))
+        lexical = BM25Index()
+        lexical.add("chunk", text)
+        lexical.save(str(tmp_path / "pdf-1"))
+
+    index_cache.clear()
+    lexical_cache.clear()
+    with patch("index_cache.INDEX_ROOT", str(tmp_path)):
+        write("first version")
+        first = load_index("pdf-1", None)
+        assert load_index("pdf-1", None) is first
+        assert load_lexical_index("pdf-1").search("first", 1)
+
+        # Written by another process, so this process's caches are not invalidated
+        write("second version")
+        second = load_index("pdf-1", None)
+        assert second is not first
+        assert [doc.page_content for doc in second.similarity_search_by_vector([1.0, 0.0], k=1)] == ["second version"]
+        assert load_lexical_index("pdf-1").search("second", 1)
+        assert not load_lexical_index("pdf-1").search("first", 1)
+    index_cache.clear()
+    lexical_cache.clear()
@@ -0,0 +1,88 @@
+import sys
+import os
+from unittest.mock import patch
+import faiss
+import numpy as np
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from index_factory import (
+    FLAT, IVFPQ, HNSWSQ, build_index, choose_index_type, compact_index, flat_index, index_bytes, ivfpq_layout,
+    load_index_params, save_index_params,
+)
+
+
+def clustered_vectors(count, dimensions, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(32, dimensions))
+    return (centers[rng.integers(0, 32, count)] + rng.normal(scale=0.3, size=(count, dimensions))).astype(np.float32)
+
+
+def test_choose_index_type_by_chunk_count():
+    """Test that small documents stay flat and large ones use the configured index."""
+    with patch("index_factory.INDEX_COMPRESS_MIN_CHUNKS", 1000):
+        assert choose_index_type(999, HNSWSQ) == FLAT
+        assert choose_index_type(1000, HNSWSQ) == HNSWSQ
+        # IVF-PQ needs enough chunks to train 256-centroid codebooks
+        assert choose_index_type(1000, IVFPQ) == FLAT
+        assert choose_index_type(20000, IVFPQ) == IVFPQ
+        assert choose_index_type(20000, FLAT) == FLAT
+    with pytest.raises(ValueError):
+        choose_index_type(10, "annoy")
+
+
+def test_ivfpq_layout_divides_dimensions():
+    nlist, m = ivfpq_layout(40000, 768)
+    assert nlist == 800
+    assert m == 192
+    assert ivfpq_layout(40000, 100)[1] == 25
+    assert ivfpq_layout(40000, 90)[1] == 18  # 22 doesn't divide 90
+
+
+# HNSW links take 256 bytes per vector, so it only saves memory for high-dimensional embeddings
+@pytest.mark.parametrize("index_type,count,dimensions", [(HNSWSQ, 500, 256), (IVFPQ, 10000, 16)])
+def test_build_index_compresses_and_keeps_positions(index_type, count, dimensions):
+    """Test that compressed indexes find vectors at the positions the docstore maps to."""
+    vectors = clustered_vectors(count, dimensions)
+    with patch("index_factory.INDEX_COMPRESS_MIN_CHUNKS", 100):
+        index, params = build_index(flat_index(vectors, dimensions), index_type)
+
+    assert params["type"] == index_type
+    assert params["chunks"] == count
+    assert index.ntotal == count
+    assert index_bytes(index) < count * dimensions * 4
+    _, positions = index.search(vectors[:20], 1)
+    assert (positions[:, 0] == np.arange(20)).mean() >= 0.8
+    # Retrieval reconstructs candidate vectors by position for MMR
+    assert np.allclose(index.reconstruct(5), vectors[5], atol=1.0)
+
+
+@pytest.mark.parametrize("index_type,count,dimensions", [(HNSWSQ, 500, 256), (IVFPQ, 10000, 16), (FLAT, 50, 8)])
+def test_compact_index_drops_vectors_and_renumbers_without_training(index_type, count, dimensions):
+    """Test that compacting keeps the stored codes of the remaining vectors under their new positions."""
+    vectors = clustered_vectors(count, dimensions)
+    with patch("index_factory.INDEX_COMPRESS_MIN_CHUNKS", 10):
+        index, _ = build_index(flat_index(vectors, dimensions), index_type)
+    keep = list(range(1, count, 3))
+
+    compacted = compact_index(index, keep)
+
+    assert compacted.ntotal == len(keep)
+    assert compacted is not index and index.ntotal == count
+    np.testing.assert_allclose(compacted.reconstruct_n(0, len(keep)), index.reconstruct_n(0, count)[keep], atol=1e-5)
+    # New vectors are encoded with the existing training and numbered after the kept ones
+    compacted.add(vectors[:1])
+    np.testing.assert_allclose(compacted.reconstruct(len(keep)), index.reconstruct(0), atol=1e-5)
+
+
+def test_build_index_leaves_small_documents_flat():
+    flat = flat_index(clustered_vectors(50, 8), 8)
+    index, params = build_index(flat, IVFPQ)
+    assert index is flat
+    assert params == {"type": FLAT, "factory": "Flat", "chunks": 50, "dimensions": 8}
+
+
+def test_index_params_round_trip(tmp_path):
+    assert load_index_params(str(tmp_path)) == {"type": FLAT}
+    save_index_params(str(tmp_path), {"type": HNSWSQ, "factory": "HNSW32,SQ8"})
+    assert load_index_params(str(tmp_path))["factory"] == "HNSW32,SQ8"
@@ -0,0 +1,171 @@
+import sys
+import os
+import asyncio
+from unittest.mock import patch
+import faiss
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from index_factory import FLAT, HNSWSQ, build_index, save_index_params
+from index_store import (
+    LOCK_FILE, MANIFEST_FILE, ChunkStore, chunk_positions, has_index, load_store, migrate_indexes, save_store, store_files,
+)
+from retrieval import scatter_gather_search
+import index_store
+
+
+def build_store(count=5):
+    items = [(f"chunk {number}", [float(number), 1.0]) for number in range(count)]
+    metadatas = [{"page": number + 1} for number in range(count)]
+    return FAISS.from_embeddings(items, embedding=None, metadatas=metadatas, ids=[f"id-{number}" for number in range(count)])
+
+
+def published_files(directory):
+    """The files of a saved index directory, with the published pair checked against the manifest."""
+    vectors_path, chunks_path = store_files(directory)
+    assert sorted(os.listdir(directory)) == sorted([LOCK_FILE, MANIFEST_FILE, os.path.basename(vectors_path), os.path.basename(chunks_path)])
+    return vectors_path, chunks_path
+
+
+def test_save_and_map_store(tmp_path):
+    """Test that a saved store is searched from mapped vectors and on-disk chunks."""
+    directory = str(tmp_path / "pdf-a")
+    save_store(build_store(), directory)
+    published_files(directory)
+    assert has_index(directory)
+
+    store = load_store(directory, None)
+    assert isinstance(store.docstore, ChunkStore)
+    docs = store.similarity_search_with_score_by_vector([3.1, 1.0], k=2)
+    assert [doc.page_content for doc, _ in docs] == ["chunk 3", "chunk 4"]
+    assert docs[0][0].id == "id-3"
+    assert docs[0][0].metadata == {"page": 4}
+    assert store.index_to_docstore_id[2] == "id-2"
+    assert len(store.index_to_docstore_id) == 5
+    assert store.docstore.search("missing") == "ID missing not found."
+    assert chunk_positions(store, ["id-1", "id-4", "missing"]) == {"id-1": 1, "id-4": 4}
+    np.testing.assert_array_equal(store.index.reconstruct(4), [4.0, 1.0])
+
+
+def test_writable_store_round_trip(tmp_path):
+    """Test that a writable load can be updated and saved again."""
+    directory = str(tmp_path / "pdf-a")
+    save_store(build_store(), directory)
+
+    store = load_store(directory, None, writable=True)
+    store.delete(["id-0"])
+    store.add_embeddings([("chunk 9", [9.0, 1.0])], metadatas=[{"page": 10}], ids=["id-9"])
+    save_store(store, directory)
+
+    reloaded = load_store(directory, None)
+    assert reloaded.index.ntotal == 5
+    assert reloaded.docstore.search("id-0") == "ID id-0 not found."
+    assert reloaded.docstore.search("id-9").metadata == {"page": 10}
+    assert [reloaded.index_to_docstore_id[position] for position in range(5)] == ["id-1", "id-2", "id-3", "id-4", "id-9"]
+
+
+@patch("index_factory.INDEX_COMPRESS_MIN_CHUNKS", 10)
+def test_compressed_index_is_mapped(tmp_path):
+    """Test that compressed indexes load from their mapped file with search parameters restored."""
+    directory = str(tmp_path / "pdf-large")
+    store = build_store(50)
+    store.index, params = build_index(store.index, HNSWSQ)
+    save_store(store, directory)
+    save_index_params(directory, params)
+
+    loaded = load_store(directory, None)
+    assert isinstance(loaded.index, faiss.IndexHNSW)
+    assert loaded.similarity_search_with_score_by_vector([20.0, 1.0], k=1)[0][0].page_content == "chunk 20"
+
+
+def test_mmap_flag_follows_the_index_file(tmp_path):
+    """Test that the mapping mode comes from the index file, not params that may be stale mid-rewrite."""
+    directory = str(tmp_path / "pdf-ivf")
+    store = build_store(64)
+    vectors = store.index.reconstruct_n(0, 64)
+    store.index = faiss.index_factory(2, "IVF1,PQ1x4")
+    store.index.train(vectors)
+    store.index.add(vectors)
+    save_store(store, directory)
+    save_index_params(directory, {"type": FLAT})
+
+    with patch("faiss.read_index", wraps=faiss.read_index) as read_index:
+        loaded = load_store(directory, None)
+    assert read_index.call_args.args[1] == faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    assert loaded.index.ntotal == 64
+
+    save_store(build_store(), directory)
+    with patch("faiss.read_index", wraps=faiss.read_index) as read_index:
+        load_store(directory, None)
+    assert read_index.call_args.args[1] == faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY
+
+
+def test_legacy_index_is_converted_on_load(tmp_path):
+    """Test that an index saved with save_local is rewritten in the mapped format."""
+    directory = str(tmp_path / "pdf-old")
+    build_store().save_local(directory)
+
+    store = load_store(directory, None)
+    assert store.docstore.search("id-1").page_content == "chunk 1"
+    published_files(directory)
+
+
+def test_legacy_index_is_converted_once_by_concurrent_loads(tmp_path):
+    """Test that loads racing on a legacy index convert it once, behind the directory lock."""
+    directory = str(tmp_path / "pdf-old")
+    build_store().save_local(directory)
+
+    with patch("index_store._publish", wraps=index_store._publish) as publish, ThreadPoolExecutor(max_workers=4) as executor:
+        stores = list(executor.map(lambda _: load_store(directory, None), range(4)))
+    assert publish.call_count == 1
+    assert all(store.index.ntotal == 5 for store in stores)
+
+
+def test_save_publishes_vectors_and_chunks_together(tmp_path):
+    """Test that each save swaps in a new pair of files at once, while stores opened earlier keep theirs."""
+    directory = str(tmp_path / "pdf-a")
+    save_store(build_store(5), directory)
+    before = load_store(directory, None)
+    old_files = published_files(directory)
+
+    # Concurrent writers, e.g. in different workers, each write their own files
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda count: save_store(build_store(count), directory), range(6, 10)))
+
+    new_files = published_files(directory)
+    assert not set(old_files) & set(new_files)
+    after = load_store(directory, None)
+    assert after.index.ntotal == len(after.docstore) in (6, 7, 8, 9)
+    assert before.index.ntotal == 5
+    assert before.docstore.search("id-4").page_content == "chunk 4"
+
+
+def test_migrate_indexes_moves_legacy_directories(tmp_path):
+    """Test that legacy index directories are moved under the index root and converted."""
+    source_root = tmp_path / "old"
+    index_root = tmp_path / "indexes"
+    index_root.mkdir()
+    build_store().save_local(str(source_root / "pdf-old"))
+    (source_root / "unrelated").mkdir()
+
+    assert migrate_indexes(str(source_root), str(index_root)) == 1
+    assert not (source_root / "pdf-old").exists()
+    assert (source_root / "unrelated").exists()
+    assert load_store(str(index_root / "pdf-old"), None).docstore.search("id-2").page_content == "chunk 2"
+
+
+def test_mmr_retrieval_on_mapped_store(tmp_path):
+    """Test that MMR reads candidate vectors back from a mapped store."""
+    directory = str(tmp_path / "pdf-a")
+    save_store(build_store(), directory)
+    store = load_store(directory, None)
+
+    with patch("retrieval.load_index", return_value=store):
+        docs = asyncio.run(scatter_gather_search(["pdf-a"], None, [2.0, 1.0], k=2, fetch_k=4, mmr=True))
+
+    assert len(docs) == 2
+    assert all(isinstance(doc, Document) for doc in docs)
+    assert docs[0].page_content == "chunk 2"
@@ -0,0 +1,49 @@
+import pytest
+from unittest.mock import patch
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from lexical_index import BM25Index, tokenize, load_lexical_index, lexical_cache
+
+
+def test_tokenize_keeps_identifiers_whole():
+    """Test that part numbers are indexed whole and by their parts."""
+    assert tokenize("Replace PN-00012 (v2.1) now") == ["replace", "pn-00012", "pn", "00012", "v2.1", "v2", "1", "now"]
+
+
+def test_bm25_ranks_exact_identifier_first():
+    """Test that a rare exact term outranks chunks with only common terms."""
+    index = BM25Index()
+    index.add_many([
+        ("c-1", "The pump valve must be inspected."),
+        ("c-2", "Order part PN-00012 for the pump valve."),
+        ("c-3", "The valve gasket and the pump seal."),
+    ])
+
+    results = index.search("which valve is PN-00012", k=2)
+
+    assert results[0][0] == "c-2"
+    assert len(results) == 2
+    assert results[0][1] > results[1][1]
+    assert index.search("unrelated words", k=3) == []
+
+
+def test_bm25_save_and_load_round_trip(tmp_path):
+    """Test that a saved index scores queries exactly like the original."""
+    index = BM25Index(k1=1.2, b=0.5)
+    index.add_many([("c-1", "alpha beta"), ("c-2", "beta gamma gamma")])
+    index.save(str(tmp_path))
+
+    loaded = BM25Index.load(str(tmp_path))
+
+    assert len(loaded) == 2
+    assert loaded.search("gamma beta", k=2) == index.search("gamma beta", k=2)
+
+
+def test_load_lexical_index_missing_for_legacy_documents(tmp_path):
+    """Test that documents indexed without a BM25 index load as None."""
+    lexical_cache.clear()
+    with patch("lexical_index.index_path", return_value=str(tmp_path)):
+        assert load_lexical_index("legacy-pdf") is None
+    lexical_cache.clear()
@@ -0,0 +1,195 @@
+import pytest
+import time
+import asyncio
+from contextlib import contextmanager
+from unittest.mock import MagicMock, patch
+import sys
+import os
+import httpx
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from llm_gateway import LLMGateway, LLMOverloadedError
+
+
+def rate_limited(retry_after="2"):
+    response = MagicMock()
+    response.status_code = 429
+    response.headers = {"Retry-After": retry_after}
+    return httpx.HTTPStatusError("429 Too Many Requests", request=None, response=response)
+
+
+class FakeChain:
+    """Chain whose calls take delay seconds; raises the queued errors first."""
+    def __init__(self, delay=0.0, errors=()):
+        self.delay = delay
+        self.errors = list(errors)
+        self.active = 0
+        self.peak = 0
+        self.calls = []
+
+    async def ainvoke(self, inputs):
+        self.calls.append(inputs["question"])
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+            if self.errors:
+                raise self.errors.pop(0)
+            return f"answer to {inputs['question']}"
+        finally:
+            self.active -= 1
+
+    async def astream(self, inputs):
+        if self.errors:
+            raise self.errors.pop(0)
+        for token in ("a", "b"):
+            yield token
+
+
+def test_gateway_bounds_concurrency():
+    """Test that no more than max_concurrency calls run at once."""
+    gateway = LLMGateway(max_concurrency=2, max_queue=10, queue_timeout=5)
+    chain = FakeChain(delay=0.02)
+
+    async def run():
+        return await asyncio.gather(*(gateway.invoke(chain, {"question": str(number)}) for number in range(6)))
+
+    assert asyncio.run(run()) == [f"answer to {number}" for number in range(6)]
+    assert chain.peak == 2
+    assert gateway.stats()["in_flight"] == 0
+    assert gateway.stats()["queued"] == 0
+
+
+def test_gateway_serves_clients_round_robin():
+    """Test that a client with many queued requests doesn't starve another."""
+    gateway = LLMGateway(max_concurrency=1, max_queue=10, queue_timeout=5)
+    chain = FakeChain(delay=0.01)
+
+    async def run():
+        busy = [asyncio.create_task(gateway.invoke(chain, {"question": f"a{number}"}, client="a")) for number in range(4)]
+        await asyncio.sleep(0)
+        other = asyncio.create_task(gateway.invoke(chain, {"question": "b0"}, client="b"))
+        await asyncio.gather(*busy, other)
+
+    asyncio.run(run())
+    assert chain.calls == ["a0", "a1", "b0", "a2", "a3"]
+
+
+def test_gateway_rejects_when_queue_is_full():
+    """Test that requests beyond the queue size get a 503 with Retry-After."""
+    gateway = LLMGateway(max_concurrency=1, max_queue=1, queue_timeout=5)
+    chain = FakeChain(delay=0.05)
+
+    async def run():
+        return await asyncio.gather(*(gateway.invoke(chain, {"question": str(number)}) for number in range(3)),
+                                    return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert results[:2] == ["answer to 0", "answer to 1"]
+    assert isinstance(results[2], LLMOverloadedError)
+    assert results[2].status_code == 503
+    assert int(results[2].headers["Retry-After"]) >= 1
+    assert gateway.stats()["rejected"] == 1
+
+
+def test_gateway_times_out_queued_requests():
+    """Test that a request waiting longer than the queue timeout is turned away and leaves no slot behind."""
+    gateway = LLMGateway(max_concurrency=1, max_queue=5, queue_timeout=0.01)
+    chain = FakeChain(delay=0.1)
+
+    async def run():
+        results = await asyncio.gather(gateway.invoke(chain, {"question": "slow"}), gateway.invoke(chain, {"question": "late"}),
+                                       return_exceptions=True)
+        # Capacity is free again afterwards
+        results.append(await gateway.invoke(FakeChain(), {"question": "next"}))
+        return results
+
+    slow, late, following = asyncio.run(run())
+    assert slow == "answer to slow"
+    assert isinstance(late, LLMOverloadedError)
+    assert following == "answer to next"
+    assert gateway.stats() == {"in_flight": 0, "queued": 0, "max_concurrency": 1, "max_queue": 5, "rejected": 1}
+
+
+def test_gateway_times_queue_wait_apart_from_the_call():
+    """Test that waiting for a slot is recorded as llm_queue, not as model time."""
+    gateway = LLMGateway(max_concurrency=1, max_queue=5, queue_timeout=5)
+    chain = FakeChain(delay=0.05)
+    stages = []
+
+    async def run():
+        await asyncio.gather(*(gateway.invoke(chain, {"question": str(number)}) for number in range(2)))
+
+    with patch("llm_gateway.timed_stage", side_effect=lambda stage: recorded(stages, stage)):
+        asyncio.run(run())
+    queued = max(seconds for stage, seconds in stages if stage == "llm_queue")
+    totals = [seconds for stage, seconds in stages if stage == "llm_total"]
+    assert queued >= 0.04
+    assert len(totals) == 2
+    assert max(totals) < 0.09
+
+
+@contextmanager
+def recorded(stages, stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages.append((stage, time.perf_counter() - started))
+
+
+def test_gateway_retries_rate_limited_calls():
+    """Test that 429s are retried after at least the server's Retry-After."""
+    delays = []
+
+    async def sleep(seconds):
+        delays.append(seconds)
+
+    gateway = LLMGateway(max_retries=3, sleep=sleep)
+    chain = FakeChain(errors=[rate_limited("2"), rate_limited("2")])
+
+    assert asyncio.run(gateway.invoke(chain, {"question": "q"})) == "answer to q"
+    assert len(chain.calls) == 3
+    assert len(delays) == 2
+    assert all(delay >= 2 for delay in delays)
+
+
+def test_gateway_gives_up_with_503_after_retries():
+    """Test that a model that stays rate limited yields a 503 instead of a 500."""
+    async def sleep(seconds):
+        pass
+
+    gateway = LLMGateway(max_retries=2, sleep=sleep)
+    chain = FakeChain(errors=[rate_limited("7")] * 3)
+
+    with pytest.raises(LLMOverloadedError) as exc_info:
+        asyncio.run(gateway.invoke(chain, {"question": "q"}))
+    assert exc_info.value.headers["Retry-After"] == "7"
+    assert len(chain.calls) == 3
+
+
+def test_gateway_does_not_retry_other_errors():
+    """Test that errors other than rate limits propagate unchanged."""
+    gateway = LLMGateway()
+    chain = FakeChain(errors=[ValueError("bad prompt")])
+
+    with pytest.raises(ValueError):
+        asyncio.run(gateway.invoke(chain, {"question": "q"}))
+    assert len(chain.calls) == 1
+    assert gateway.stats()["in_flight"] == 0
+
+
+def test_gateway_stream_retries_before_first_token_and_releases():
+    """Test that a stream is retried until it starts and frees its slot when done."""
+    async def sleep(seconds):
+        pass
+
+    gateway = LLMGateway(max_concurrency=1, sleep=sleep)
+    chain = FakeChain(errors=[rate_limited("0")])
+
+    async def run():
+        lease = await gateway.acquire("client")
+        return [token async for token in gateway.stream(chain, {"question": "q"}, lease)]
+
+    assert asyncio.run(run()) == ["a", "b"]
+    assert gateway.stats()["in_flight"] == 0
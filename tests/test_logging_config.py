@@ -0,0 +1,27 @@
+import sys
+import os
+import uuid
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from logging_config import LOG_FILE, configure_logging, stop_logging, worker_logging_args
+
+
+def log_in_worker(message):
+    logging.getLogger("pdf_processor").info(message)
+    return os.getpid()
+
+
+def test_pool_workers_log_through_the_parent_listener():
+    """Test that records logged in a pool worker reach the parent's log file."""
+    message = f"logged in a worker {uuid.uuid4()}"
+    configure_logging()
+    try:
+        with ProcessPoolExecutor(max_workers=1, **worker_logging_args()) as executor:
+            assert executor.submit(log_in_worker, message).result() != os.getpid()
+    finally:
+        # Drains the queue into the handlers before the file is read
+        stop_logging()
+    with open(LOG_FILE) as log_file:
+        assert message in log_file.read()
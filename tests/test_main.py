@@ -1,16 +1,49 @@
 import pytest
 from fastapi.testclient import TestClient
-from unittest.mock import MagicMock, patch
+from unittest.mock import MagicMock, AsyncMock, patch
+from concurrent.futures import ThreadPoolExecutor
 import sys
 import os
+import json
+import asyncio
+import zipfile
+import httpx
+import subprocess
 from io import BytesIO
 
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from main import app, MAX_FILE_SIZE
+from registry import SQLiteRegistry
+from semantic_cache import SemanticCache
+from data_models import PDF_File, PENDING, READY
+import ingestion
 
 client = TestClient(app)
 
+@pytest.fixture(autouse=True)
+def registry(tmp_path):
+    """Use a fresh registry outside the working directory for every test."""
+    test_registry = SQLiteRegistry(str(tmp_path / "registry.db"), content_dir=str(tmp_path / "content"))
+    with patch("main.registry", test_registry):
+        yield test_registry
+
+@pytest.fixture(autouse=True)
+def answer_cache():
+    """Start every test with an empty semantic answer cache."""
+    with patch("main.semantic_cache", SemanticCache(threshold=0.9)) as cache:
+        yield cache
+
+@pytest.fixture(autouse=True)
+def inline_ingestion(tmp_path):
+    """Run ingestion in threads so patched processors are visible, and spool to tmp_path."""
+    executor = ThreadPoolExecutor(max_workers=1)
+    with patch("ingestion._get_parse_executor", return_value=executor), \
+         patch("ingestion.UPLOAD_DIR", str(tmp_path / "uploads")), \
+         patch("main.check_pdf_access"):
+        yield
+    executor.shutdown()
+
 @pytest.fixture
 def mock_pdf_file():
     """Fixture to simulate a PDF file upload."""
@@ -24,15 +57,17 @@ def mock_pdf_file():
     )
     return mock_file
 
-@patch("main.process_pdf")
-@patch("main.get_vector_store")
-def test_upload_pdf_success(mock_get_vector_store, mock_process_pdf, mock_pdf_file):
+@patch("ingestion.process_pdf_file")
+@patch("ingestion.get_vector_store")
+def test_upload_pdf_success(mock_get_vector_store, mock_process_pdf, mock_pdf_file, registry):
     """Test successful PDF upload."""
-    # Mock the behavior of process_pdf
-    mock_process_pdf.return_value = {
-        "text": "Mocked PDF text content",
-        "metadata": {"author": "Test Author"}
-    }
+    # Mock the behavior of process_pdf_file, which streams page texts to the content file
+    def extract(path, content_path):
+        os.makedirs(os.path.dirname(content_path), exist_ok=True)
+        with open(content_path, "w", encoding="utf-8") as content_file:
+            content_file.write("Mocked PDF text content\f")
+        return {"metadata": '{"author": "Test Author"}', "page_count": 1}
+    mock_process_pdf.side_effect = extract
 
     # Mock get_vector_store to avoid unnecessary processing
     mock_get_vector_store.return_value = None
@@ -43,16 +78,31 @@ def test_upload_pdf_success(mock_get_vector_store, mock_process_pdf, mock_pdf_fi
         files={"file": ("test.pdf", mock_pdf_file.file, "application/pdf")}
     )
 
-    # Assert successful response
-    assert response.status_code == 200
+    # Assert the upload is accepted and queued
+    assert response.status_code == 202
     response_data = response.json()
     assert "pdf_id" in response_data
+    assert response_data["status"] == "pending"
 
-    # Assert mocks were called
+    # Assert mocks were called by the background ingestion
     mock_process_pdf.assert_called_once()
-    mock_get_vector_store.assert_called_once_with(content="Mocked PDF text content", pdf_id=response_data["pdf_id"])
+    mock_get_vector_store.assert_called_once()
+    assert list(mock_get_vector_store.call_args.kwargs["pages"]) == [(1, "Mocked PDF text content")]
+    assert mock_get_vector_store.call_args.kwargs["pdf_id"] == response_data["pdf_id"]
+
+    # The spooled upload is removed once ingestion finishes
+    assert not os.listdir(ingestion.UPLOAD_DIR)
+
+    status = client.get(f"/v1/pdf/{response_data['pdf_id']}")
+    assert status.status_code == 200
+    assert status.json()["status"] == "ready"
+    assert status.json()["pages_parsed"] == 1
+    assert status.json()["metadata"] == '{"author": "Test Author"}'
+
+    # Extracted text is kept on disk rather than in the registry
+    assert registry.load_content(response_data["pdf_id"]) == "Mocked PDF text content\f"
 
-@patch("main.process_pdf")
+@patch("ingestion.process_pdf_file")
 def test_upload_pdf_unsupported_file_type(mock_process_pdf):
     """Test upload with an unsupported file type."""
     response = client.post(
@@ -74,13 +124,13 @@ def test_upload_pdf_file_size_exceeded():
     assert response.json() == {"detail": "File size exceeds the 100 MB limit."}
 
 
-@patch("main.process_pdf")
-def test_upload_pdf_password_protected(mock_process_pdf, mock_pdf_file):
+@patch("main.check_pdf_access")
+def test_upload_pdf_password_protected(mock_check_pdf_access, mock_pdf_file):
     """Test upload with a password-protected PDF."""
     from main import PDFPasswordProtectedError
 
-    # Mock process_pdf to raise a password-protected exception
-    mock_process_pdf.side_effect = PDFPasswordProtectedError("Password-protected PDF")
+    # Mock the access check to raise a password-protected exception
+    mock_check_pdf_access.side_effect = PDFPasswordProtectedError("Password-protected PDF")
 
     response = client.post(
         "/v1/pdf",
@@ -89,3 +139,481 @@ def test_upload_pdf_password_protected(mock_process_pdf, mock_pdf_file):
 
     assert response.status_code == 401
     assert response.json() == {"detail": "Password-protected PDF"}
+
+
+@patch("ingestion.process_pdf_file")
+@patch("ingestion.get_vector_store")
+def test_upload_identical_pdf_reuses_index(mock_get_vector_store, mock_process_pdf):
+    """Test that a byte-identical upload short-circuits to the existing pdf_id."""
+    mock_process_pdf.return_value = {"metadata": "{}", "page_count": 1}
+    content = b"%PDF-1.4\n%Identical PDF Content\n"
+
+    first = client.post("/v1/pdf", files={"file": ("a.pdf", BytesIO(content), "application/pdf")})
+    second = client.post("/v1/pdf", files={"file": ("b.pdf", BytesIO(content), "application/pdf")})
+
+    assert first.status_code == 202
+    assert second.json()["pdf_id"] == first.json()["pdf_id"]
+    assert second.json()["status"] == "ready"
+    mock_process_pdf.assert_called_once()
+    mock_get_vector_store.assert_called_once()
+
+
+@patch("ingestion.process_pdf_file")
+@patch("ingestion.get_vector_store")
+def test_batch_upload_streams_results_per_file(mock_get_vector_store, mock_process_pdf, registry):
+    """Test that a batch of files and a zip archive is ingested with one NDJSON line per PDF."""
+    def extract(path, content_path):
+        if open(path, "rb").read().endswith(b"%broken\n"):
+            raise ValueError("cannot parse")
+        return {"metadata": "{}", "page_count": 1}
+    mock_process_pdf.side_effect = extract
+
+    archive = BytesIO()
+    with zipfile.ZipFile(archive, "w") as zip_file:
+        zip_file.writestr("docs/b.pdf", b"%PDF-1.4\n%b\n")
+        zip_file.writestr("docs/c.pdf", b"%PDF-1.4\n%broken\n")
+        zip_file.writestr("docs/readme.txt", b"not a pdf")
+        zip_file.writestr("__MACOSX/docs/._b.pdf", b"resource fork")
+    archive.seek(0)
+
+    response = client.post("/v1/pdf/batch", files=[
+        ("files", ("a.pdf", BytesIO(b"%PDF-1.4\n%a\n"), "application/pdf")),
+        ("files", ("a-copy.pdf", BytesIO(b"%PDF-1.4\n%a\n"), "application/pdf")),
+        ("files", ("notes.txt", BytesIO(b"text"), "text/plain")),
+        ("files", ("docs.zip", archive, "application/zip")),
+    ])
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    results = {line["file_name"]: line for line in map(json.loads, response.text.splitlines())}
+    assert set(results) == {"a.pdf", "a-copy.pdf", "notes.txt", "b.pdf", "c.pdf"}
+    assert results["a.pdf"]["status"] == "ready"
+    assert results["b.pdf"]["status"] == "ready"
+    assert results["c.pdf"]["status"] == "failed"
+    assert "cannot parse" in results["c.pdf"]["error"]
+    assert results["notes.txt"]["status"] == "rejected"
+    # The second copy in the same batch is deduplicated against the first
+    assert results["a-copy.pdf"]["duplicate"] is True
+    assert results["a-copy.pdf"]["pdf_id"] == results["a.pdf"]["pdf_id"]
+    assert mock_process_pdf.call_count == 3
+    assert registry.get(results["b.pdf"]["pdf_id"]).file_name == "b.pdf"
+
+
+def test_ingest_batch_starts_ingesting_before_later_files_are_staged():
+    """Test that each staged PDF enters the pipeline while the rest of the batch is still being spooled."""
+    started = []
+
+    async def ingest(pdf_id, path, registry):
+        started.append(pdf_id)
+
+    async def staged():
+        yield ({"file_name": "a.pdf"}, ("a.pdf", "pdf-a", "a-path"))
+        # The first document is ingesting before the second is spooled
+        for _ in range(10):
+            if started:
+                break
+            await asyncio.sleep(0)
+        assert started == ["pdf-a"]
+        yield ({"file_name": "bad.txt", "status": "rejected"}, None)
+        yield ({"file_name": "b.pdf"}, ("b.pdf", "pdf-b", "b-path"))
+
+    batch_registry = MagicMock()
+    batch_registry.get.return_value = PDF_File(pdf_id="x", file_name="x.pdf", size=1, status=READY)
+
+    async def collect():
+        return [result async for result in ingestion.ingest_batch(staged(), batch_registry)]
+
+    with patch("ingestion.ingest_pdf", ingest):
+        results = asyncio.run(collect())
+
+    assert started == ["pdf-a", "pdf-b"]
+    assert sorted(result["file_name"] for result in results) == ["a.pdf", "b.pdf", "bad.txt"]
+
+
+def test_batch_upload_rejects_invalid_zip():
+    """Test that an unreadable zip archive is reported without failing the batch."""
+    response = client.post("/v1/pdf/batch", files=[("files", ("bad.zip", BytesIO(b"not a zip"), "application/zip"))])
+
+    assert response.status_code == 200
+    result = json.loads(response.text)
+    assert result["status"] == "rejected"
+    assert result["error"].startswith("Invalid zip archive")
+
+
+@patch("ingestion.process_pdf_file")
+@patch("ingestion.update_vector_store")
+@patch("ingestion.get_vector_store")
+def test_replace_pdf_updates_existing_index(mock_get_vector_store, mock_update_vector_store, mock_process_pdf, tmp_path):
+    """Test that a new version keeps its pdf_id and is diffed into the existing index."""
+    mock_process_pdf.return_value = {"metadata": "{}", "page_count": 1}
+    mock_update_vector_store.return_value = {"kept": 1, "added": 0, "removed": 0}
+    first = client.post("/v1/pdf", files={"file": ("a.pdf", BytesIO(b"%PDF-1.4\n%v1\n"), "application/pdf")})
+    pdf_id = first.json()["pdf_id"]
+    mock_get_vector_store.assert_called_once()
+
+    # Identical bytes are a no-op, and a document being ingested can't be replaced
+    same = client.put(f"/v1/pdf/{pdf_id}", files={"file": ("a.pdf", BytesIO(b"%PDF-1.4\n%v1\n"), "application/pdf")})
+    assert same.json() == {"pdf_id": pdf_id, "status": "ready"}
+    assert mock_process_pdf.call_count == 1
+
+    index_dir = tmp_path / "indexes" / pdf_id
+    index_dir.mkdir(parents=True)
+    (index_dir / "vectors.faiss").write_bytes(b"")
+    with patch("ingestion.index_path", return_value=str(index_dir)):
+        response = client.put(f"/v1/pdf/{pdf_id}", files={"file": ("a-v2.pdf", BytesIO(b"%PDF-1.4\n%v2\n"), "application/pdf")})
+
+    assert response.status_code == 202
+    assert response.json() == {"pdf_id": pdf_id, "status": "pending"}
+    mock_get_vector_store.assert_called_once()
+    assert mock_update_vector_store.call_args.kwargs["pdf_id"] == pdf_id
+    status = client.get(f"/v1/pdf/{pdf_id}").json()
+    assert status["status"] == "ready"
+    assert status["file_name"] == "a-v2.pdf"
+
+
+def test_concurrent_replacements_of_a_pdf_are_serialized(registry):
+    """Test that of two concurrent PUTs for one document only one is accepted, each spooled to its own file."""
+    registry.put(PDF_File(pdf_id="pdf-r", file_name="a.pdf", size=10, digest="v1", status=READY))
+
+    async def replace_twice():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as async_client:
+            return await asyncio.gather(*(
+                async_client.put("/v1/pdf/pdf-r", files={"file": (f"{name}.pdf", BytesIO(f"%PDF-1.4\n%{name}\n".encode()), "application/pdf")})
+                for name in ("b", "c")
+            ))
+
+    with patch("main.ingest_pdf", AsyncMock()) as mock_ingest:
+        responses = asyncio.run(replace_twice())
+
+    assert sorted(response.status_code for response in responses) == [202, 409]
+    mock_ingest.assert_awaited_once()
+    # The rejected upload's spooled file is removed, the accepted one is left for ingestion
+    assert os.listdir(ingestion.UPLOAD_DIR) == [os.path.basename(mock_ingest.call_args.args[1])]
+    assert registry.get("pdf-r").status == PENDING
+
+
+def test_replace_or_delete_unknown_pdf():
+    """Test that replacing or deleting an unknown PDF returns 404."""
+    put = client.put("/v1/pdf/unknown", files={"file": ("a.pdf", BytesIO(b"%PDF-1.4"), "application/pdf")})
+    assert put.status_code == 404
+    assert client.delete("/v1/pdf/unknown").status_code == 404
+
+
+@patch("main.delete_indexes")
+def test_delete_pdf(mock_delete_indexes, registry):
+    """Test that deleting a PDF removes its indexes, content and registry entry."""
+    registry.put(PDF_File(pdf_id="old-pdf", file_name="old.pdf", size=10, status=READY))
+    registry.save_content("old-pdf", "Old text")
+    registry.put(PDF_File(pdf_id="busy-pdf", file_name="busy.pdf", size=10, status=PENDING))
+
+    assert client.delete("/v1/pdf/busy-pdf").status_code == 409
+    assert client.delete("/v1/pdf/old-pdf").status_code == 204
+
+    mock_delete_indexes.assert_called_once_with("old-pdf")
+    assert registry.get("old-pdf") is None
+    assert not os.path.exists(registry.content_path("old-pdf"))
+    assert client.get("/v1/pdf/old-pdf").status_code == 404
+
+
+@patch("ingestion.process_pdf_file")
+def test_failed_ingestion_reports_status(mock_process_pdf, mock_pdf_file):
+    """Test that a failed ingestion is reported by the status endpoint and blocks chat."""
+    mock_process_pdf.side_effect = RuntimeError("Error processing PDF: broken")
+
+    response = client.post(
+        "/v1/pdf",
+        files={"file": ("broken.pdf", mock_pdf_file.file, "application/pdf")}
+    )
+    pdf_id = response.json()["pdf_id"]
+
+    status = client.get(f"/v1/pdf/{pdf_id}").json()
+    assert status["status"] == "failed"
+    assert "broken" in status["error"]
+
+    chat = client.post(f"/v1/chat/{pdf_id}", json={"message": "Hello?"})
+    assert chat.status_code == 409
+
+
+def test_chat_with_pending_pdf_returns_conflict(registry):
+    """Test chatting with a PDF whose ingestion has not finished."""
+    registry.put(PDF_File(pdf_id="pending-pdf", file_name="pending.pdf", size=1))
+    response = client.post("/v1/chat/pending-pdf", json={"message": "Hello?"})
+    assert response.status_code == 409
+    assert "not ready" in response.json()["detail"]
+    assert client.get("/v1/pdf/pending-pdf").json()["status"] == PENDING
+
+
+def test_pdf_status_not_found():
+    """Test status lookup for an unknown PDF."""
+    response = client.get("/v1/pdf/unknown-pdf")
+    assert response.status_code == 404
+
+
+@pytest.fixture
+def ready_pdf(registry):
+    """Register a processed PDF for chat tests."""
+    registry.put(PDF_File(pdf_id="ready-pdf", file_name="ready.pdf", size=10, page_count=1, status=READY))
+    return "ready-pdf"
+
+
+@patch("main.get_query_embeddings")
+@patch("main.get_shared_chain")
+@patch("main.scatter_gather_search")
+def test_stream_chat_with_pdf(mock_search, mock_get_chain, mock_embeddings, ready_pdf):
+    """Test that answers are streamed as SSE token events followed by an end event."""
+    from langchain_core.documents import Document
+
+    docs = [Document(id="chunk-1", page_content="First"), Document(id="chunk-2", page_content="Second")]
+    mock_embeddings.return_value.aembed_query = AsyncMock(return_value=[1.0, 0.0])
+    mock_search.return_value = docs
+    end = {
+        "chunk_ids": ["chunk-1", "chunk-2"],
+        "sources": [
+            {"chunk_id": "chunk-1", "page": None, "start_index": None, "end_index": None, "snippet": "First"},
+            {"chunk_id": "chunk-2", "page": None, "start_index": None, "end_index": None, "snippet": "Second"},
+        ],
+    }
+
+    async def fake_astream(inputs):
+        assert inputs == {"context": docs, "question": "What is it?"}
+        for token in ["The ", "answer"]:
+            yield token
+
+    mock_get_chain.return_value.astream = fake_astream
+
+    response = client.post(f"/v1/chat/{ready_pdf}/stream", json={"message": "What is it?"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [block for block in response.text.split("\n\n") if block]
+    assert events[0] == 'event: token\ndata: {"text": "The "}'
+    assert events[1] == 'event: token\ndata: {"text": "answer"}'
+    assert events[2].startswith("event: end\ndata: ")
+    end_data = json.loads(events[2].split("data: ", 1)[1])
+    usage = end_data.pop("usage")
+    assert end_data == end
+    assert usage["prompt_tokens"] > usage["context_tokens"] > 0
+
+    # A repeated question is answered from the cache in a single token event
+    cached = client.post(f"/v1/chat/{ready_pdf}/stream", json={"message": "What is it?"})
+    cached_events = [block for block in cached.text.split("\n\n") if block]
+    cached_end = {**end, "usage": {"prompt_tokens": 0, "context_tokens": 0, "chunks_dropped": 0}}
+    assert cached_events == [
+        'event: token\ndata: {"text": "The answer"}',
+        f"event: end\ndata: {json.dumps(cached_end)}",
+    ]
+    mock_search.assert_called_once()
+
+
+@patch("main.get_query_embeddings")
+@patch("main.get_shared_chain")
+@patch("main.scatter_gather_search")
+def test_stream_chat_overloaded_returns_503(mock_search, mock_get_chain, mock_embeddings, ready_pdf):
+    """Test that a stream the LLM gateway can't admit is a 503 with Retry-After, not a broken stream."""
+    from llm_gateway import LLMGateway
+
+    mock_embeddings.return_value.aembed_query = AsyncMock(return_value=[1.0, 0.0])
+    mock_search.return_value = []
+    with patch("main.llm_gateway", LLMGateway(max_concurrency=0, max_queue=0)):
+        response = client.post(f"/v1/chat/{ready_pdf}/stream", json={"message": "What is it?"})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert "Retry later" in response.json()["detail"]
+
+
+def test_stream_chat_with_unknown_pdf():
+    """Test streaming chat against an unknown PDF returns 404 before streaming."""
+    response = client.post("/v1/chat/unknown-pdf/stream", json={"message": "Hello?"})
+    assert response.status_code == 404
+
+
+@patch("main.get_query_embeddings")
+@patch("main.get_shared_chain")
+@patch("main.scatter_gather_search")
+def test_chat_with_pdf(mock_search, mock_get_chain, mock_embeddings, ready_pdf):
+    """Test the chat endpoint retrieves and answers through the async APIs, citing the source pages."""
+    from langchain_core.documents import Document
+
+    docs = [Document(id="chunk-1", page_content="Pumps need calibration every year.",
+                     metadata={"page": 3, "start_index": 120, "end_index": 154, "chunk_index": 7})]
+    mock_embeddings.return_value.aembed_query = AsyncMock(return_value=[1.0, 0.0])
+    mock_search.return_value = docs
+    mock_get_chain.return_value.ainvoke = AsyncMock(return_value="  The answer.  ")
+
+    response = client.post(f"/v1/chat/{ready_pdf}", json={"message": "What is it?"})
+
+    assert response.status_code == 200
+    body = response.json()
+    usage = body.pop("usage")
+    assert usage["context_tokens"] == 9  # 34 characters at 4 per token
+    assert usage["prompt_tokens"] > usage["context_tokens"]
+    assert body == {
+        "response": "The answer.",
+        "sources": [{
+            "chunk_id": "chunk-1", "page": 3, "start_index": 120, "end_index": 154,
+            "snippet": "Pumps need calibration every year.",
+        }],
+    }
+    mock_search.assert_awaited_once_with(
+        [ready_pdf], mock_embeddings.return_value, [1.0, 0.0],
+        k=4, query_text="What is it?", fetch_k=20, mode="hybrid", mmr=False, prior_ids=[],
+    )
+    mock_get_chain.return_value.ainvoke.assert_awaited_once_with({"context": docs, "question": "What is it?"})
+    stages = [entry.split(";")[0] for entry in response.headers["Server-Timing"].split(", ")]
+    assert stages == ["embed_query", "retrieve", "llm_queue", "llm_total", "app"]
+
+
+def test_metrics_endpoint():
+    """Test that stage histograms and cache counters are exposed in the Prometheus format."""
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE pdf_chat_stage_seconds histogram" in response.text
+    assert 'pdf_chat_cache_lookups_total{cache="semantic",result="hit"}' in response.text
+    assert "pdf_chat_embedding_retries_total" in response.text
+
+
+@patch("main.get_query_embeddings")
+@patch("main.get_shared_chain")
+@patch("main.scatter_gather_search")
+def test_chat_reuses_answer_for_similar_question(mock_search, mock_get_chain, mock_embeddings, ready_pdf, answer_cache):
+    """Test a semantically similar question is answered without calling Gemini again."""
+    mock_embeddings.return_value.aembed_query = AsyncMock(side_effect=[[1.0, 0.0], [0.99, 0.05], [0.0, 1.0]])
+    mock_search.return_value = []
+    mock_get_chain.return_value.ainvoke = AsyncMock(side_effect=["First answer", "Other answer"])
+
+    first = client.post(f"/v1/chat/{ready_pdf}", json={"message": "What is the topic?"})
+    similar = client.post(f"/v1/chat/{ready_pdf}", json={"message": "What's the topic?"})
+    different = client.post(f"/v1/chat/{ready_pdf}", json={"message": "Who wrote it?"})
+
+    assert similar.json()["response"] == first.json()["response"] == "First answer"
+    assert similar.json()["usage"]["prompt_tokens"] == 0
+    assert first.json()["usage"]["prompt_tokens"] > 0
+    assert different.json()["response"] == "Other answer"
+    assert mock_get_chain.return_value.ainvoke.await_count == 2
+    assert answer_cache.stats()["hits"] == 1
+
+
+@patch("main.get_query_embeddings")
+@patch("main.get_shared_chain")
+@patch("main.scatter_gather_search")
+def test_chat_session_follow_up(mock_search, mock_get_chain, mock_embeddings, ready_pdf, answer_cache):
+    """Test that a follow-up in a session is retrieved with the previous question and answered with history."""
+    from langchain_core.documents import Document
+
+    mock_embeddings.return_value.aembed_query = AsyncMock(return_value=[1.0, 0.0])
+    mock_search.side_effect = [
+        [Document(id="chunk-1", page_content="The P-100 pump runs at 3 bar.")],
+        [Document(id="chunk-2", page_content="Calibrate the P-100 yearly.")],
+    ]
+    mock_get_chain.return_value.ainvoke = AsyncMock(side_effect=["It runs at 3 bar.", "Yearly."])
+
+    created = client.post(f"/v1/chat/{ready_pdf}/sessions")
+    assert created.status_code == 201
+    session_id = created.json()["session_id"]
+
+    client.post(f"/v1/chat/{ready_pdf}", json={"message": "What pressure does the P-100 pump use?", "session_id": session_id})
+    follow_up = client.post(f"/v1/chat/{ready_pdf}", json={"message": "How often is it calibrated?", "session_id": session_id})
+
+    assert follow_up.json()["response"] == "Yearly."
+    # The follow-up is searched together with the question it refers to, preferring the previous chunks
+    search_kwargs = mock_search.call_args_list[1].kwargs
+    assert search_kwargs["query_text"] == "What pressure does the P-100 pump use? How often is it calibrated?"
+    assert search_kwargs["prior_ids"] == ["chunk-1"]
+    question = mock_get_chain.return_value.ainvoke.call_args_list[1].args[0]["question"]
+    assert "User: What pressure does the P-100 pump use?\nAssistant: It runs at 3 bar." in question
+    assert question.endswith("Current question: How often is it calibrated?")
+    # Follow-ups bypass the answer cache
+    assert answer_cache.stats()["entries"] == 1
+
+    history = client.get(f"/v1/chat/{ready_pdf}/sessions/{session_id}").json()
+    assert [turn["question"] for turn in history["turns"]] == [
+        "What pressure does the P-100 pump use?", "How often is it calibrated?",
+    ]
+    assert history["turns"][1]["chunk_ids"] == ["chunk-2"]
+
+    assert client.delete(f"/v1/chat/{ready_pdf}/sessions/{session_id}").status_code == 204
+    assert client.get(f"/v1/chat/{ready_pdf}/sessions/{session_id}").status_code == 404
+
+
+def test_chat_with_unknown_session(ready_pdf):
+    """Test that chat requests naming an unknown session are rejected."""
+    response = client.post(f"/v1/chat/{ready_pdf}", json={"message": "Hi?", "session_id": "nope"})
+    assert response.status_code == 404
+    assert client.post("/v1/chat/unknown-pdf/sessions").status_code == 404
+
+
+def test_create_and_get_collection(registry):
+    """Test grouping ready PDFs into a collection."""
+    registry.put(PDF_File(pdf_id="pdf-a", file_name="a.pdf", size=1, status=READY))
+    registry.put(PDF_File(pdf_id="pdf-b", file_name="b.pdf", size=1, status=READY))
+
+    response = client.post("/v1/collections", json={"name": "Manuals", "pdf_ids": ["pdf-a", "pdf-b", "pdf-a"]})
+    assert response.status_code == 201
+    collection = response.json()
+    assert collection["pdf_ids"] == ["pdf-a", "pdf-b"]
+
+    fetched = client.get(f"/v1/collections/{collection['collection_id']}")
+    assert fetched.json() == collection
+
+    missing = client.post("/v1/collections", json={"name": "Bad", "pdf_ids": ["pdf-a", "nope"]})
+    assert missing.status_code == 404
+
+
+@patch("main.get_query_embeddings")
+@patch("main.get_shared_chain")
+@patch("main.scatter_gather_search")
+def test_chat_across_collection(mock_search, mock_get_chain, mock_embeddings, registry):
+    """Test a question across a collection plus an extra pdf_id searches all documents."""
+    from langchain_core.documents import Document
+
+    for pdf_id in ["pdf-a", "pdf-b", "pdf-c"]:
+        registry.put(PDF_File(pdf_id=pdf_id, file_name=f"{pdf_id}.pdf", size=1, status=READY))
+    collection_id = client.post("/v1/collections", json={"name": "Set", "pdf_ids": ["pdf-a", "pdf-b"]}).json()["collection_id"]
+
+    docs = [Document(id="chunk-1", page_content="x", metadata={"pdf_id": "pdf-b", "page": 2, "start_index": 0, "end_index": 1})]
+    mock_search.return_value = docs
+    mock_embeddings.return_value.aembed_query = AsyncMock(return_value=[1.0])
+    mock_get_chain.return_value.ainvoke = AsyncMock(return_value="Answer")
+
+    response = client.post("/v1/chat", json={"message": "Q?", "collection_id": collection_id, "pdf_ids": ["pdf-c"], "k": 6})
+
+    assert response.status_code == 200
+    assert response.json()["response"] == "Answer"
+    assert response.json()["sources"] == [
+        {"pdf_id": "pdf-b", "chunk_id": "chunk-1", "page": 2, "start_index": 0, "end_index": 1, "snippet": "x"},
+    ]
+    assert mock_search.call_args.args[0] == ["pdf-c", "pdf-a", "pdf-b"]
+    assert mock_search.call_args.kwargs["k"] == 6
+    assert mock_search.call_args.kwargs["mode"] == "hybrid"
+
+
+def test_chat_across_pdfs_requires_targets(registry):
+    """Test validation of multi-document chat requests."""
+    assert client.post("/v1/chat", json={"message": "Q?"}).status_code == 422
+    assert client.post("/v1/chat", json={"message": "Q?", "collection_id": "nope"}).status_code == 404
+    registry.put(PDF_File(pdf_id="pending", file_name="p.pdf", size=1))
+    assert client.post("/v1/chat", json={"message": "Q?", "pdf_ids": ["pending"]}).status_code == 409
+
+
+def test_import_leaves_ocr_and_faiss_stacks_unloaded():
+    """Test that importing the app doesn't import the OCR, FAISS or Gemini SDK modules."""
+    heavy = ["pytesseract", "pdf2image", "faiss", "langchain_community.vectorstores.faiss", "langchain_google_genai", "google.generativeai"]
+    code = f"import sys, main; print([name for name in {heavy!r} if name in sys.modules])"
+    result = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
+
+
+@patch("main.warm_indexes")
+@patch("main.get_query_embeddings")
+@patch("main.get_shared_chain")
+def test_startup_builds_clients_and_warms_indexes(mock_get_chain, mock_embeddings, mock_warm_indexes, registry):
+    """Test that the lifespan hook builds the shared clients and warms indexes before serving."""
+    with TestClient(app) as started:
+        mock_get_chain.assert_called_once()
+        mock_warm_indexes.assert_called_once_with(mock_embeddings.return_value)
+        assert started.get("/").status_code == 200
@@ -0,0 +1,70 @@
+import sys
+import os
+import asyncio
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY, CollectorRegistry
+from metrics import (
+    ServerTimingMiddleware, StageClock, StatsCollector, format_server_timing, observe_stage, timed_stage,
+)
+
+
+def observations(stage):
+    return REGISTRY.get_sample_value("pdf_chat_stage_seconds_count", {"stage": stage})
+
+
+def test_stage_clock_accumulates_and_observes_once():
+    """Test that interleaved steps add up per stage and are observed once each."""
+    clock = StageClock()
+    for _ in range(3):
+        with clock.measure("test_clock_a"):
+            time.sleep(0.001)
+        with clock.measure("test_clock_b"):
+            pass
+
+    assert clock.seconds["test_clock_a"] >= 0.003
+    clock.observe()
+    assert observations("test_clock_a") == 1
+    assert observations("test_clock_b") == 1
+
+
+def test_server_timing_header_lists_request_stages():
+    """Test that stages timed during a request are reported in its Server-Timing header."""
+    app = FastAPI()
+    app.add_middleware(ServerTimingMiddleware)
+
+    @app.get("/work")
+    async def work():
+        with timed_stage("retrieve"):
+            await asyncio.sleep(0)
+        await asyncio.to_thread(observe_stage, "embed", 0.25)
+        observe_stage("embed", 0.25)
+        return {}
+
+    response = TestClient(app).get("/work")
+
+    entries = dict(entry.split(";dur=") for entry in response.headers["Server-Timing"].split(", "))
+    assert list(entries) == ["retrieve", "embed", "app"]
+    assert float(entries["embed"]) == 500.0
+
+
+def test_format_server_timing():
+    assert format_server_timing({"retrieve": 0.0123, "llm_total": 1.5}) == "retrieve;dur=12.3, llm_total;dur=1500.0"
+
+
+def test_stats_collector_exposes_existing_counters():
+    """Test that cache and embedding stats are read at scrape time."""
+    stats = {"hits": 2, "misses": 1, "evictions": 0, "entries": 3}
+    registry = CollectorRegistry()
+    registry.register(StatsCollector(
+        caches={"index": lambda: stats},
+        embedding_stats=lambda: {"requests": 5, "retries": 2, "chunks": 40},
+    ))
+
+    assert registry.get_sample_value("pdf_chat_cache_lookups_total", {"cache": "index", "result": "hit"}) == 2
+    assert registry.get_sample_value("pdf_chat_embedding_retries_total") == 2
+    stats["hits"] = 7
+    assert registry.get_sample_value("pdf_chat_cache_lookups_total", {"cache": "index", "result": "hit"}) == 7
@@ -1,7 +1,8 @@
 import pytest
 from unittest.mock import patch, MagicMock
 from io import BytesIO
-from pypdf import PdfReader
+import json
+from pypdf import PdfReader, PdfWriter
 
 import sys
 import os
@@ -12,15 +13,32 @@ from pdf_processor import (
     extract_text_with_ocr,
     process_pdf,
     get_text_chunks,
+    process_pdf_file,
+    read_pages,
+    iter_text_chunks,
+    get_vector_store,
+    update_vector_store,
+    check_pdf_access,
+    open_pdf,
+    iter_pdf_pages,
+    get_document_embeddings,
     PDFPasswordProtectedError,
 )
+from index_store import store_files
 
 
+@pytest.fixture(autouse=True)
+def fresh_embeddings_client():
+    """Each test builds its own (patched) shared embeddings client."""
+    get_document_embeddings.cache_clear()
+    yield
+    get_document_embeddings.cache_clear()
+
 
 def test_preprocess_text():
-    """Test text preprocessing to clean and format extracted text."""
+    """Test text preprocessing to clean and format extracted text, keeping paragraph breaks."""
     raw_text = "  This is a   sample   text.\n\nIt has extra spaces.  "
-    expected_output = "This is a sample text. It has extra spaces."
+    expected_output = "This is a sample text.\n\nIt has extra spaces."
     assert preprocess_text(raw_text) == expected_output
 
 
@@ -36,19 +54,34 @@ def test_process_metadata():
     assert process_metadata(None) == "{}"
 
 
-@patch("pdf_processor.convert_from_bytes")
-@patch("pdf_processor.pytesseract.image_to_string")
-def test_extract_text_with_ocr(mock_image_to_string, mock_convert_from_bytes):
-    """Test text extraction using OCR."""
-    mock_image_to_string.return_value = "Mock OCR text"
-    mock_convert_from_bytes.return_value = [MagicMock()] * 3  # Simulate 3 pages
+@patch("pdf_processor.OCR_WORKERS", 1)
+@patch("pdf2image.convert_from_path")
+@patch("pytesseract.image_to_string")
+def test_extract_text_with_ocr(mock_image_to_string, mock_convert_from_path):
+    """Test text extraction using OCR, one rasterized page at a time."""
+    mock_image_to_string.side_effect = ["Page one", "Page three"]
+    mock_convert_from_path.return_value = [MagicMock()]  # One image per call
 
     pdf_stream = BytesIO(b"%PDF-1.4\n%Mock PDF Content\n")
-    extracted_text = extract_text_with_ocr(pdf_stream)
+    extracted_text = extract_text_with_ocr(pdf_stream, page_numbers=[1, 3], dpi=150, lang="eng")
+
+    assert extracted_text == {1: "Page one", 3: "Page three"}
+    assert mock_convert_from_path.call_count == 2
+    first_call = mock_convert_from_path.call_args_list[0]
+    assert first_call.kwargs == {"dpi": 150, "first_page": 1, "last_page": 1}
+    mock_image_to_string.assert_called_with(mock_convert_from_path.return_value[0], lang="eng")
+
+
+@patch("pdf_processor.OCR_WORKERS", 1)
+@patch("pdf2image.pdfinfo_from_path", return_value={"Pages": 2})
+@patch("pdf2image.convert_from_path", return_value=[MagicMock()])
+@patch("pytesseract.image_to_string", return_value="Mock OCR text")
+def test_extract_text_with_ocr_all_pages(mock_image_to_string, mock_convert_from_path, mock_pdfinfo):
+    """Test OCR of every page when no page numbers are given."""
+    extracted_text = extract_text_with_ocr(BytesIO(b"%PDF-1.4\n"))
 
-    assert extracted_text == "Mock OCR textMock OCR textMock OCR text"
-    mock_image_to_string.assert_called()
-    mock_convert_from_bytes.assert_called_once()
+    assert extracted_text == {1: "Mock OCR text", 2: "Mock OCR text"}
+    mock_pdfinfo.assert_called_once()
 
 
 @patch("pdf_processor.PdfReader")
@@ -83,6 +116,18 @@ def test_process_pdf_password_protected(mock_pdf_reader):
         process_pdf(pdf_stream)
 
 
+@patch("pdf_processor.PdfReader")
+def test_check_pdf_access_password_protected(mock_pdf_reader):
+    """Test the upfront access check rejects password-protected PDFs."""
+    mock_reader_instance = MagicMock()
+    mock_pdf_reader.return_value = mock_reader_instance
+    mock_reader_instance.is_encrypted = True
+    mock_reader_instance.decrypt.return_value = False
+
+    with pytest.raises(PDFPasswordProtectedError):
+        check_pdf_access(BytesIO(b"%PDF-1.4\n%Mock PDF Content\n"))
+
+
 @patch("pdf_processor.PdfReader")
 @patch("pdf_processor.extract_text_with_ocr")
 def test_process_pdf_ocr_fallback(mock_extract_text_with_ocr, mock_pdf_reader):
@@ -92,14 +137,35 @@ def test_process_pdf_ocr_fallback(mock_extract_text_with_ocr, mock_pdf_reader):
     mock_reader_instance.pages = [MagicMock()]
     mock_reader_instance.pages[0].extract_text.return_value = None  # Simulate no text
     mock_reader_instance.metadata = None
-    mock_extract_text_with_ocr.return_value = "OCR extracted text."
+    mock_extract_text_with_ocr.return_value = {1: "OCR extracted text."}
 
     pdf_stream = BytesIO(b"%PDF-1.4\n%Mock PDF Content\n")
     result = process_pdf(pdf_stream)
 
     assert result["text"] == "OCR extracted text."
     assert result["metadata"] == {}
-    mock_extract_text_with_ocr.assert_called_once()
+    mock_extract_text_with_ocr.assert_called_once_with(pdf_stream, page_numbers=[1])
+
+
+@patch("pdf_processor.PdfReader")
+@patch("pdf_processor.extract_text_with_ocr")
+def test_process_pdf_ocr_only_empty_pages(mock_extract_text_with_ocr, mock_pdf_reader):
+    """Test that mixed PDFs only OCR the pages without a text layer."""
+    mock_reader_instance = MagicMock()
+    mock_pdf_reader.return_value = mock_reader_instance
+    mock_reader_instance.is_encrypted = False
+    mock_reader_instance.pages = [MagicMock(), MagicMock(), MagicMock()]
+    mock_reader_instance.pages[0].extract_text.return_value = "Page 1 text."
+    mock_reader_instance.pages[1].extract_text.return_value = ""
+    mock_reader_instance.pages[2].extract_text.return_value = "Page 3 text."
+    mock_reader_instance.metadata = None
+    mock_extract_text_with_ocr.return_value = {2: "Scanned   page 2."}
+
+    result = process_pdf(BytesIO(b"%PDF-1.4\n"))
+
+    assert result["text"] == "Page 1 text.Scanned page 2.Page 3 text."
+    assert result["page_count"] == 3
+    assert mock_extract_text_with_ocr.call_args.kwargs == {"page_numbers": [2]}
 
 
 def test_get_text_chunks():
@@ -109,3 +175,168 @@ def test_get_text_chunks():
 
     assert len(chunks) > 1  # Ensure text is split into multiple chunks
     assert all(len(chunk) <= 1000 for chunk in chunks)  # Ensure chunk size limit
+
+
+@patch("pdf_processor.PdfReader")
+def test_process_pdf_file_streams_pages_to_content(mock_pdf_reader, tmp_path):
+    """Test that page texts are written to the content file instead of returned."""
+    pages = [MagicMock(), MagicMock()]
+    pages[0].extract_text.return_value = "First   page."
+    pages[1].extract_text.return_value = "Second page."
+    mock_pdf_reader.return_value.is_encrypted = False
+    mock_pdf_reader.return_value.pages = pages
+    mock_pdf_reader.return_value.metadata = {"/Title": "Streamed"}
+    pdf_path = tmp_path / "doc.pdf"
+    pdf_path.write_bytes(b"%PDF-1.4")
+    content_path = tmp_path / "content" / "doc.txt"
+
+    result = process_pdf_file(str(pdf_path), str(content_path))
+
+    assert result["page_count"] == 2
+    assert json.loads(result["metadata"]) == {"/Title": "Streamed"}
+    # pypdf gets the open file rather than the path, which it would read into memory
+    assert not isinstance(mock_pdf_reader.call_args.args[0], str)
+    assert list(read_pages(str(content_path))) == [(1, "First page."), (2, "Second page.")]
+    # Stage timings travel back from the worker process with the result; nothing was OCR'd
+    assert set(result["timings"]) == {"parse"}
+
+
+@patch("pdf_processor.extract_text_with_ocr", side_effect=lambda pdf_file, page_numbers: {number: "Scanned" for number in page_numbers})
+def test_iter_pdf_pages_releases_parsed_pages(mock_ocr):
+    """Test that pages are dropped from pypdf's page list once extracted."""
+    writer = PdfWriter()
+    for _ in range(3):
+        writer.add_blank_page(100, 100)
+    pdf_stream = BytesIO()
+    writer.write(pdf_stream)
+    pdf_stream.seek(0)
+
+    reader = open_pdf(pdf_stream)
+    assert [number for number, _ in iter_pdf_pages(reader, pdf_stream)] == [1, 2, 3]
+    assert reader.flattened_pages == [None, None, None]
+    assert len(reader.pages) == 3
+
+
+def test_read_pages_across_block_boundaries(tmp_path):
+    """Test that page records split across read blocks are reassembled."""
+    content_path = tmp_path / "doc.txt"
+    content_path.write_text("alpha\fbeta gamma\f\fdelta\f", encoding="utf-8")
+
+    assert list(read_pages(str(content_path), block_size=3)) == [
+        (1, "alpha"), (2, "beta gamma"), (3, ""), (4, "delta"),
+    ]
+
+
+@patch("pdf_processor.EMBED_STREAM_CHUNKS", 2)
+@patch("pdf_processor.CachedEmbeddings", side_effect=lambda embeddings, model, on_progress=None: embeddings)
+@patch("pdf_processor.create_embeddings")
+def test_get_vector_store_consumes_pages_incrementally(mock_embeddings, mock_cached, tmp_path):
+    """Test that chunks are embedded in steps as pages are read."""
+    mock_embeddings.return_value.embed_documents.side_effect = lambda texts: [[float(len(text)), 1.0] for text in texts]
+    consumed = []
+
+    def pages():
+        for number in range(1, 6):
+            consumed.append(number)
+            yield number, f"Text of page {number}."
+
+    progress = []
+    with patch("pdf_processor.index_path", return_value=str(tmp_path / "index")):
+        get_vector_store(pages(), "pdf-stream", on_progress=lambda done, total: progress.append((done, total)))
+
+    batches = [call.args[0] for call in mock_embeddings.return_value.embed_documents.call_args_list]
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert consumed == [1, 2, 3, 4, 5]
+    assert progress[-1] == (5, 5)
+    assert all(os.path.exists(path) for path in store_files(str(tmp_path / "index")))
+    assert (tmp_path / "index" / "bm25.json").exists()
+
+
+@patch("pdf_processor.CachedEmbeddings", side_effect=lambda embeddings, model, on_progress=None: embeddings)
+@patch("pdf_processor.create_embeddings")
+def test_update_vector_store_embeds_only_changed_chunks(mock_embeddings, mock_cached, tmp_path):
+    """Test that a new version reuses the vectors of unchanged chunks and drops removed ones."""
+    from index_store import load_store
+    from lexical_index import BM25Index
+
+    mock_embeddings.return_value.embed_documents.side_effect = lambda texts: [[float(len(text)), 1.0] for text in texts]
+    index_dir = str(tmp_path / "index")
+    with patch("pdf_processor.index_path", return_value=index_dir):
+        get_vector_store([(1, "Intro page."), (2, "Pump maintenance."), (3, "Old appendix.")], "pdf-v")
+        mock_embeddings.return_value.embed_documents.reset_mock()
+
+        # Page 2 moves to page 3 unchanged, a new page 2 is inserted and the appendix is gone
+        changes = update_vector_store([(1, "Intro page."), (2, "Safety notes."), (3, "Pump maintenance.")], "pdf-v")
+
+    assert changes == {"kept": 2, "added": 1, "removed": 1}
+    batches = [call.args[0] for call in mock_embeddings.return_value.embed_documents.call_args_list]
+    assert batches == [["Safety notes."]]
+
+    store = load_store(index_dir, mock_embeddings.return_value, writable=True)
+    docs = {doc.page_content: doc for doc in store.docstore._dict.values()}
+    assert store.index.ntotal == 3
+    assert set(docs) == {"Intro page.", "Safety notes.", "Pump maintenance."}
+    assert docs["Pump maintenance."].metadata["page"] == 3
+    lexical = BM25Index.load(index_dir)
+    assert sorted(lexical.doc_ids) == sorted(store.index_to_docstore_id.values())
+    assert lexical.search("appendix", k=1) == []
+
+
+@pytest.mark.parametrize("index_type,page_count", [("hnswsq", 12), ("ivfpq", 10000)])
+@patch("index_factory.INDEX_COMPRESS_MIN_CHUNKS", 10)
+@patch("pdf_processor.CachedEmbeddings", side_effect=lambda embeddings, model, on_progress=None: embeddings)
+@patch("pdf_processor.create_embeddings")
+def test_update_vector_store_on_compressed_index(mock_embeddings, mock_cached, tmp_path, index_type, page_count):
+    """Test that compressed indexes are updated in place, without embedding kept chunks or training again."""
+    from index_store import load_store
+    from index_factory import load_index_params
+
+    mock_embeddings.return_value.embed_documents.side_effect = lambda texts: [[float(len(text)), float(text.count("e")), float(hash(text) % 97)] for text in texts]
+    pages = [(number, f"Section {number} text.") for number in range(1, page_count + 1)]
+    index_dir = str(tmp_path / "index")
+    with patch("pdf_processor.index_path", return_value=index_dir), patch("index_factory.INDEX_TYPE", index_type):
+        get_vector_store(pages, "pdf-large")
+        params = load_index_params(index_dir)
+        assert params["type"] == index_type
+        before = load_store(index_dir, mock_embeddings.return_value)
+        mock_embeddings.return_value.embed_documents.reset_mock()
+
+        with patch("pdf_processor.build_index") as mock_build:
+            changes = update_vector_store(pages[1:-1] + [(page_count, "Appended section.")], "pdf-large")
+
+    assert changes == {"kept": page_count - 2, "added": 1, "removed": 2}
+    mock_build.assert_not_called()
+    batches = [call.args[0] for call in mock_embeddings.return_value.embed_documents.call_args_list]
+    assert batches == [["Appended section."]]
+    store = load_store(index_dir, mock_embeddings.return_value)
+    assert type(store.index) is type(before.index)
+    assert store.index.ntotal == page_count - 1
+    updated = load_index_params(index_dir)
+    assert updated["chunks"] == page_count - 1
+    assert (updated["factory"], updated["train_seconds"]) == (params["factory"], params["train_seconds"])
+    # Kept chunks keep their stored codes under their new positions
+    old_positions = {doc_id: position for position, doc_id in before.index_to_docstore_id.items()}
+    for position, doc_id in store.index_to_docstore_id.items():
+        if doc_id in old_positions:
+            assert (store.index.reconstruct(position) == before.index.reconstruct(old_positions[doc_id])).all()
+    assert store.docstore.search(store.index_to_docstore_id[page_count - 2]).page_content == "Appended section."
+
+
+def test_iter_text_chunks_carries_page_metadata():
+    """Test that every chunk records its page, offsets within the page and position."""
+    page_one = "alpha beta gamma " * 100
+    chunks = list(iter_text_chunks([(1, page_one), (2, "Second page text.")]))
+
+    assert [metadata["chunk_index"] for _, metadata in chunks] == list(range(len(chunks)))
+    for text, metadata in chunks[:-1]:
+        assert metadata["page"] == 1
+        assert page_one[metadata["start_index"]:metadata["end_index"]] == text
+    assert chunks[-1] == ("Second page text.", {"page": 2, "start_index": 0, "end_index": 17, "chunk_index": len(chunks) - 1})
+
+
+@patch("pdf_processor.CachedEmbeddings", side_effect=lambda embeddings, model, on_progress=None: embeddings)
+@patch("pdf_processor.create_embeddings")
+def test_get_vector_store_rejects_empty_document(mock_embeddings, mock_cached):
+    """Test that a document without text does not produce an index."""
+    with pytest.raises(ValueError):
+        get_vector_store(iter([(1, "")]), "pdf-empty")
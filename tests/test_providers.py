@@ -0,0 +1,108 @@
+import pytest
+import asyncio
+import subprocess
+import time
+from unittest.mock import patch
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import numpy as np
+from embedding_cache import EmbeddingCache
+from providers import (
+    HashingEmbeddings,
+    EchoChatModel,
+    UnlimitedRate,
+    create_embeddings,
+    create_chat_model,
+    embedding_limiter,
+    embedding_model_name,
+)
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def test_hashing_embeddings_are_deterministic_and_normalized():
+    """Test that local embeddings are stable and unit length."""
+    embeddings = HashingEmbeddings(dimensions=64)
+    first, again = embeddings.embed_documents(["Pump calibration interval", "Pump calibration interval"])
+    assert first == again
+    assert len(first) == 64
+    assert np.linalg.norm(first) == pytest.approx(1.0, abs=1e-6)
+    assert embeddings.embed_query("") == [0.0] * 64
+
+
+def test_hashing_embeddings_rank_shared_vocabulary_higher():
+    """Test that texts sharing words are closer than unrelated texts."""
+    embeddings = HashingEmbeddings()
+    query = np.array(embeddings.embed_query("pump calibration interval"))
+    related, unrelated = (np.array(vector) for vector in embeddings.embed_documents([
+        "The calibration interval of the pump is twelve months.",
+        "Invoices are payable within thirty days.",
+    ]))
+    assert query @ related > query @ unrelated
+
+
+def test_echo_chat_model_quotes_context_with_latency():
+    """Test that the local model answers from the context after the configured delay."""
+    model = EchoChatModel(latency=0.05, max_words=3)
+    prompt = "Instructions. Maintain Context: yes\nContext:\nThe pump runs at 3 bar.\nQuestion: \nWhat pressure?\n"
+
+    started = time.perf_counter()
+    answer = asyncio.run(model.ainvoke(prompt))
+    assert time.perf_counter() - started >= 0.05
+    assert answer.content == "The pump runs "
+
+    async def stream():
+        return [chunk.content async for chunk in model.astream(prompt)]
+
+    assert asyncio.run(stream()) == ["The ", "pump ", "runs "]
+
+
+def test_provider_selection():
+    """Test that providers are chosen by name and unknown names are rejected."""
+    assert isinstance(create_embeddings("local"), HashingEmbeddings)
+    assert isinstance(create_chat_model("local"), EchoChatModel)
+    assert isinstance(embedding_limiter("local"), UnlimitedRate)
+    assert embedding_model_name("local").startswith("local-hashing-")
+    assert embedding_model_name("google") == "models/embedding-001"
+    with pytest.raises(ValueError):
+        create_embeddings("unknown")
+    with patch.dict(os.environ, {"GOOGLE_API_KEY": ""}):
+        with pytest.raises(ValueError):
+            create_chat_model("google")
+
+
+def test_app_imports_without_api_key():
+    """Test that the service can start offline with the local provider."""
+    env = {key: value for key, value in os.environ.items() if key != "GOOGLE_API_KEY"}
+    env["PROVIDER"] = "local"
+    result = subprocess.run([sys.executable, "-c", "import main"], cwd=ROOT, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+
+def test_local_providers_index_and_answer_offline(tmp_path):
+    """Test ingestion, retrieval and answering end to end with the local providers."""
+    from pdf_processor import get_vector_store
+    from retrieval import scatter_gather_search
+    from gemini_client import get_conversational_chain
+    from index_cache import index_cache
+    from lexical_index import lexical_cache
+
+    pages = [(1, "The P-100 pump runs at 3 bar."), (2, "Invoices are payable within thirty days.")]
+    with patch("providers.EMBEDDING_PROVIDER", "local"), patch("providers.LLM_PROVIDER", "local"), \
+         patch("embedding_cache.embedding_cache", EmbeddingCache(str(tmp_path / "cache.db"))), \
+         patch("pdf_processor.index_path", return_value=str(tmp_path / "pdf-local")), \
+         patch("index_cache.index_path", return_value=str(tmp_path / "pdf-local")), \
+         patch("lexical_index.index_path", return_value=str(tmp_path / "pdf-local")):
+        get_vector_store(iter(pages), "pdf-local")
+        embeddings = create_embeddings()
+        docs = asyncio.run(scatter_gather_search(
+            ["pdf-local"], embeddings, embeddings.embed_query("pump pressure"), k=1, query_text="pump pressure", mode="hybrid",
+        ))
+        answer = asyncio.run(get_conversational_chain().ainvoke({"context": docs, "question": "What pressure?"}))
+    index_cache.clear()
+    lexical_cache.clear()
+
+    assert docs[0].metadata["page"] == 1
+    assert answer.startswith("The P-100 pump runs at 3 bar.")
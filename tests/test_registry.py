@@ -0,0 +1,166 @@
+import pytest
+import sys
+import os
+import socket
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from registry import DocumentRegistry, SQLiteRegistry, MemoryRegistry, create_registry, INTERRUPTED_ERROR
+from data_models import PDF_File, Collection, ChatSession, ChatTurn, READY, FAILED, PENDING, PARSING
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def registry(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteRegistry(str(tmp_path / "registry.db"), content_dir=str(tmp_path / "content"))
+    return MemoryRegistry(content_dir=str(tmp_path / "content"))
+
+
+def test_registry_put_get_update(registry):
+    """Test storing a PDF and updating its ingestion status."""
+    registry.put(PDF_File(pdf_id="pdf-1", file_name="a.pdf", size=10, digest="abc"))
+    registry.update("pdf-1", status=READY, page_count=3)
+
+    pdf_file = registry.get("pdf-1")
+    assert pdf_file.status == READY
+    assert pdf_file.page_count == 3
+    assert pdf_file.file_name == "a.pdf"
+    assert registry.get("missing") is None
+    assert registry.list_ids() == ["pdf-1"]
+
+    registry.delete("pdf-1")
+    assert registry.get("pdf-1") is None
+
+
+def test_registry_claim_only_replaces_settled_documents(registry):
+    """Test that a new version is only claimed once, and never while an ingestion is running."""
+    registry.put(PDF_File(pdf_id="pdf-1", file_name="a.pdf", size=10, digest="v1", status=READY))
+
+    assert registry.claim(PDF_File(pdf_id="pdf-1", file_name="b.pdf", size=20, digest="v2"))
+    assert not registry.claim(PDF_File(pdf_id="pdf-1", file_name="c.pdf", size=30, digest="v3"))
+    assert not registry.claim(PDF_File(pdf_id="missing", file_name="d.pdf", size=1))
+    pdf_file = registry.get("pdf-1")
+    assert (pdf_file.file_name, pdf_file.digest, pdf_file.status) == ("b.pdf", "v2", PENDING)
+
+    registry.update("pdf-1", status=FAILED, error="broken")
+    assert registry.claim(PDF_File(pdf_id="pdf-1", file_name="c.pdf", size=30, digest="v3"))
+    assert registry.get("pdf-1").error is None
+
+
+def test_registry_delete_removes_sessions_and_collection_membership(registry):
+    """Test that deleting a document also drops its sessions and its place in collections."""
+    registry.put(PDF_File(pdf_id="pdf-1", file_name="a.pdf", size=10))
+    registry.put(PDF_File(pdf_id="pdf-2", file_name="b.pdf", size=10))
+    registry.put_collection(Collection(collection_id="c-1", name="Manuals", pdf_ids=["pdf-1", "pdf-2"]))
+    registry.put_session(ChatSession(session_id="s-1", pdf_id="pdf-1", created=1.0))
+    registry.put_session(ChatSession(session_id="s-2", pdf_id="pdf-2", created=1.0))
+
+    registry.delete("pdf-1")
+
+    assert registry.get_collection("c-1").pdf_ids == ["pdf-2"]
+    assert registry.get_session("s-1") is None
+    assert registry.get_session("s-2") is not None
+
+
+def test_registry_find_by_digest_prefers_usable_copy(registry):
+    """Test digest lookup skips failed ingestions of the same file."""
+    registry.put(PDF_File(pdf_id="failed", file_name="a.pdf", size=10, digest="abc", status=FAILED))
+    registry.put(PDF_File(pdf_id="ok", file_name="a.pdf", size=10, digest="abc", status=PENDING))
+
+    assert registry.find_by_digest("abc").pdf_id == "ok"
+    assert registry.find_by_digest("other") is None
+
+
+def test_registry_content_is_stored_on_disk(registry):
+    """Test extracted text is written to disk and loaded on demand."""
+    registry.save_content("pdf-1", "Extracted text")
+    assert os.path.exists(os.path.join(registry.content_dir, "pdf-1.txt"))
+    assert registry.load_content("pdf-1") == "Extracted text"
+
+
+def test_sqlite_registry_is_shared_between_instances(tmp_path):
+    """Test that separate connections (as in separate workers) see the same documents."""
+    path = str(tmp_path / "registry.db")
+    first = SQLiteRegistry(path, content_dir=str(tmp_path))
+    second = SQLiteRegistry(path, content_dir=str(tmp_path))
+
+    first.put(PDF_File(pdf_id="pdf-1", file_name="a.pdf", size=10))
+    first.update("pdf-1", status=READY)
+
+    assert second.get("pdf-1").status == READY
+
+
+def test_sqlite_registry_recovers_interrupted_ingestions(tmp_path):
+    """Test that a restart fails ingestions whose process is gone and keeps those still running."""
+    path = str(tmp_path / "registry.db")
+    before = SQLiteRegistry(path, content_dir=str(tmp_path))
+    before.put(PDF_File(pdf_id="stuck", file_name="a.pdf", size=10, digest="abc"))
+    before.update("stuck", status=PARSING)
+    before.put(PDF_File(pdf_id="running", file_name="b.pdf", size=10, status=PARSING))
+    before.put(PDF_File(pdf_id="done", file_name="c.pdf", size=10, status=READY))
+    # The process that was parsing "stuck" has exited; its pid now belongs to another process
+    before._execute("UPDATE documents SET owner = ? WHERE pdf_id = ?", (f"{socket.gethostname()}:{os.getpid()}:0", "stuck"))
+
+    restarted = SQLiteRegistry(path, content_dir=str(tmp_path))
+    assert restarted.recover_interrupted() == 1
+    assert restarted.get("stuck").status == FAILED
+    assert restarted.get("stuck").error == INTERRUPTED_ERROR
+    assert restarted.get("running").status == PARSING
+    assert restarted.get("done").status == READY
+    # Recovered rows are left alone afterwards
+    assert restarted.recover_interrupted() == 0
+
+
+def test_registry_rebuild_registers_orphaned_indexes(registry, tmp_path):
+    """Test that index directories left on disk are registered on startup."""
+    index_root = tmp_path / "indexes"
+    (index_root / "orphan").mkdir(parents=True)
+    (index_root / "orphan" / "index.faiss").write_bytes(b"")
+    (index_root / "not-an-index").mkdir()
+    registry.put(PDF_File(pdf_id="known", file_name="k.pdf", size=1, status=READY))
+    (index_root / "known").mkdir()
+    (index_root / "known" / "vectors.faiss").write_bytes(b"")
+
+    assert registry.rebuild(str(index_root)) == 1
+    assert registry.get("orphan").status == READY
+    assert registry.get("known").file_name == "k.pdf"
+    assert registry.get("not-an-index") is None
+    assert registry.rebuild(str(tmp_path / "missing")) == 0
+
+
+def test_registry_sessions(registry):
+    """Test storing, replacing and deleting chat sessions."""
+    session = ChatSession(session_id="s1", pdf_id="pdf-1", created=1.0)
+    registry.put_session(session)
+    assert registry.get_session("s1") == session
+
+    updated = session.model_copy(update={"turns": [ChatTurn(question="Q?", answer="A.", chunk_ids=["c1"], created=2.0)]})
+    registry.put_session(updated)
+    assert registry.get_session("s1").turns[0].chunk_ids == ["c1"]
+
+    registry.delete_session("s1")
+    assert registry.get_session("s1") is None
+
+
+def test_registry_collections(registry):
+    """Test storing collections and preserving their document order."""
+    registry.put_collection(Collection(collection_id="c1", name="Manuals", pdf_ids=["b", "a"]))
+    assert registry.get_collection("c1").pdf_ids == ["b", "a"]
+
+    registry.put_collection(Collection(collection_id="c1", name="Manuals", pdf_ids=["c"]))
+    assert registry.get_collection("c1").pdf_ids == ["c"]
+    assert registry.get_collection("missing") is None
+
+
+def test_create_registry_rejects_unknown_backend():
+    with pytest.raises(ValueError):
+        create_registry("redis")
+
+
+def test_incomplete_registry_backend_fails_at_instantiation():
+    """Test that a backend missing storage methods can't be created."""
+    class PartialRegistry(DocumentRegistry):
+        def get(self, pdf_id):
+            return None
+
+    with pytest.raises(TypeError):
+        PartialRegistry()
@@ -0,0 +1,156 @@
+import pytest
+import asyncio
+from unittest.mock import MagicMock, patch
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from retrieval import scatter_gather_search, cite_sources, reciprocal_rank_fusion, warm_indexes
+from lexical_index import BM25Index
+
+
+def build_store(items):
+    """Build a real FAISS store from (text, vector) pairs."""
+    return FAISS.from_embeddings(items, embedding=None)
+
+
+def test_scatter_gather_search_merges_global_top_k():
+    """Test results from several indexes are merged by distance into one top k."""
+    stores = {
+        "pdf-a": build_store([("a-near", [1.0, 0.0]), ("a-far", [-1.0, 0.0])]),
+        "pdf-b": build_store([("b-nearest", [0.99, 0.01]), ("b-mid", [0.5, 0.5])]),
+    }
+
+    with patch("retrieval.load_index", side_effect=lambda pdf_id, embeddings: stores[pdf_id]):
+        docs = asyncio.run(scatter_gather_search(["pdf-a", "pdf-b"], None, [1.0, 0.0], k=3))
+
+    assert [doc.page_content for doc in docs] == ["a-near", "b-nearest", "b-mid"]
+    assert [doc.metadata["pdf_id"] for doc in docs] == ["pdf-a", "pdf-b", "pdf-b"]
+    # The cached index documents are left untouched
+    for store in stores.values():
+        assert all("pdf_id" not in doc.metadata for doc in store.docstore._dict.values())
+
+
+def test_scatter_gather_search_handles_small_indexes():
+    """Test k larger than the total number of chunks."""
+    stores = {"pdf-a": build_store([("only", [1.0, 0.0])])}
+    with patch("retrieval.load_index", side_effect=lambda pdf_id, embeddings: stores[pdf_id]):
+        docs = asyncio.run(scatter_gather_search(["pdf-a"], None, [1.0, 0.0], k=5))
+    assert [doc.page_content for doc in docs] == ["only"]
+
+
+def test_cite_sources_reports_pages_and_snippets():
+    """Test that citations carry page metadata and a trimmed snippet."""
+    long_doc = Document(id="c-1", page_content="word " * 100, metadata={"page": 4, "start_index": 10, "end_index": 510, "pdf_id": "pdf-a"})
+    legacy_doc = Document(id="c-2", page_content="Short chunk")
+
+    with patch("retrieval.SNIPPET_CHARS", 20):
+        long_source, legacy_source = cite_sources([long_doc, legacy_doc])
+
+    assert long_source == {
+        "pdf_id": "pdf-a", "chunk_id": "c-1", "page": 4, "start_index": 10, "end_index": 510,
+        "snippet": "word word word word...",
+    }
+    assert legacy_source["page"] is None
+    assert legacy_source["snippet"] == "Short chunk"
+
+
+def build_hybrid_store(items):
+    """Build a FAISS store plus a BM25 index over the same chunk ids."""
+    store = FAISS.from_embeddings(items, embedding=None, ids=[text for text, _ in items])
+    lexical = BM25Index()
+    lexical.add_many((text, text) for text, _ in items)
+    return store, lexical
+
+
+def run_search(stores, lexicals, **kwargs):
+    with patch("retrieval.load_index", side_effect=lambda pdf_id, embeddings: stores[pdf_id]), \
+         patch("retrieval.load_lexical_index", side_effect=lambda pdf_id: lexicals.get(pdf_id)):
+        return asyncio.run(scatter_gather_search(list(stores), None, [1.0, 0.0], **kwargs))
+
+
+def test_lexical_hits_are_merged_relative_to_each_documents_best_score():
+    """Test that a short document's inflated BM25 scores don't push out better hits of another document."""
+    stores = {
+        "pdf-long": build_hybrid_store([("long-1", [1.0, 0.0]), ("long-2", [0.9, 0.1])])[0],
+        "pdf-short": build_hybrid_store([("short-1", [0.0, 1.0]), ("short-2", [0.1, 0.9])])[0],
+    }
+    lexicals = {"pdf-long": MagicMock(), "pdf-short": MagicMock()}
+    lexicals["pdf-long"].search.return_value = [("long-1", 2.0), ("long-2", 1.9)]
+    # Rare terms in a short document give every hit a high raw score
+    lexicals["pdf-short"].search.return_value = [("short-1", 20.0), ("short-2", 4.0)]
+
+    docs = run_search(stores, lexicals, k=4, query_text="pump", mode="lexical")
+
+    assert [doc.page_content for doc in docs] == ["long-1", "short-1", "long-2", "short-2"]
+
+
+def test_hybrid_search_recovers_exact_identifier():
+    """Test that BM25 brings in a chunk naming the queried part that vector search ranks last."""
+    store, lexical = build_hybrid_store([
+        ("pump overview", [1.0, 0.0]),
+        ("valve overview", [0.9, 0.1]),
+        ("seal overview", [0.8, 0.2]),
+        ("part PN-00012 spec", [0.0, 1.0]),
+    ])
+    stores, lexicals = {"pdf-a": store}, {"pdf-a": lexical}
+
+    vector_only = run_search(stores, lexicals, k=2, query_text="PN-00012", fetch_k=4, mode="vector")
+    hybrid = run_search(stores, lexicals, k=2, query_text="PN-00012", fetch_k=4, mode="hybrid")
+    lexical_only = run_search(stores, lexicals, k=2, query_text="PN-00012", fetch_k=4, mode="lexical")
+
+    assert "part PN-00012 spec" not in [doc.page_content for doc in vector_only]
+    assert "part PN-00012 spec" in [doc.page_content for doc in hybrid]
+    assert [doc.page_content for doc in lexical_only] == ["part PN-00012 spec"]
+    assert hybrid[0].metadata["pdf_id"] == "pdf-a"
+
+
+def test_lexical_mode_falls_back_to_vectors_without_bm25_index():
+    """Test that documents indexed before BM25 existed still answer lexical queries."""
+    stores = {"pdf-a": build_store([("only", [1.0, 0.0])])}
+    docs = run_search(stores, {}, k=1, query_text="only", mode="lexical")
+    assert [doc.page_content for doc in docs] == ["only"]
+
+
+def test_mmr_search_skips_near_duplicates():
+    """Test that MMR picks a diverse second chunk over a near-duplicate of the first."""
+    store, lexical = build_hybrid_store([
+        ("first", [0.95, 0.31]),
+        ("first copy", [0.949, 0.315]),
+        ("other angle", [0.9, -0.436]),
+    ])
+    stores, lexicals = {"pdf-a": store}, {"pdf-a": lexical}
+
+    plain = run_search(stores, lexicals, k=2, fetch_k=3, mode="vector")
+    diverse = run_search(stores, lexicals, k=2, fetch_k=3, mode="vector", mmr=True)
+
+    assert [doc.page_content for doc in plain] == ["first", "first copy"]
+    assert [doc.page_content for doc in diverse] == ["first", "other angle"]
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    """Test that a chunk ranked well by both lists wins over one ranked first by a single list."""
+    a, b, c, d = (Document(id=name, page_content=name, metadata={"pdf_id": "p"}) for name in "abcd")
+    fused = reciprocal_rank_fusion([[a, b, c, d], [d, b]])
+    assert [doc.id for doc in fused] == ["b", "d", "a", "c"]
+
+
+def test_warm_indexes_loads_recent_indexes():
+    """Test that warmup loads the vector and BM25 indexes and skips ones that fail to load."""
+    def load(pdf_id, embeddings, record=True):
+        if pdf_id == "broken":
+            raise ValueError("corrupt index")
+
+    with patch("retrieval.recently_used_indexes", return_value=["pdf-a", "broken", "pdf-b"]) as recent, \
+         patch("retrieval.load_index", side_effect=load) as load_index, \
+         patch("retrieval.load_lexical_index") as load_lexical, \
+         patch("retrieval.prefetch"):
+        warmed = warm_indexes(MagicMock(), count=3)
+
+    assert warmed == ["pdf-a", "pdf-b"]
+    recent.assert_called_once_with(3)
+    assert load_index.call_count == 3
+    assert all(call.kwargs == {"record": False} for call in load_index.call_args_list)
+    assert [call.args[0] for call in load_lexical.call_args_list] == ["pdf-a", "pdf-b"]
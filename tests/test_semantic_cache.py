@@ -0,0 +1,73 @@
+import pytest
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from semantic_cache import SemanticCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_semantic_cache_hits_within_threshold():
+    """Test that a similar question returns the stored answer."""
+    cache = SemanticCache(threshold=0.95, max_entries=10, ttl_seconds=60)
+    cache.store("pdf-1", "v1", [1.0, 0.0], "Answer", ["chunk-1"])
+
+    hit = cache.lookup("pdf-1", "v1", [0.99, 0.01])
+    assert hit.answer == "Answer"
+    assert hit.chunk_ids == ["chunk-1"]
+    assert cache.lookup("pdf-1", "v1", [0.0, 1.0]) is None
+    assert cache.stats()["hit_rate"] == 0.5
+
+
+def test_semantic_cache_is_scoped_per_document_and_version():
+    """Test that answers never leak across documents or document versions."""
+    cache = SemanticCache(threshold=0.9)
+    cache.store("pdf-1", "v1", [1.0, 0.0], "Answer")
+
+    assert cache.lookup("pdf-2", "v1", [1.0, 0.0]) is None
+    assert cache.lookup("pdf-1", "v2", [1.0, 0.0]) is None
+    # The stale version is dropped on lookup
+    assert cache.stats()["entries"] == 0
+
+
+def test_semantic_cache_ttl():
+    """Test that entries expire after the TTL."""
+    clock = FakeClock()
+    cache = SemanticCache(threshold=0.9, ttl_seconds=10, clock=clock)
+    cache.store("pdf-1", "v1", [1.0, 0.0], "Answer")
+
+    clock.now = 5
+    assert cache.lookup("pdf-1", "v1", [1.0, 0.0]) is not None
+    clock.now = 11
+    assert cache.lookup("pdf-1", "v1", [1.0, 0.0]) is None
+
+
+def test_semantic_cache_size_cap_evicts_least_recently_used():
+    """Test the size cap across documents."""
+    cache = SemanticCache(threshold=0.9, max_entries=2)
+    cache.store("pdf-1", "v1", [1.0, 0.0], "A")
+    cache.store("pdf-2", "v1", [1.0, 0.0], "B")
+    cache.lookup("pdf-1", "v1", [1.0, 0.0])  # "A" becomes most recently used
+    cache.store("pdf-3", "v1", [1.0, 0.0], "C")
+
+    assert cache.lookup("pdf-2", "v1", [1.0, 0.0]) is None
+    assert cache.lookup("pdf-1", "v1", [1.0, 0.0]).answer == "A"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_semantic_cache_invalidate():
+    """Test dropping every answer for a rewritten document."""
+    cache = SemanticCache(threshold=0.9)
+    cache.store("pdf-1", "v1", [1.0, 0.0], "A")
+    cache.store("pdf-2", "v1", [1.0, 0.0], "B")
+    cache.invalidate("pdf-1")
+
+    assert cache.lookup("pdf-1", "v1", [1.0, 0.0]) is None
+    assert cache.lookup("pdf-2", "v1", [1.0, 0.0]).answer == "B"
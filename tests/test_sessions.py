@@ -0,0 +1,54 @@
+import pytest
+from unittest.mock import patch
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from data_models import ChatSession
+from sessions import add_turn, condense_query, question_with_history, prior_chunk_ids, is_follow_up
+
+
+def new_session():
+    return ChatSession(session_id="s1", pdf_id="pdf-1", created=0.0)
+
+
+def test_is_follow_up():
+    """Test detection of questions that refer back to the conversation."""
+    assert is_follow_up("And the torque?")
+    assert is_follow_up("What is its maximum pressure rating?")
+    assert not is_follow_up("What is the maximum pressure of the P-100 pump?")
+
+
+def test_condense_query_only_expands_follow_ups():
+    """Test that follow-ups are searched with the previous question and standalone questions are not."""
+    session = add_turn(new_session(), "How is the P-100 pump installed?", "On a flange.", ["c1"], 1.0)
+
+    assert condense_query(None, "How often is it serviced?") == "How often is it serviced?"
+    assert condense_query(session, "How often is it serviced?") == "How is the P-100 pump installed? How often is it serviced?"
+    assert condense_query(session, "Which gasket material suits steam lines?") == "Which gasket material suits steam lines?"
+    assert prior_chunk_ids(session) == ["c1"]
+
+
+@patch("sessions.SESSION_HISTORY_TURNS", 2)
+def test_add_turn_windows_history_into_summary():
+    """Test that turns beyond the window keep only their question in the summary."""
+    session = new_session()
+    for number in range(4):
+        session = add_turn(session, f"Question {number}?", f"Answer {number}.", [], float(number))
+
+    assert [turn.question for turn in session.turns] == ["Question 2?", "Question 3?"]
+    assert session.summary == "Question 0?; Question 1?"
+
+    prompt = question_with_history(session, "Next?")
+    assert prompt.startswith("Conversation so far:\nEarlier questions: Question 0?; Question 1?")
+    assert "User: Question 3?\nAssistant: Answer 3." in prompt
+    assert "Answer 0." not in prompt
+
+
+@patch("sessions.SESSION_ANSWER_CHARS", 10)
+def test_question_with_history_truncates_long_answers():
+    """Test that earlier answers are shortened in the prompt."""
+    session = add_turn(new_session(), "Q?", "word " * 50, [], 1.0)
+    prompt = question_with_history(session, "Next?")
+    assert "Assistant: word word..." in prompt
+    assert question_with_history(new_session(), "First?") == "First?"
@@ -0,0 +1,48 @@
+import sys
+import os
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from text_chunker import TextChunker, normalize_text
+
+
+def test_normalize_text_keeps_paragraphs():
+    """Test that wrapped lines are joined, blank lines kept as paragraph breaks and noise lines dropped."""
+    raw = "Pump  maintenance\nrequires   calibration.\n12\n\n\n  Safety\tnotes follow.\f\nA\nEnd of page."
+    assert normalize_text(raw) == "Pump maintenance requires calibration.\n\nSafety notes follow.\n\nEnd of page."
+    assert normalize_text(" \n \n") == ""
+
+
+def test_chunks_respect_size_and_offsets():
+    """Test that every chunk fits the size and its offsets point at its text."""
+    text = normalize_text(" ".join(f"Sentence number {i} ends here." for i in range(500)))
+    chunker = TextChunker(chunk_size=200, chunk_overlap=40)
+
+    spans = list(chunker.spans(text))
+
+    assert len(spans) > 1
+    for start, end in spans:
+        assert 0 < end - start <= 200
+        assert text[start:end] == text[start:end].strip()
+    # Chunks end at sentence boundaries and overlap their predecessor
+    assert all(text[end - 1] == "." for _, end in spans[:-1])
+    assert all(next_start < end for (_, end), (next_start, _) in zip(spans, spans[1:]))
+    assert spans[-1][1] == len(text)
+
+
+def test_chunks_prefer_paragraph_breaks():
+    first = "First paragraph sentence. " * 5
+    text = f"{first.strip()}\n\nSecond paragraph starts here and goes on for a while."
+    chunks = TextChunker(chunk_size=170, chunk_overlap=0).split(text)
+    assert chunks[0] == first.strip()
+    assert chunks[1].startswith("Second paragraph")
+
+
+def test_chunks_without_spaces_are_cut_hard():
+    """Test that text without spaces is cut at the size, without overlap that would start mid-word."""
+    assert TextChunker(chunk_size=10, chunk_overlap=2).split("x" * 25) == ["x" * 10, "x" * 10, "x" * 5]
+
+
+def test_chunk_overlap_must_be_smaller_than_size():
+    with pytest.raises(ValueError):
+        TextChunker(chunk_size=100, chunk_overlap=100)
@@ -0,0 +1,105 @@
+import os
+import re
+from typing import Iterator, List, Tuple
+
+# Target chunk length and the characters repeated between neighbouring chunks
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "100"))
+
+PARAGRAPH_BREAK = "\n\n"
+# Sentence ends a chunk may be cut after, and the word gap used when there is none
+SENTENCE_ENDS = (". ", "? ", "! ", ".\n", "?\n", "!\n")
+# Lines of one or two characters are page numbers, bullets or OCR noise
+NOISE_LINE = re.compile(r"\w{1,2}")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Clean extracted page text in one pass over its lines: whitespace inside a
+    line collapses to single spaces, wrapped lines are joined, blank lines
+    become paragraph breaks and one- or two-character lines are dropped.
+    """
+    paragraphs = []
+    lines = []
+    for line in text.splitlines():
+        # str.split() without arguments collapses every kind of whitespace in C
+        words = line.split()
+        if not words:
+            if lines:
+                paragraphs.append(" ".join(lines))
+                lines = []
+            continue
+        if len(words) == 1 and NOISE_LINE.fullmatch(words[0]):
+            continue
+        lines.append(" ".join(words))
+    if lines:
+        paragraphs.append(" ".join(lines))
+    return PARAGRAPH_BREAK.join(paragraphs)
+
+
+class TextChunker:
+    """
+    Split text into chunks of at most chunk_size characters in one left to
+    right scan. Each chunk ends at the last paragraph break in the second half
+    of its window, else the last sentence end or else the last space in its
+    final quarter. The next chunk starts chunk_overlap characters earlier, at
+    a word boundary. Chunks are returned as offsets into the text, so nothing
+    is copied until a chunk is used.
+    """
+    def __init__(self, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP):
+        if not 0 <= chunk_overlap < chunk_size:
+            raise ValueError("chunk_overlap must be smaller than chunk_size")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    def _cut(self, text: str, start: int, end: int) -> int:
+        # A paragraph may end in the second half of the window, a sentence in
+        # its last quarter, so chunks don't get much shorter than chunk_size
+        cut = text.rfind(PARAGRAPH_BREAK, start + self.chunk_size // 2, end)
+        if cut > start:
+            return cut
+        low = start + self.chunk_size * 3 // 4
+        cut = max(text.rfind(mark, low, end + 1) for mark in SENTENCE_ENDS)
+        if cut > start:
+            return cut + 1
+        cut = text.rfind(" ", low, end + 1)
+        if cut > start:
+            return cut
+        return end
+
+    def spans(self, text: str) -> Iterator[Tuple[int, int]]:
+        """
+        Yield the (start, end) offsets of each chunk, without leading or
+        trailing whitespace.
+        """
+        length = len(text)
+        position = 0
+        while position < length:
+            # Skip whitespace between chunks
+            while position < length and text[position].isspace():
+                position += 1
+            if position >= length:
+                return
+            end = position + self.chunk_size
+            if end >= length:
+                end = length
+            else:
+                end = self._cut(text, position, end)
+            stop = end
+            while stop > position and text[stop - 1].isspace():
+                stop -= 1
+            yield position, stop
+            if end >= length:
+                return
+            # Start the next chunk chunk_overlap characters back, at the start of a word
+            next_position = max(end - self.chunk_overlap, position + 1)
+            if self.chunk_overlap and next_position < end:
+                space = text.find(" ", next_position, end)
+                next_position = space + 1 if space != -1 else end
+            position = next_position
+
+    def split(self, text: str) -> List[str]:
+        return [text[start:end] for start, end in self.spans(text)]
+
+
+text_chunker = TextChunker()